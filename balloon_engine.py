@@ -2,6 +2,9 @@ import cv2
 import numpy as np
 from dataclasses import dataclass
 from config import Config
+from occupancy import OccupancyGrid
+from layout_optimizer import LayoutOptimizer
+from instrumentation import traced, tracer
 
 @dataclass
 class Balloon:
@@ -16,7 +19,53 @@ class BalloonEngine:
         self.next_id = 1
         self.img_width = img_width
         self.img_height = img_height
-        self.occupied_map = np.zeros((img_height, img_width), dtype=bool)
+        
+        # Sparse occupancy: placed balloons, and the drawing's own ink
+        r = Config.BALLOON_RADIUS + Config.BALLOON_PADDING
+        self.occupancy = OccupancyGrid(cell_size=2 * r)
+        self.ink = OccupancyGrid(cell_size=2 * r)
+        self.obstacle_boxes = []
+        self.obstacle_lines = []
+    
+    def add_obstacles(self, text_boxes=(), lines=None):
+        """Keep balloons off the drawing's text boxes and lines
+        
+        text_boxes are (x, y, w, h); lines are (x1, y1, x2, y2) segments or
+        HoughLinesP output.
+        """
+        for x, y, w, h in text_boxes:
+            self.ink.add_rect(x, y, x + w, y + h)
+            self.obstacle_boxes.append((x, y, w, h))
+        
+        if lines is not None:
+            for line in np.asarray(lines).reshape(-1, 4):
+                x1, y1, x2, y2 = (float(v) for v in line)
+                self.ink.add_segment(x1, y1, x2, y2, Config.BALLOON_INK_CLEARANCE)
+                self.obstacle_lines.append((x1, y1, x2, y2))
+    
+    @traced('place_balloons')
+    def place_balloons(self, dimensions):
+        """Place balloons for all dimensions of a page
+        
+        Uses the global LayoutOptimizer when Config.LAYOUT_MODE is 'global',
+        otherwise places them one by one with place_balloon.
+        """
+        if Config.LAYOUT_MODE != 'global':
+            return [self.place_balloon(dimension) for dimension in dimensions]
+        
+        optimizer = LayoutOptimizer(
+            self.img_width, self.img_height,
+            self.obstacle_boxes, self.obstacle_lines or None
+        )
+        placed = []
+        for dimension, position in zip(dimensions, optimizer.layout(dimensions)):
+            balloon = Balloon(id=self.next_id, position=position, dimension=dimension)
+            self.balloons.append(balloon)
+            self.next_id += 1
+            self.mark_occupied_area(position)
+            placed.append(balloon)
+        
+        return placed
     
     def place_balloon(self, dimension):
         """Intelligent balloon placement with collision avoidance"""
@@ -79,6 +128,7 @@ class BalloonEngine:
     
     def is_position_available(self, position):
         """Check if position is available"""
+        tracer.count('placement_attempts')
         x, y = position
         r = Config.BALLOON_RADIUS + Config.BALLOON_PADDING
         
@@ -87,68 +137,76 @@ class BalloonEngine:
             y - r < 0 or y + r >= self.img_height):
             return False
         
-        # Check occupied map
-        y_start = max(0, int(y - r))
-        y_end = min(self.img_height, int(y + r))
-        x_start = max(0, int(x - r))
-        x_end = min(self.img_width, int(x + r))
+        # Check other balloons, then the drawing itself
+        if self.occupancy.collides_circle(x, y, r):
+            return False
         
-        return not np.any(self.occupied_map[y_start:y_end, x_start:x_end])
+        return not self.ink.collides_circle(x, y, Config.BALLOON_RADIUS)
     
     def mark_occupied_area(self, position):
         """Mark area around balloon as occupied"""
         x, y = position
         r = Config.BALLOON_RADIUS + Config.BALLOON_PADDING
         
-        y_start = max(0, int(y - r))
-        y_end = min(self.img_height, int(y + r))
-        x_start = max(0, int(x - r))
-        x_end = min(self.img_width, int(x + r))
-        
-        self.occupied_map[y_start:y_end, x_start:x_end] = True
+        self.occupancy.add_circle(x, y, r)
     
-    def draw_balloons(self, img):
-        """Draw balloons on image"""
+    @traced('draw_balloons')
+    def draw_balloons(self, img, origin=(0, 0), scale=1.0):
+        """Draw balloons on image
+        
+        img may be a part of the page whose top-left corner is at origin;
+        balloons outside it are clipped. With a scale, img is the page at
+        scale times the resolution of the balloon coordinates.
+        """
         img_with_balloons = img.copy()
+        origin_x, origin_y = origin
+        
+        def to_image(x, y):
+            return (int(round((x - origin_x) * scale)), int(round((y - origin_y) * scale)))
+        
+        font_scale = 0.8 * scale
+        thickness = max(1, int(round(2 * scale)))
         
         for balloon in self.balloons:
+            position = to_image(*balloon.position)
+            
             # Draw balloon circle
             cv2.circle(
                 img_with_balloons, 
-                balloon.position, 
-                balloon.radius, 
+                position, 
+                int(round(balloon.radius * scale)), 
                 (0, 0, 255),  # Red color
-                2  # Thickness
+                thickness
             )
             
             # Draw balloon ID
             text_size = cv2.getTextSize(
                 str(balloon.id), 
                 cv2.FONT_HERSHEY_SIMPLEX, 
-                0.8,  # Font scale
-                2     # Thickness
+                font_scale,
+                thickness
             )[0]
             
-            text_x = balloon.position[0] - text_size[0] // 2
-            text_y = balloon.position[1] + text_size[1] // 2
+            text_x = position[0] - text_size[0] // 2
+            text_y = position[1] + text_size[1] // 2
             
             cv2.putText(
                 img_with_balloons,
                 str(balloon.id),
                 (text_x, text_y),
                 cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
+                font_scale,
                 (0, 0, 255),
-                2
+                thickness
             )
             
             # Draw line from balloon to dimension text
             text_x, text_y, w, h = balloon.dimension['coords']
-            text_center = (text_x + w // 2, text_y + h // 2)
+            text_center = to_image(text_x + w // 2, text_y + h // 2)
             
             cv2.line(
                 img_with_balloons,
-                balloon.position,
+                position,
                 text_center,
                 (0, 255, 0),  # Green color
                 1
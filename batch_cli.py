@@ -0,0 +1,260 @@
+"""Headless batch ballooning of whole directories of drawings
+
+Usage:
+    python batch_cli.py drawings/ more/drawing.pdf -o outputs/batch -j 8
+
+Every document gets its own output folder. Progress is recorded in a state
+file in the output folder, so an interrupted run picks up where it stopped
+when started again with the same output folder.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+from PIL import Image
+from config import Config
+from pipeline import PagePipeline
+from cmm_exporter import CMMExporter
+from drawing_standards import detected_standard
+from result_cache import ResultCache
+
+STATE_FILE = 'batch_state.json'
+SUMMARY_FILE = 'batch_summary.json'
+EXPORT_FORMATS = ['png', 'xlsx', 'csv', 'pdf', 'cmm', 'qif', 'overlay']
+
+def find_documents(inputs, recursive=False):
+    """Expand files and directories into a sorted list of PDF paths"""
+    documents = []
+    for path in inputs:
+        if os.path.isdir(path):
+            if recursive:
+                for root, _, files in os.walk(path):
+                    documents.extend(
+                        os.path.join(root, name) for name in files
+                        if name.lower().endswith('.pdf')
+                    )
+            else:
+                documents.extend(
+                    os.path.join(path, name) for name in os.listdir(path)
+                    if name.lower().endswith('.pdf')
+                )
+        elif os.path.isfile(path):
+            documents.append(path)
+        else:
+            raise FileNotFoundError(path)
+    return sorted(set(os.path.abspath(doc) for doc in documents))
+
+def document_key(pdf_path, standard, coarse_to_fine=False, formats=EXPORT_FORMATS):
+    """Identity of a document run: its content, the drawing standard, mode and outputs"""
+    mode = '|coarse' if coarse_to_fine else ''
+    outputs = ','.join(sorted(set(formats)))
+    return hashlib.sha256(
+        f"{ResultCache.hash_file(pdf_path)}|{standard}{mode}|{outputs}".encode()
+    ).hexdigest()
+
+def document_folder(output_dir, pdf_path, key):
+    """Per-document output folder; the hash keeps same-named files apart"""
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+    return os.path.join(output_dir, f"{stem}-{key[:8]}")
+
+def _init_worker():
+    """Documents run in parallel, so each one uses a single core"""
+    cv2.setNumThreads(1)
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+def process_document(pdf_path, key, output_dir, standard, formats, coarse_to_fine=False):
+    """Balloon one document and write its outputs; runs in a pool worker"""
+    start = time.perf_counter()
+    folder = document_folder(output_dir, pdf_path, key)
+    os.makedirs(folder, exist_ok=True)
+    # Page images with balloons are only drawn when PNGs are requested, and
+    # nobody looks at previews here. Documents already keep every core busy:
+    # one OCR thread per document
+    pipeline = PagePipeline(
+        standard, workers=1, raster_balloons='png' in formats, preview_pyramid=False,
+        coarse_to_fine=coarse_to_fine, ocr_workers=1
+    )
+    balloons = []
+    dimension_count = 0
+    page_count = 0
+    outputs = []
+    try:
+        for result in pipeline.run(pdf_path):
+            page_count += 1
+            dimension_count += len(result.dimensions)
+            balloons.extend(result.balloons)
+            
+            if 'png' not in formats:
+                continue
+            page_path = os.path.join(folder, f"page_{result.page_num+1}_ballooned.png")
+            if result.scale != 1:
+                # Coarse to fine images are at a lower resolution: say which
+                dpi = Config.DPI * result.scale
+                Image.fromarray(result.load('ballooned')).save(page_path, dpi=(dpi, dpi))
+            elif 'ballooned' in result.image_files:
+                shutil.copyfile(result.image_files['ballooned'], page_path)
+            else:
+                cv2.imwrite(page_path, cv2.cvtColor(result.load('ballooned'), cv2.COLOR_RGB2BGR))
+            outputs.append(page_path)
+    finally:
+        pipeline.close()
+    
+    if standard == 'AUTO':
+        standard = detected_standard([balloon.dimension for balloon in balloons])
+    exporter = CMMExporter(balloons, standard, output_dir=folder)
+    if 'xlsx' in formats:
+        outputs.append(exporter.to_excel())
+    if 'csv' in formats:
+        outputs.append(exporter.to_csv())
+    if 'pdf' in formats:
+        outputs.append(exporter.to_pdf_report(pdf_path))
+    if 'cmm' in formats:
+        outputs.append(exporter.to_cmm_text())
+    if 'qif' in formats:
+        outputs.append(exporter.to_qif())
+    if 'overlay' in formats:
+        outputs.append(exporter.to_ballooned_pdf(pdf_path))
+    
+    return {
+        'status': 'done',
+        'path': pdf_path,
+        'folder': folder,
+        'pages': page_count,
+        'dimensions': dimension_count,
+        'seconds': time.perf_counter() - start,
+        'outputs': outputs
+    }
+
+def load_state(output_dir):
+    """Results of previous runs into this output folder"""
+    path = os.path.join(output_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_json(output_dir, name, data):
+    """Write JSON atomically so a crash never leaves a truncated file"""
+    path = os.path.join(output_dir, name)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def run_batch(documents, output_dir, standard='ASME_Y14.5', workers=None,
+              formats=EXPORT_FORMATS, resume=True, coarse_to_fine=False):
+    """Process documents concurrently and return the run summary"""
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    state = load_state(output_dir) if resume else {}
+    
+    todo = []
+    skipped = 0
+    done, failed = [], []
+    for pdf_path in documents:
+        try:
+            key = document_key(pdf_path, standard, coarse_to_fine, formats)
+        except OSError as e:
+            # Unreadable, so it has no key to record in the state file
+            failed.append({'status': 'failed', 'path': pdf_path, 'error': repr(e)})
+            print(f"[failed] {pdf_path}: {e!r}", file=sys.stderr)
+            continue
+        if state.get(key, {}).get('status') == 'done':
+            skipped += 1
+        else:
+            todo.append((pdf_path, key))
+    
+    workers = min(workers or Config.PIPELINE_WORKERS, max(len(todo), 1))
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=_init_worker
+    ) as pool:
+        futures = {
+            pool.submit(
+                process_document, pdf_path, key, output_dir, standard, formats, coarse_to_fine
+            ):
+            (pdf_path, key)
+            for pdf_path, key in todo
+        }
+        for future in as_completed(futures):
+            pdf_path, key = futures[future]
+            try:
+                record = future.result()
+                done.append(record)
+                print(f"[done] {pdf_path}: {record['pages']} pages, "
+                      f"{record['dimensions']} dimensions in {record['seconds']:.1f}s")
+            except Exception as e:
+                record = {'status': 'failed', 'path': pdf_path, 'error': repr(e)}
+                failed.append(record)
+                print(f"[failed] {pdf_path}: {e!r}", file=sys.stderr)
+            
+            # Persist after every document so a crash loses at most the
+            # documents that were still in progress
+            state[key] = record
+            save_json(output_dir, STATE_FILE, state)
+    
+    elapsed = time.perf_counter() - start
+    pages = sum(record['pages'] for record in done)
+    summary = {
+        'documents': len(documents),
+        'processed': len(done),
+        'skipped': skipped,
+        'failed': len(failed),
+        'pages': pages,
+        'dimensions': sum(record['dimensions'] for record in done),
+        'workers': workers,
+        'seconds': elapsed,
+        'pages_per_second': pages / elapsed if elapsed > 0 else 0.0,
+        'documents_per_second': len(done) / elapsed if elapsed > 0 else 0.0,
+        'failures': [{'path': r['path'], 'error': r['error']} for r in failed]
+    }
+    save_json(output_dir, SUMMARY_FILE, summary)
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Balloon engineering drawings in batch, without the web UI"
+    )
+    parser.add_argument('inputs', nargs='+', help="PDF files or directories of PDFs")
+    parser.add_argument('-o', '--output-dir',
+                        default=os.path.join(Config.OUTPUT_FOLDER, 'batch'),
+                        help="Folder for per-document outputs and the run state")
+    parser.add_argument('-s', '--standard', default='ASME_Y14.5',
+                        choices=['AUTO'] + Config.SUPPORTED_STANDARDS)
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Documents processed in parallel (default: CPU count)")
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help="Search directories recursively")
+    parser.add_argument('--formats', default=','.join(EXPORT_FORMATS),
+                        help="Comma-separated outputs (png,xlsx,csv,pdf,cmm,qif,overlay)")
+    parser.add_argument('--no-resume', action='store_true',
+                        help="Reprocess documents already done in the output folder")
+    parser.add_argument('--coarse-to-fine', action='store_true',
+                        help="Analyse pages at Config.ANALYSIS_DPI and OCR only text "
+                             "regions at full resolution; PNGs are at the lower DPI")
+    args = parser.parse_args(argv)
+    
+    formats = [fmt.strip() for fmt in args.formats.split(',') if fmt.strip()]
+    unknown = set(formats) - set(EXPORT_FORMATS)
+    if unknown:
+        parser.error(f"unknown formats: {', '.join(sorted(unknown))}")
+    
+    documents = find_documents(args.inputs, args.recursive)
+    summary = run_batch(
+        documents, args.output_dir, args.standard, args.workers,
+        formats, resume=not args.no_resume, coarse_to_fine=args.coarse_to_fine
+    )
+    
+    print(f"{summary['processed']} processed, {summary['skipped']} skipped, "
+          f"{summary['failed']} failed; {summary['pages']} pages in "
+          f"{summary['seconds']:.1f}s ({summary['pages_per_second']:.2f} pages/s)")
+    return 1 if summary['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
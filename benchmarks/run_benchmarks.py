@@ -0,0 +1,267 @@
+"""Per-stage benchmark of the ballooning pipeline on synthetic drawings
+
+Usage:
+    python benchmarks/run_benchmarks.py                  # compare with baseline
+    python benchmarks/run_benchmarks.py --save-baseline  # record a new baseline
+    python benchmarks/run_benchmarks.py --full --threshold 0.15
+
+Each case is a generated drawing (sheet size, dimension density, tolerance
+style, vector or raster). Every stage is timed separately (best of
+--repeat runs) and its peak traced memory recorded in an extra run. The
+run fails when a stage is slower, or uses more memory, than the stored
+baseline by more than the threshold.
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz
+import pytesseract
+from config import Config
+from pdf_processor import PDFProcessor
+from dimension_detector import DimensionDetector
+from balloon_engine import BalloonEngine
+from cmm_exporter import CMMExporter
+from synthetic_drawings import generate_drawing
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Differences below these are noise, whatever the relative change
+MIN_SECONDS_DELTA = 0.005
+MIN_MEMORY_DELTA_MB = 1.0
+
+QUICK_MATRIX = {
+    'sheet': ['A4', 'A2'],
+    'density': [20, 100],
+    'standard': ['ASME_Y14.5', 'ISO_1101'],
+    'raster': [False, True]
+}
+FULL_MATRIX = {
+    'sheet': ['A4', 'A3', 'A2', 'A1', 'A0'],
+    'density': [10, 50, 200],
+    'standard': Config.SUPPORTED_STANDARDS,
+    'raster': [False, True]
+}
+
+def tesseract_available():
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+def case_name(case):
+    kind = 'raster' if case['raster'] else 'vector'
+    return f"{case['sheet']}-{case['density']}-{case['standard']}-{kind}"
+
+def build_stages(pdf_path, case, workdir, can_ocr):
+    """Ordered (name, function) pairs; each function updates a shared state"""
+    processor = PDFProcessor()
+    detector = DimensionDetector(case['standard'])
+    
+    def pdf_to_images(state):
+        state['images'] = processor.pdf_to_images(pdf_path)
+    
+    def extract_text_layer(state):
+        state['text_layers'] = processor.extract_text_layer(pdf_path)
+    
+    def extract_geometry(state):
+        with fitz.open(pdf_path) as doc:
+            state['geometry'] = [
+                processor.get_page_geometry(page, Config.DPI / 72) for page in doc
+            ]
+    
+    def preprocess_image(state):
+        state['processed'] = [processor.preprocess_image(img) for img in state['images']]
+    
+    def detect_lines(state):
+        state['lines'] = [
+            detector.detect_lines(img, geometry)
+            for img, geometry in zip(state['processed'], state['geometry'])
+        ]
+    
+    def detect_dimensions(state):
+        # No line segments here: association is timed as its own stage
+        state['dimensions'] = [
+            detector.detect_dimensions(img, page_num, text_layer, line_segments=[])
+            for page_num, (img, text_layer) in
+            enumerate(zip(state['processed'], state['text_layers']))
+        ]
+    
+    def find_associated_lines(state):
+        for dimensions, lines in zip(state['dimensions'], state['lines']):
+            detector.associate_lines(dimensions, lines)
+    
+    def place_balloon(state):
+        state['balloons'] = []
+        for img, dimensions, lines in zip(state['processed'], state['dimensions'], state['lines']):
+            engine = BalloonEngine(img.shape[1], img.shape[0])
+            engine.add_obstacles([dim['coords'] for dim in dimensions], lines)
+            engine.place_balloons(dimensions)
+            state['balloons'].extend(engine.balloons)
+    
+    def exporter(state):
+        return CMMExporter(state['balloons'], case['standard'], output_dir=workdir)
+    
+    stages = [
+        ('pdf_to_images', pdf_to_images),
+        ('extract_text_layer', extract_text_layer),
+        ('extract_geometry', extract_geometry),
+        ('preprocess_image', preprocess_image),
+        ('detect_lines', detect_lines),
+        ('detect_dimensions', detect_dimensions),
+        ('find_associated_lines', find_associated_lines),
+        ('place_balloon', place_balloon),
+        ('to_excel', lambda state: exporter(state).to_excel()),
+        ('to_csv', lambda state: exporter(state).to_csv()),
+        ('to_pdf_report', lambda state: exporter(state).to_pdf_report(pdf_path)),
+        ('to_cmm_text', lambda state: exporter(state).to_cmm_text()),
+        ('to_qif', lambda state: exporter(state).to_qif()),
+        ('to_ballooned_pdf', lambda state: exporter(state).to_ballooned_pdf(pdf_path))
+    ]
+    # Raster pages can only be read with OCR
+    if case['raster'] and not can_ocr:
+        stages = stages[:stages.index(('detect_dimensions', detect_dimensions))]
+    return stages
+
+def run_case(case, repeat, workdir, can_ocr):
+    """Benchmark one case; returns {stage: {'seconds', 'peak_mb'}} plus recall"""
+    pdf_path = os.path.join(workdir, f"{case_name(case)}.pdf")
+    truth = generate_drawing(
+        pdf_path, case['sheet'], case['density'], case['standard'], case['raster']
+    )
+    stages = build_stages(pdf_path, case, workdir, can_ocr)
+    
+    timings = {name: float('inf') for name, _ in stages}
+    state = {}
+    for _ in range(repeat):
+        state = {}
+        for name, stage in stages:
+            start = time.perf_counter()
+            stage(state)
+            timings[name] = min(timings[name], time.perf_counter() - start)
+    
+    # Separate pass for memory: tracing slows everything down
+    peaks = {}
+    traced = {}
+    tracemalloc.start()
+    try:
+        for name, stage in stages:
+            tracemalloc.reset_peak()
+            stage(traced)
+            peaks[name] = tracemalloc.get_traced_memory()[1] / 1024**2
+    finally:
+        tracemalloc.stop()
+    
+    result = {
+        'stages': {
+            name: {'seconds': timings[name], 'peak_mb': peaks[name]}
+            for name, _ in stages
+        }
+    }
+    if 'dimensions' in state:
+        found = {dim['text'] for page in state['dimensions'] for dim in page}
+        result['recall'] = sum(item['text'] in found for item in truth) / max(len(truth), 1)
+    return result
+
+def compare(results, baseline, threshold):
+    """List of human-readable regressions against the baseline"""
+    regressions = []
+    for name, result in results.items():
+        base_case = baseline.get(name)
+        if base_case is None:
+            continue
+        for stage, current in result['stages'].items():
+            base = base_case['stages'].get(stage)
+            if base is None:
+                continue
+            if (current['seconds'] > base['seconds'] * (1 + threshold) and
+                    current['seconds'] - base['seconds'] > MIN_SECONDS_DELTA):
+                regressions.append(
+                    f"{name} {stage}: {current['seconds']:.4f}s vs {base['seconds']:.4f}s"
+                )
+            if (current['peak_mb'] > base['peak_mb'] * (1 + threshold) and
+                    current['peak_mb'] - base['peak_mb'] > MIN_MEMORY_DELTA_MB):
+                regressions.append(
+                    f"{name} {stage}: {current['peak_mb']:.1f} MB vs {base['peak_mb']:.1f} MB peak"
+                )
+    return regressions
+
+def print_table(results):
+    stages = []
+    for result in results.values():
+        stages.extend(stage for stage in result['stages'] if stage not in stages)
+    print(f"{'case':38}" + ''.join(f"{stage[:12]:>13}" for stage in stages) + f"{'recall':>8}")
+    for name, result in results.items():
+        row = f"{name:38}"
+        for stage in stages:
+            value = result['stages'].get(stage)
+            row += f"{value['seconds'] * 1000:>11.1f}ms" if value else f"{'-':>13}"
+        recall = result.get('recall')
+        row += f"{recall:>8.2f}" if recall is not None else f"{'-':>8}"
+        print(row)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ballooning pipeline")
+    parser.add_argument('--full', action='store_true', help="Run the full case matrix")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per case (best is kept)")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="Allowed relative slowdown per stage before failing")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Store these results as the new baseline")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+    
+    matrix = FULL_MATRIX if args.full else QUICK_MATRIX
+    cases = [dict(zip(matrix, values)) for values in itertools.product(*matrix.values())]
+    can_ocr = tesseract_available()
+    if not can_ocr:
+        print("tesseract not found: OCR stages of raster cases are skipped")
+    
+    # Keep the processors' folders out of the working tree
+    workdir = tempfile.mkdtemp(prefix='balloon_bench_')
+    Config.UPLOAD_FOLDER = os.path.join(workdir, 'uploads')
+    Config.OUTPUT_FOLDER = os.path.join(workdir, 'outputs')
+    Config.TEMP_FOLDER = os.path.join(workdir, 'temp')
+    try:
+        results = {}
+        for case in cases:
+            results[case_name(case)] = run_case(case, args.repeat, workdir, can_ocr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline first")
+        return 0
+    
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No stage regressed by more than {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
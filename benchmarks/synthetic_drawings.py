@@ -0,0 +1,97 @@
+"""Synthetic engineering-drawing PDFs with known dimensions for benchmarks"""
+import random
+import fitz  # PyMuPDF
+
+# Landscape sheet sizes in PDF points
+SHEETS = {
+    'A4': (842, 595),
+    'A3': (1191, 842),
+    'A2': (1684, 1191),
+    'A1': (2384, 1684),
+    'A0': (3370, 2384)
+}
+
+def format_dimension(value, upper, lower, standard):
+    """Dimension text in the tolerance style of a DrawingStandards pattern"""
+    if standard == 'ISO_1101':
+        return f"{value:.2f} +{upper:.2f}/-{lower:.2f}"
+    if standard == 'DIN_406':
+        return f"{value:.2f} (+{upper:.2f}/-{lower:.2f})"
+    if standard == 'JIS_B_0021':
+        return f"{value:.2f}+{upper:.2f}"
+    return f"{value:.2f} ±{upper:.2f}"
+
+def generate_drawing(path, sheet='A3', dimensions=50, standard='ASME_Y14.5',
+                     raster=False, pages=1, seed=0):
+    """Write a synthetic drawing to path and return its ground truth
+    
+    Each page has a border, a title block, some part geometry and the given
+    number of dimensions, each with a dimension line and extension lines.
+    With raster=True every page is flattened to an image, so there is no
+    text layer and the OCR path is exercised.
+    
+    Returns a list of {'page', 'text', 'rect'} dicts in PDF points.
+    """
+    rng = random.Random(seed)
+    width, height = SHEETS[sheet]
+    doc = fitz.open()
+    truth = []
+    
+    for page_num in range(pages):
+        page = doc.new_page(width=width, height=height)
+        shape = page.new_shape()
+        
+        # Border and title block
+        shape.draw_rect(fitz.Rect(20, 20, width - 20, height - 20))
+        title = fitz.Rect(width - 260, height - 90, width - 20, height - 20)
+        shape.draw_rect(title)
+        shape.finish(color=(0, 0, 0), width=1.2)
+        
+        # Part outline geometry
+        for _ in range(max(4, dimensions // 5)):
+            x = rng.uniform(60, width - 300)
+            y = rng.uniform(60, height - 150)
+            shape.draw_rect(fitz.Rect(x, y, x + rng.uniform(40, 200), y + rng.uniform(30, 150)))
+        shape.finish(color=(0, 0, 0), width=0.8)
+        
+        # Dimensions on a jittered grid so the text does not collide
+        columns = max(1, int((width - 320) // 150))
+        rows = max(1, (dimensions + columns - 1) // columns)
+        row_height = (height - 200) / rows
+        for i in range(dimensions):
+            col, row = i % columns, i // columns
+            x = 60 + col * 150 + rng.uniform(0, 20)
+            y = 80 + row * row_height + rng.uniform(0, max(row_height - 30, 0))
+            value = rng.uniform(1, 500)
+            text = format_dimension(value, rng.choice([0.05, 0.1, 0.2]),
+                                    rng.choice([0.05, 0.1, 0.2]), standard)
+            
+            length = rng.uniform(60, 120)
+            shape.draw_line((x, y + 4), (x + length, y + 4))
+            shape.draw_line((x, y - 10), (x, y + 10))
+            shape.draw_line((x + length, y - 10), (x + length, y + 10))
+            page.insert_text((x + 5, y), text, fontsize=7)
+            rect = fitz.Rect(x + 5, y - 7, x + 5 + fitz.get_text_length(text, fontsize=7), y + 2)
+            truth.append({'page': page_num, 'text': text, 'rect': tuple(rect)})
+        shape.finish(color=(0, 0, 0), width=0.5)
+        
+        page.insert_text((title.x0 + 10, title.y0 + 20), f"DWG NO. BENCH-{seed:04d}", fontsize=9)
+        page.insert_text((title.x0 + 10, title.y0 + 40), f"SHEET {page_num + 1} OF {pages}", fontsize=9)
+        shape.commit()
+    
+    if raster:
+        doc = _flatten(doc)
+    
+    doc.save(path)
+    doc.close()
+    return truth
+
+def _flatten(doc, dpi=200):
+    """Replace every page by a scanned-looking image of itself"""
+    flat = fitz.open()
+    for page in doc:
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        new_page = flat.new_page(width=page.rect.width, height=page.rect.height)
+        new_page.insert_image(new_page.rect, pixmap=pix)
+    doc.close()
+    return flat
@@ -1,53 +1,317 @@
-import pandas as pd
-from fpdf import FPDF
+import csv
 import os
+import re
+import uuid
+import zipfile
+from xml.sax.saxutils import escape
+import fitz  # PyMuPDF
+from fpdf import FPDF
 from config import Config
 from drawing_standards import DrawingStandards
+from instrumentation import traced, tracer
+
+# Fixed parts of a single-sheet XLSX workbook
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    )
+}
+XLSX_SHEET_HEAD = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+XLSX_SHEET_TAIL = b'</sheetData></worksheet>'
+
+class BalloonTable:
+    """Balloon data in columns, built once and shared by every export format
+    
+    Besides the report columns it holds each dimension's nominal value and
+    its upper and lower tolerance as numbers, as CMM software expects them.
+    """
+    COLUMNS = ['Balloon ID', 'Dimension', 'Value', 'Tolerance', 'Page']
+    
+    def __init__(self, balloons):
+        self.columns = {name: [] for name in self.COLUMNS}
+        self.nominal = []
+        self.upper = []
+        self.lower = []
+        
+        for balloon in balloons:
+            dim = balloon.dimension
+            tolerance = dim.get('tolerance') or ''
+            self.columns['Balloon ID'].append(balloon.id)
+            self.columns['Dimension'].append(dim['text'])
+            self.columns['Value'].append(dim['value'])
+            self.columns['Tolerance'].append(tolerance)
+            self.columns['Page'].append(dim['page'] + 1)
+            
+            upper, lower = self.parse_tolerance(tolerance)
+            self.nominal.append(float(dim['value']))
+            self.upper.append(upper)
+            self.lower.append(lower)
+    
+    def __len__(self):
+        return len(self.columns['Balloon ID'])
+    
+    def rows(self, columns=None):
+        """Iterate rows as tuples of the given (default: all report) columns"""
+        return zip(*(self.columns[name] for name in columns or self.COLUMNS))
+    
+    @staticmethod
+    def parse_tolerance(tolerance):
+        """(upper, lower) deviations of a tolerance string
+        
+        Handles every standard's style: "±0.1", "+0.1", "-0.1",
+        "+0.1/-0.2" and "(+0.1/-0.2)". A one-sided tolerance leaves the
+        other side at 0.
+        """
+        text = re.sub(r'[\s()]', '', tolerance or '')
+        if not text:
+            return 0.0, 0.0
+        if text.startswith('±'):
+            value = float(text[1:])
+            return value, -value
+        
+        upper, lower = 0.0, 0.0
+        for part in text.split('/'):
+            value = float(part)
+            if part.startswith('-'):
+                lower = value
+            else:
+                upper = value
+        return upper, lower
 
 class CMMExporter:
-    def __init__(self, balloons, standard='ASME_Y14.5'):
+    def __init__(self, balloons, standard='ASME_Y14.5', output_dir=None,
+                 basename='balloon_report', session_id=None):
         self.balloons = balloons
         self.standard = DrawingStandards(standard)
+        # Every session writes to its own folder so they never overwrite each other
+        self.output_dir = output_dir or os.path.join(
+            Config.OUTPUT_FOLDER, session_id or uuid.uuid4().hex
+        )
+        self.basename = basename
+        self.table = BalloonTable(balloons)
+    
+    def _output_path(self, extension):
+        """Path of a report file for this export"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, f"{self.basename}.{extension}")
     
+    @staticmethod
+    def _replace(tmp_path, path):
+        """Publish a finished file; readers never see a partial report"""
+        os.replace(tmp_path, path)
+        return path
+    
+    @traced('export_excel')
     def to_excel(self):
-        """Export balloon data to Excel format"""
-        data = []
-        for balloon in self.balloons:
-            dim = balloon.dimension
-            data.append({
-                'Balloon ID': balloon.id,
-                'Dimension': dim['text'],
-                'Value': dim['value'],
-                'Tolerance': dim.get('tolerance', ''),
-                'Page': dim['page'] + 1
-            })
-        
-        df = pd.DataFrame(data)
-        excel_path = os.path.join(Config.OUTPUT_FOLDER, 'balloon_report.xlsx')
-        df.to_excel(excel_path, index=False)
-        return excel_path
+        """Export balloon data to Excel format
+        
+        The workbook is streamed row by row into the XLSX zip container.
+        """
+        tracer.count('rows', len(self.table))
+        excel_path = self._output_path('xlsx')
+        tmp_path = f"{excel_path}.tmp"
+        
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as xlsx:
+            for name, content in XLSX_PARTS.items():
+                xlsx.writestr(name, content)
+            with xlsx.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+                sheet.write(XLSX_SHEET_HEAD)
+                sheet.write(self._xlsx_row(1, BalloonTable.COLUMNS))
+                for row_num, row in enumerate(self.table.rows(), start=2):
+                    sheet.write(self._xlsx_row(row_num, row))
+                sheet.write(XLSX_SHEET_TAIL)
+        
+        return self._replace(tmp_path, excel_path)
+    
+    @staticmethod
+    def _xlsx_row(row_num, values):
+        """One worksheet <row>; ints become numbers, the rest inline strings"""
+        cells = []
+        for col, value in enumerate(values):
+            ref = f"{chr(ord('A') + col)}{row_num}"
+            if isinstance(value, int):
+                cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+            elif value != '':
+                cells.append(
+                    f'<c r="{ref}" t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+                )
+        return f'<row r="{row_num}">{"".join(cells)}</row>'.encode('utf-8')
     
+    @traced('export_csv')
     def to_csv(self):
         """Export balloon data to CSV format"""
-        data = []
+        tracer.count('rows', len(self.table))
+        csv_path = self._output_path('csv')
+        tmp_path = f"{csv_path}.tmp"
+        
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(BalloonTable.COLUMNS)
+            writer.writerows(self.table.rows())
+        
+        return self._replace(tmp_path, csv_path)
+    
+    @traced('export_cmm')
+    def to_cmm_text(self):
+        """Export a tab-delimited characteristic list for CMM programming
+        
+        One row per balloon with numeric nominal, upper and lower tolerance,
+        the layout CMM software imports as a generic characteristic table.
+        """
+        tracer.count('rows', len(self.table))
+        txt_path = self._output_path('txt')
+        tmp_path = f"{txt_path}.tmp"
+        
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, delimiter='\t')
+            writer.writerow(['Characteristic', 'Nominal', 'Upper Tol', 'Lower Tol', 'Page'])
+            for balloon_id, nominal, upper, lower, page in zip(
+                self.table.columns['Balloon ID'], self.table.nominal,
+                self.table.upper, self.table.lower, self.table.columns['Page']
+            ):
+                writer.writerow([balloon_id, f"{nominal:g}", f"{upper:+g}", f"{lower:+g}", page])
+        
+        return self._replace(tmp_path, txt_path)
+    
+    @traced('export_qif')
+    def to_qif(self):
+        """Export the characteristics as a simplified QIF 3.0 document
+        
+        Each balloon becomes a linear characteristic definition (tolerance),
+        nominal (target value) and item (balloon number).
+        """
+        count = len(self.table)
+        tracer.count('rows', count)
+        qif_path = self._output_path('qif')
+        tmp_path = f"{qif_path}.tmp"
+        
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            f.write(f'<QIFDocument xmlns="http://qifstandards.org/xsd/qif3" '
+                    f'versionQIF="3.0.0" idMax="{3 * count}">\n')
+            f.write(f'  <Characteristics>\n    <CharacteristicDefinitions n="{count}">\n')
+            for i, (upper, lower) in enumerate(zip(self.table.upper, self.table.lower)):
+                f.write(f'      <LinearCharacteristicDefinition id="{i + 1}"><Tolerance>'
+                        f'<MaxValue>{upper:g}</MaxValue><MinValue>{lower:g}</MinValue>'
+                        f'</Tolerance></LinearCharacteristicDefinition>\n')
+            f.write(f'    </CharacteristicDefinitions>\n    <CharacteristicNominals n="{count}">\n')
+            for i, nominal in enumerate(self.table.nominal):
+                f.write(f'      <LinearCharacteristicNominal id="{count + i + 1}">'
+                        f'<CharacteristicDefinitionId>{i + 1}</CharacteristicDefinitionId>'
+                        f'<TargetValue>{nominal:g}</TargetValue></LinearCharacteristicNominal>\n')
+            f.write(f'    </CharacteristicNominals>\n    <CharacteristicItems n="{count}">\n')
+            for i, (balloon_id, text) in enumerate(zip(
+                self.table.columns['Balloon ID'], self.table.columns['Dimension']
+            )):
+                f.write(f'      <LinearCharacteristicItem id="{2 * count + i + 1}">'
+                        f'<Name>{escape(text)}</Name>'
+                        f'<CharacteristicDesignator><Designator>{balloon_id}</Designator>'
+                        f'</CharacteristicDesignator>'
+                        f'<CharacteristicNominalId>{count + i + 1}</CharacteristicNominalId>'
+                        f'</LinearCharacteristicItem>\n')
+            f.write('    </CharacteristicItems>\n  </Characteristics>\n</QIFDocument>\n')
+        
+        return self._replace(tmp_path, qif_path)
+    
+    @traced('export_overlay')
+    def to_ballooned_pdf(self, original_pdf_path):
+        """Write the original PDF with balloons drawn on it as vector graphics
+        
+        Balloons, IDs and leaders are added to the page content in PDF
+        points, so the drawing keeps its vector quality and no page image is
+        rendered or embedded.
+        """
+        by_page = {}
         for balloon in self.balloons:
-            dim = balloon.dimension
-            data.append({
-                'Balloon ID': balloon.id,
-                'Dimension': dim['text'],
-                'Value': dim['value'],
-                'Tolerance': dim.get('tolerance', ''),
-                'Page': dim['page'] + 1
-            })
-        
-        df = pd.DataFrame(data)
-        csv_path = os.path.join(Config.OUTPUT_FOLDER, 'balloon_report.csv')
-        df.to_csv(csv_path, index=False)
-        return csv_path
+            by_page.setdefault(balloon.dimension['page'], []).append(balloon)
+        tracer.count('rows', len(self.balloons))
+        
+        pdf_path = self._output_path('ballooned.pdf')
+        tmp_path = f"{pdf_path}.tmp"
+        with fitz.open(original_pdf_path) as doc:
+            for page_num, balloons in by_page.items():
+                self._overlay_page(doc[page_num], balloons)
+            doc.save(tmp_path, garbage=3, deflate=True)
+        return self._replace(tmp_path, pdf_path)
+    
+    @staticmethod
+    def _overlay_page(page, balloons):
+        """Draw balloons given in page-image pixels onto a PDF page
+        
+        The page image was rendered at Config.DPI with the page rotation
+        applied, so pixels map back to unrotated PDF points through the
+        inverse of that transformation.
+        """
+        zoom = Config.DPI / 72
+        to_page = ~(page.rotation_matrix * fitz.Matrix(zoom, zoom))
+        radius = Config.BALLOON_RADIUS / zoom
+        fontsize = radius
+        red, green = (1, 0, 0), (0, 0.6, 0)
+        
+        shape = page.new_shape()
+        for balloon in balloons:
+            center = fitz.Point(balloon.position) * to_page
+            x, y, w, h = balloon.dimension['coords']
+            anchor = fitz.Point(x + w / 2, y + h / 2) * to_page
+            
+            # Leader from the balloon's edge to the dimension text
+            offset = anchor - center
+            if abs(offset) > radius:
+                shape.draw_line(center + offset / abs(offset) * radius, anchor)
+                shape.finish(color=green, width=0.3)
+            
+            shape.draw_circle(center, radius)
+            shape.finish(color=red, fill=(1, 1, 1), width=0.5)
+            
+            # ID centered in the balloon, upright in the displayed page
+            label = str(balloon.id)
+            half_width = fitz.get_text_length(label, fontsize=fontsize) / 2
+            baseline = fitz.Point(
+                balloon.position[0] - half_width * zoom,
+                balloon.position[1] + 0.35 * fontsize * zoom
+            ) * to_page
+            shape.insert_text(
+                baseline, label, fontsize=fontsize, color=red, rotate=page.rotation
+            )
+        shape.commit()
     
+    @traced('export_pdf')
     def to_pdf_report(self, original_pdf_path):
-        """Generate PDF report with ballooned drawings"""
+        """Generate PDF report with ballooned drawings
+        
+        The balloon table is laid out page by page with the header repeated
+        on each page, so thousands of characteristics stay readable.
+        """
         pdf = FPDF()
+        pdf.set_auto_page_break(False)
         
         # Add cover page
         pdf.add_page()
@@ -59,22 +323,26 @@ class CMMExporter:
         pdf.set_font("Arial", size=12)
         col_widths = [20, 30, 50, 30, 20]
         headers = ['ID', 'Value', 'Tolerance', 'Page', 'Notes']
+        row_height = 10
+        bottom = pdf.h - pdf.b_margin
         
-        # Table header
-        for i, header in enumerate(headers):
-            pdf.cell(col_widths[i], 10, header, 1, 0, 'C')
-        pdf.ln()
+        def table_header():
+            for i, header in enumerate(headers):
+                pdf.cell(col_widths[i], row_height, header, 1, 0, 'C')
+            pdf.ln()
         
-        # Table rows
-        for balloon in self.balloons:
-            dim = balloon.dimension
-            pdf.cell(col_widths[0], 10, str(balloon.id), 1, 0, 'C')
-            pdf.cell(col_widths[1], 10, str(dim['value']), 1, 0, 'C')
-            pdf.cell(col_widths[2], 10, str(dim.get('tolerance', '')), 1, 0, 'C')
-            pdf.cell(col_widths[3], 10, str(dim['page'] + 1), 1, 0, 'C')
-            pdf.cell(col_widths[4], 10, '', 1, 1, 'C')
+        table_header()
+        for row in self.table.rows(['Balloon ID', 'Value', 'Tolerance', 'Page']):
+            if pdf.get_y() + row_height > bottom:
+                pdf.add_page()
+                table_header()
+            for width, value in zip(col_widths, row):
+                pdf.cell(width, row_height, str(value), 1, 0, 'C')
+            pdf.cell(col_widths[4], row_height, '', 1, 1, 'C')
+        tracer.count('rows', len(self.table))
         
         # Save PDF
-        pdf_path = os.path.join(Config.OUTPUT_FOLDER, 'balloon_report.pdf')
-        pdf.output(pdf_path)
-        return pdf_path
+        pdf_path = self._output_path('pdf')
+        tmp_path = f"{pdf_path}.tmp"
+        pdf.output(tmp_path)
+        return self._replace(tmp_path, pdf_path)
@@ -9,10 +9,62 @@ class Config:
     
     # Processing parameters
     DPI = 300  # PDF conversion DPI
+    COARSE_TO_FINE = False  # Analyse pages at ANALYSIS_DPI, render only text regions at DPI for OCR; tiled pages are always read at DPI
+    ANALYSIS_DPI = 100  # Page images, preprocessing, lines and text regions with COARSE_TO_FINE
+    FINE_MIN_TEXT_HEIGHT = 20  # Smaller text regions are rendered above DPI for OCR, in pixels at DPI
+    FINE_MAX_DPI = 600  # Highest OCR resolution; also used to re-read low confidence tokens
     MIN_DIMENSION_CONFIDENCE = 80  # OCR confidence threshold
     BALLOON_RADIUS = 20  # Balloon circle radius
     BALLOON_PADDING = 40  # Padding around balloons
+    BALLOON_INK_CLEARANCE = 5  # Min gap between a balloon and drawing lines
+    LAYOUT_MODE = 'global'  # 'global' (whole-page optimizer) or 'greedy'
+    LAYOUT_RINGS = 20  # Candidate rings around each dimension in global layout
+    LAYOUT_TIME_BUDGET = 2.0  # Seconds per page for the whole global layout
     LINE_DETECTION_THRESHOLD = 100  # For dimension line detection
+    LINE_DETECTION_SCALE = 0.5  # Downscale of raster pages before Hough line detection
+    LINE_MIN_LENGTH = 50  # Shortest line segment kept, in pixels
+    USE_VECTOR_GEOMETRY = True  # Take lines from PDF drawing commands instead of Hough where possible
+    ARROW_MAX_SIZE = 40  # Largest filled vector shape treated as an arrowhead, in pixels
+    LINE_ASSOCIATION_DISTANCE = 200  # Max text-to-line distance in pixels
+    LINE_ASSOCIATION_MODE = 'center'  # 'center' (line midpoint) or 'segment' (nearest point)
+    USE_TEXT_LAYER = True  # Read native PDF text instead of OCR where possible
+    OCR_REGION_PROPOSAL = True  # OCR only candidate text regions, not the whole page
+    OCR_BATCH_GAP = 20  # Blank pixels between region crops in a batched OCR image
+    OCR_BATCH_MAX_HEIGHT = 30000  # Tesseract rejects images above 32767 px
+    OCR_BATCH_MIN_HEIGHT = 2000  # Smallest batch worth a separate OCR call
+    OCR_BACKEND = 'auto'  # 'tesserocr' (in-process), 'pytesseract' or 'auto'
+    OCR_MEMO_SIZE = 10000  # Text crops whose OCR result is kept for reuse, per process
+    TEMPLATE_MASKING = True  # Skip borders, title blocks etc. repeated across sheets
+    TEMPLATE_HASH_DPI = 72  # Resolution of the render compared between sheets
+    TEMPLATE_CELL_SIZE = 16  # Compared cell size in pixels at TEMPLATE_HASH_DPI
+    TEMPLATE_MAX_SHARED = 0.9  # Sheets sharing more of their ink are copies of one drawing
+    TEMPLATE_HISTORY = 20  # Learned templates per sheet size kept for later documents
+    TEMPLATE_LEARNING = False  # Match templates learned from earlier documents; off so uploads never mask each other
+    PIPELINE_WORKERS = os.cpu_count() or 1  # Pages processed in parallel
+    PAGE_WINDOW = 2 * PIPELINE_WORKERS  # Max pages in flight at once
+    OCR_WORKERS = PIPELINE_WORKERS  # OCR threads of a process not in the page pool
+    RASTER_BALLOONS = True  # Also draw balloons onto page images (the vector PDF never needs them)
+    PREVIEW_PYRAMID = True  # Build tiled preview pyramids so the viewer never loads full pages
+    PREVIEW_TILE_SIZE = 512  # Preview tile edge in pixels
+    PREVIEW_THUMBNAIL_SIZE = 1024  # Max edge of the smallest preview level
+    TILED_PROCESSING = True  # Process oversized sheets in overlapping tiles instead of whole
+    TILED_MIN_PIXELS = 64 * 10**6  # Rendered size from which a sheet is tiled (A1 and up at 300 DPI)
+    TILE_SIZE = 4096  # Page area owned by each tile, in pixels; rounded down to PREVIEW_TILE_SIZE times a power of two
+    TILE_OVERLAP = 256  # Pixels rendered around each tile, at least half the longest text on a seam
+    TILE_PNG_COMPRESSION = 1  # PNG compression (0-9) of tiled page images kept only for exports
+    SPILL_PAGES = True  # Write finished page images to disk instead of keeping them in RAM
+    CACHE_MAX_BYTES = 2 * 1024**3  # Size limit of the page result cache
+    REVISION_HASH_DPI = 72  # Resolution of the render compared between revisions
+    REVISION_CELL_SIZE = 32  # Compared cell size in pixels at REVISION_HASH_DPI
+    REVISION_MATCH_DISTANCE = 300  # Max shift in pixels for a dimension to keep its balloon
+    REVISION_MOVE_TOLERANCE = 3  # Shifts up to this many pixels are not reported as moves
+    JOB_SERVICE_URL = None  # e.g. 'http://127.0.0.1:8765': the web UI hands uploads to job_service.py
+    JOB_SERVICE_PORT = 8765  # Port job_service.py listens on
+    JOB_POLL_INTERVAL = 1.0  # Seconds between progress polls of the web UI
+    JOB_MAX_UPLOAD_MB = 200  # Largest PDF the job service accepts
+    JOB_RETENTION = 3600  # Seconds the job service keeps a finished job and its files
+    JOB_MAX_FINISHED = 200  # Finished jobs kept at most; the oldest are dropped first
+    INSTRUMENTATION = False  # Record per-stage timings (see instrumentation.py)
     
     # Supported standards
     SUPPORTED_STANDARDS = ['ASME_Y14.5', 'ISO_1101', 'DIN_406', 'JIS_B_0021']
@@ -1,90 +1,633 @@
 import cv2
-import pytesseract
+import hashlib
+import math
 import re
+from collections import OrderedDict
 import numpy as np
-from drawing_standards import DrawingStandards
+from config import Config
+from drawing_standards import DrawingStandards, DimensionMatcher
+from line_index import LineIndex
+from ocr_engine import get_ocr_engine
+from instrumentation import traced, tracer
 
 class DimensionDetector:
-    def __init__(self, standard='ASME_Y14.5'):
+    # Longest run of words tried as one dimension, e.g. "+0.1", "/", "-0.2"
+    MAX_WORDS_PER_DIMENSION = 4
+    
+    def __init__(self, standard='ASME_Y14.5', ocr_engine=None):
+        # 'AUTO' uses the dominant standard of each page's tokens
+        self.auto = standard == 'AUTO'
         self.standard = DrawingStandards(standard)
-        self.dimension_pattern = self.standard.get_dimension_regex()
+        self.matcher = DimensionMatcher()
+        self.hits = {}  # page_num -> toleranced tokens per standard
+        self.ocr = ocr_engine or get_ocr_engine()
+        # Crop hash -> words read in that crop, shared by all pages and documents
+        self.ocr_memo = OrderedDict()
+    
+    def classify(self, texts, page_num):
+        """Match tokens against all standards in one pass
+        
+        Adds the tokens' per-standard hits to self.hits[page_num]. Returns
+        one {standard: (value, tolerance)} dict per token, see
+        DimensionMatcher.classify.
+        """
+        classified = self.matcher.classify(texts)
+        page_hits = self.hits.setdefault(page_num, {})
+        for standard, count in self.matcher.count_hits(classified).items():
+            page_hits[standard] = page_hits.get(standard, 0) + count
+        return classified
+    
+    def page_standard(self, page_num):
+        """Standard of a page: with 'AUTO', the dominant one of its hits so far"""
+        if not self.auto:
+            return self.standard.standard
+        return self.matcher.dominant(self.hits.get(page_num, {}))
+    
+    def _match(self, matches, page_num):
+        """(standard, (value, tolerance)) of a classified token, or None
+        
+        With 'AUTO' the page's standard is not final until all its tokens
+        are read, so any standard will do for now: see resolve_standard.
+        """
+        standard = self.page_standard(page_num)
+        if standard in matches:
+            return standard, matches[standard]
+        if self.auto and matches:
+            return next(iter(matches.items()))
+        return None
+    
+    def resolve_standard(self, dimensions, page_num):
+        """Dimensions of a page read in its one standard, once all are read
+        
+        With 'AUTO', dimensions carry their matches in every standard until
+        then; those not matching the page's standard are dropped.
+        """
+        if not self.auto:
+            return dimensions
+        standard = self.page_standard(page_num)
+        resolved = []
+        for dim in dimensions:
+            matches = dim.pop('matches', {standard: (dim['value'], dim['tolerance'])})
+            if standard in matches:
+                dim['value'], dim['tolerance'] = matches[standard]
+                dim['standard'] = standard
+                resolved.append(dim)
+        return resolved
+    
+    @traced('detect_lines')
+    def detect_lines(self, img, geometry=None, scale=1.0):
+        """Dimension line segments of a page as an (N, 4) array
+        
+        With the page's vector geometry (see PDFProcessor.get_page_geometry)
+        its segments are used as they are and Hough detection only runs on
+        the raster regions; without it, or if the page has no vector lines,
+        the whole page is treated as raster. img may be the page at scale
+        times Config.DPI; segments are always at Config.DPI.
+        """
+        if geometry is None or len(geometry['segments']) == 0:
+            lines = self.hough_lines(img, scale)
+        else:
+            lines = np.concatenate([
+                geometry['segments'], self.raster_lines(img, geometry['raster_regions'], scale)
+            ])
+        tracer.count('segments', len(lines))
+        
+        return lines
+    
+    def raster_lines(self, img, regions, scale=1.0):
+        """Hough segments of the (x, y, w, h) regions of img, in img pixels
+        
+        With a scale, img is at scale times Config.DPI while the regions and
+        segments are at Config.DPI.
+        """
+        lines = [np.empty((0, 4))]
+        for region in regions:
+            x, y, w, h = self._scale_box(region, scale)
+            origin = np.array([x, y, x, y]) / scale
+            lines.append(self.hough_lines(img[y:y + h, x:x + w], scale) + origin)
+        return np.concatenate(lines)
+    
+    def hough_lines(self, img, scale=1.0):
+        """Detect line segments with the Hough transform on a downscaled image
+        
+        img is at scale times Config.DPI; it is only downscaled further
+        down to Config.LINE_DETECTION_SCALE. Segments are at Config.DPI.
+        """
+        if img.size == 0:
+            return np.empty((0, 4))
+        resize = min(1.0, Config.LINE_DETECTION_SCALE / scale)
+        if resize != 1:
+            img = cv2.resize(img, None, fx=resize, fy=resize, interpolation=cv2.INTER_AREA)
+        scale *= resize
         
-    def detect_lines(self, img):
-        """Detect dimension lines using Hough Line Transform"""
         # Detect edges
         edges = cv2.Canny(img, 50, 150, apertureSize=3)
         
-        # Detect lines
+        # Detect lines; votes and lengths shrink with the image
         lines = cv2.HoughLinesP(
-            edges, 1, np.pi/180, Config.LINE_DETECTION_THRESHOLD,
-            minLineLength=50, maxLineGap=10
+            edges, 1, np.pi/180, max(1, int(Config.LINE_DETECTION_THRESHOLD * scale)),
+            minLineLength=Config.LINE_MIN_LENGTH * scale, maxLineGap=10 * scale
         )
+        if lines is None:
+            return np.empty((0, 4))
         
-        return lines
+        return lines.reshape(-1, 4) / scale
     
-    def detect_dimensions(self, img, page_num):
-        """Detect dimensions using OCR and line detection"""
+    def detect_dimensions(self, img, page_num, text_layer=None, line_segments=None,
+                          template=None, fine=None, scale=1.0):
+        """Detect dimensions using OCR and line detection
+        
+        If a native PDF text layer is given (see
+        PDFProcessor.extract_text_layer), dimensions are read from it directly
+        and OCR only runs on the page's raster regions. Line segments already
+        detected for the page can be passed in to avoid detecting them again.
+        Nothing inside the page's template (see template_mask.py) is read.
+        With fine (see fine_ocr_dimensions), img is the page at scale times
+        Config.DPI and only its text regions are OCR'd, re-rendered. With
+        'AUTO', one standard is chosen from all the tokens of the page.
+        """
+        def ocr(region=None):
+            if fine is None:
+                return self.ocr_dimensions(img, page_num, region, template)
+            return self.fine_ocr_dimensions(img, page_num, fine, scale, region, template)
+        
+        dimensions = []
+        if line_segments is None:
+            line_segments = self.detect_lines(img, scale=scale) if img is not None else []
+        
+        if text_layer is None or not text_layer['words']:
+            dimensions.extend(self.reading_order(ocr()))
+        else:
+            # Raster regions are read first: text layer words are joined
+            # into dimensions in the page's standard, so every token must
+            # be counted by then
+            raster_dimensions = []
+            for region in text_layer['raster_regions']:
+                raster_dimensions.extend(ocr(region))
+            dimensions.extend(
+                self.text_layer_dimensions(text_layer['words'], page_num)
+            )
+            dimensions.extend(self.reading_order(raster_dimensions))
+        dimensions = self.resolve_standard(dimensions, page_num)
+        
+        if template is not None:
+            dimensions = [dim for dim in dimensions if not template.covers_box(dim['coords'])]
+        
+        # Find associated dimension lines for all dimensions at once
+        self.associate_lines(dimensions, line_segments)
+        
+        return dimensions
+    
+    @staticmethod
+    def reading_order(dimensions):
+        """OCR'd dimensions top to bottom, then left to right
+        
+        Balloons are numbered in this order, which does not depend on how
+        the page was split up for OCR (regions, tiles or resolution).
+        """
+        return sorted(dimensions, key=lambda dim: (dim['coords'][1], dim['coords'][0]))
+    
+    @traced('ocr')
+    def ocr_dimensions(self, img, page_num, region=None, template=None, origin=(0, 0),
+                       core=None):
+        """Detect dimensions by running OCR on the page or one (x, y, w, h) region
+        
+        img may be part of the page with its top-left corner at origin;
+        boxes are returned in page pixels. Proposed text regions inside the
+        page template are not OCR'd. With a core (a page box), only text
+        centered in it is kept: whole proposed regions, else single words.
+        """
+        offset_x, offset_y = origin
+        if region is not None:
+            x, y, w, h = region
+            img = img[y:y + h, x:x + w]
+            if img.size == 0:
+                return []
+            offset_x, offset_y = offset_x + x, offset_y + y
+        
         # Run OCR to get text data
-        ocr_data = pytesseract.image_to_data(
-            img, output_type=pytesseract.Output.DICT, config='--psm 6'
-        )
+        if Config.OCR_REGION_PROPOSAL:
+            regions = self.propose_text_regions(img)
+            if core is not None:
+                regions = [
+                    box for box in regions
+                    if self._centered_in((box[0] + offset_x, box[1] + offset_y) + box[2:], core)
+                ]
+            if template is not None:
+                kept = [
+                    box for box in regions
+                    if not template.covers_box((box[0] + offset_x, box[1] + offset_y) + box[2:])
+                ]
+                tracer.count('template_regions', len(regions) - len(kept))
+                regions = kept
+            ocr_data = self.ocr_text_regions(img, regions)
+        else:
+            ocr_data = self.ocr.image_to_data(img)
+        
+        dimensions = self._words_to_dimensions(ocr_data, page_num, (offset_x, offset_y))
+        if core is not None and not Config.OCR_REGION_PROPOSAL:
+            dimensions = [dim for dim in dimensions if self._centered_in(dim['coords'], core)]
+        
+        return dimensions
+    
+    @traced('ocr')
+    def fine_ocr_dimensions(self, img, page_num, fine, scale, region=None, template=None):
+        """Detect dimensions by OCR of text regions re-rendered at high resolution
+        
+        img is the preprocessed page at scale times Config.DPI and is only
+        used to find the text regions. region is an (x, y, w, h) box at
+        Config.DPI, like the returned boxes. fine(boxes, dpis) renders page
+        boxes at the given resolutions (see PDFProcessor.render_boxes).
+        """
+        offset_x, offset_y = 0, 0
+        if region is not None:
+            offset_x, offset_y, w, h = self._scale_box(region, scale)
+            img = img[offset_y:offset_y + h, offset_x:offset_x + w]
+            if img.size == 0:
+                return []
+        
+        dpi = Config.DPI * scale
+        boxes = [
+            self._scale_box((x + offset_x, y + offset_y, w, h), 1 / scale)
+            for x, y, w, h in self.coarse_text_regions(img, dpi)
+        ]
+        if template is not None:
+            kept = [box for box in boxes if not template.covers_box(box)]
+            tracer.count('template_regions', len(boxes) - len(kept))
+            boxes = kept
+        
+        return self._words_to_dimensions(self.ocr_fine_regions(fine, boxes), page_num)
+    
+    def _words_to_dimensions(self, ocr_data, page_num, offset=(0, 0)):
+        """Dimensions among OCR'd words, their boxes shifted by offset"""
+        offset_x, offset_y = offset
+        tracer.count('ocr_words', len(ocr_data['text']))
+        
+        # Skip low confidence or empty text
+        candidates = [
+            i for i in range(len(ocr_data['text']))
+            if ocr_data['text'][i].strip() and
+            int(float(ocr_data['conf'][i])) >= Config.MIN_DIMENSION_CONFIDENCE
+        ]
+        texts = [ocr_data['text'][i].strip() for i in candidates]
+        classified = self.classify(texts, page_num)
         
         dimensions = []
-        line_segments = self.detect_lines(img) if img is not None else []
-        
-        # Process OCR results
-        for i in range(len(ocr_data['text'])):
-            text = ocr_data['text'][i].strip()
-            conf = int(ocr_data['conf'][i])
-            
-            # Skip low confidence or empty text
-            if conf < Config.MIN_DIMENSION_CONFIDENCE or not text:
-                continue
-                
-            # Check if text matches dimension pattern
-            if match := self.dimension_pattern.match(text):
-                x, y, w, h = (
-                    ocr_data['left'][i], 
-                    ocr_data['top'][i], 
-                    ocr_data['width'][i], 
+        for i, text, matches in zip(candidates, texts, classified):
+            match = self._match(matches, page_num)
+            if match is not None:
+                bbox = (
+                    ocr_data['left'][i] + offset_x,
+                    ocr_data['top'][i] + offset_y,
+                    ocr_data['width'][i],
                     ocr_data['height'][i]
                 )
-                
-                # Find associated dimension lines
-                associated_lines = self.find_associated_lines(
-                    (x, y, w, h), line_segments
-                )
-                
-                dimensions.append({
-                    'text': text,
-                    'value': match.group(1),
-                    'tolerance': match.group(2) if match.lastindex >= 2 else None,
-                    'coords': (x, y, w, h),
-                    'lines': associated_lines,
-                    'page': page_num
-                })
+                dimensions.append(self.build_dimension(text, matches, bbox, page_num, *match))
         
         return dimensions
     
+    @staticmethod
+    def _centered_in(box, area):
+        """Whether the center of an (x, y, w, h) box lies in another box"""
+        x, y, w, h = box
+        ax, ay, aw, ah = area
+        return ax <= x + w / 2 < ax + aw and ay <= y + h / 2 < ay + ah
+    
+    def coarse_text_regions(self, img, dpi):
+        """Candidate text boxes of a binary page image at a low resolution
+        
+        There, text touching a dimension or extension line merges with it
+        into one component too large to be a character, so long horizontal
+        and vertical strokes are removed first. Shorter lines then leave
+        character-sized stubs: boxes holding a single component that the
+        removal changed are dropped.
+        """
+        length = max(3, int(45 * dpi / 300))
+        rules = cv2.morphologyEx(img, cv2.MORPH_OPEN, np.ones((1, length), np.uint8))
+        rules |= cv2.morphologyEx(img, cv2.MORPH_OPEN, np.ones((length, 1), np.uint8))
+        stripped = cv2.subtract(img, rules)
+        
+        regions = []
+        for x, y, w, h in self.propose_text_regions(stripped, dpi):
+            crop = stripped[y:y + h, x:x + w]
+            count, _ = cv2.connectedComponents(crop)
+            if count > 2 or np.array_equal(crop, img[y:y + h, x:x + w]):
+                regions.append((x, y, w, h))
+        return regions
+    
+    @staticmethod
+    def _scale_box(box, factor):
+        """Integer (x, y, w, h) box covering box scaled by factor"""
+        x, y, w, h = box
+        x0, y0 = int(x * factor), int(y * factor)
+        return (x0, y0, math.ceil((x + w) * factor) - x0, math.ceil((y + h) * factor) - y0)
+    
+    @traced('propose_text_regions')
+    def propose_text_regions(self, img, dpi=None):
+        """Find candidate text boxes (x, y, w, h) on a preprocessed binary image
+        
+        Character-sized connected components are kept, then merged into
+        words and short phrases by a horizontal dilation. Long lines, borders
+        and hatching are dropped because they are not character-sized.
+        Sizes are for an image at dpi, by default Config.DPI.
+        """
+        scale = (dpi or Config.DPI) / 300
+        min_h, max_h = 6 * scale, 120 * scale
+        
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(img, connectivity=8)
+        w, h = stats[1:, cv2.CC_STAT_WIDTH], stats[1:, cv2.CC_STAT_HEIGHT]
+        is_char = (h >= min_h) & (h <= max_h) & (w <= max_h * 1.5)
+        
+        char_labels = np.flatnonzero(is_char) + 1
+        if len(char_labels) == 0:
+            return []
+        lookup = np.zeros(count, dtype=np.uint8)
+        lookup[char_labels] = 255
+        char_mask = lookup[labels]
+        
+        # Join characters of the same word/phrase ("25.4 ±0.1" stays together)
+        kernel = cv2.getStructuringElement(
+            cv2.MORPH_RECT, (max(3, int(24 * scale)), max(1, int(3 * scale)))
+        )
+        merged = cv2.dilate(char_mask, kernel)
+        _, _, boxes, _ = cv2.connectedComponentsWithStats(merged, connectivity=8)
+        
+        pad = int(4 * scale)
+        img_h, img_w = img.shape[:2]
+        x0 = np.maximum(boxes[1:, 0] - pad, 0)
+        y0 = np.maximum(boxes[1:, 1] - pad, 0)
+        x1 = np.minimum(boxes[1:, 0] + boxes[1:, 2] + pad, img_w)
+        y1 = np.minimum(boxes[1:, 1] + boxes[1:, 3] + pad, img_h)
+        
+        return [
+            (int(x), int(y), int(xe - x), int(ye - y))
+            for x, y, xe, ye in zip(x0, y0, x1, y1)
+        ]
+    
+    def ocr_text_regions(self, img, regions):
+        """OCR many small regions with one Tesseract call per batch
+        
+        The crops are stacked into a single image, one row per region, and
+        the words found are mapped back to page coordinates (see
+        read_crops). Returns the same dict layout as pytesseract.image_to_data.
+        """
+        ocr_data = {'text': [], 'conf': [], 'left': [], 'top': [], 'width': [], 'height': []}
+        crops = [img[y:y + h, x:x + w] for x, y, w, h in regions]
+        
+        for (rx, ry, _, _), words in zip(regions, self.read_crops(crops)):
+            for text, conf, left, top, width, height in words:
+                ocr_data['text'].append(text)
+                ocr_data['conf'].append(conf)
+                ocr_data['left'].append(left + rx)
+                ocr_data['top'].append(top + ry)
+                ocr_data['width'].append(width)
+                ocr_data['height'].append(height)
+        
+        return ocr_data
+    
+    def ocr_fine_regions(self, fine, boxes):
+        """OCR (x, y, w, h) page boxes re-rendered from the PDF
+        
+        Each box is rendered at Config.DPI, or higher for text smaller than
+        Config.FINE_MIN_TEXT_HEIGHT pixels. Boxes with a word below
+        Config.MIN_DIMENSION_CONFIDENCE are read again at
+        Config.FINE_MAX_DPI, keeping the more confident reading. Returns the
+        words at Config.DPI in the layout of pytesseract.image_to_data.
+        """
+        ocr_data = {'text': [], 'conf': [], 'left': [], 'top': [], 'width': [], 'height': []}
+        # Proposals are padded by 4 px at 300 DPI on each side
+        pad = 8 * Config.DPI / 300
+        dpis = [
+            min(Config.FINE_MAX_DPI, max(
+                Config.DPI, Config.DPI * Config.FINE_MIN_TEXT_HEIGHT / max(h - pad, 1)
+            ))
+            for _, _, _, h in boxes
+        ]
+        words = self.read_crops(fine(boxes, dpis))
+        
+        retry = [
+            i for i, region_words in enumerate(words)
+            if dpis[i] < Config.FINE_MAX_DPI and any(
+                float(conf) < Config.MIN_DIMENSION_CONFIDENCE for _, conf, *_ in region_words
+            )
+        ]
+        tracer.count('fine_retries', len(retry))
+        if retry:
+            again = self.read_crops(fine(
+                [boxes[i] for i in retry], [Config.FINE_MAX_DPI] * len(retry)
+            ))
+            for i, region_words in zip(retry, again):
+                if self._mean_conf(region_words) > self._mean_conf(words[i]):
+                    words[i], dpis[i] = region_words, Config.FINE_MAX_DPI
+        
+        for (bx, by, _, _), dpi, region_words in zip(boxes, dpis, words):
+            factor = Config.DPI / dpi
+            for text, conf, left, top, width, height in region_words:
+                ocr_data['text'].append(text)
+                ocr_data['conf'].append(conf)
+                ocr_data['left'].append(bx + int(left * factor))
+                ocr_data['top'].append(by + int(top * factor))
+                ocr_data['width'].append(max(1, round(width * factor)))
+                ocr_data['height'].append(max(1, round(height * factor)))
+        
+        return ocr_data
+    
+    @staticmethod
+    def _mean_conf(words):
+        return sum(float(conf) for _, conf, *_ in words) / len(words) if words else -1
+    
+    def read_crops(self, crops):
+        """Words of every image crop, as (text, conf, left, top, width, height) lists
+        
+        Crops are read in batched mosaics spread over the OCR engine's
+        workers. Crops already read before, on this page or an earlier one,
+        are taken from the OCR memo.
+        """
+        keys = [self._crop_key(crop) for crop in crops]
+        todo = {}  # Crops to read: key -> crop
+        for key, crop in zip(keys, crops):
+            if key in self.ocr_memo:
+                self.ocr_memo.move_to_end(key)
+            else:
+                todo.setdefault(key, crop)
+        tracer.count('ocr_memo_hits', len(crops) - len(todo))
+        if todo:
+            self._read_crops(todo)
+        
+        words = [self.ocr_memo[key] for key in keys]
+        
+        # Evict least recently used crops; the ones of this call stay
+        while len(self.ocr_memo) > max(Config.OCR_MEMO_SIZE, len(crops)):
+            self.ocr_memo.popitem(last=False)
+        
+        return words
+    
+    @staticmethod
+    def _crop_key(crop):
+        digest = hashlib.blake2b(crop.tobytes(), digest_size=16)
+        digest.update(repr(crop.shape).encode())
+        return digest.digest()
+    
+    def _read_crops(self, todo):
+        """OCR the crops of todo in mosaics and add their words to the memo"""
+        keys, crops = list(todo), list(todo.values())
+        words = [[] for _ in crops]
+        gap = Config.OCR_BATCH_GAP
+        
+        # Split at Tesseract's image limits, or evenly over the workers
+        total_height = sum(crop.shape[0] + gap for crop in crops)
+        max_height = min(
+            Config.OCR_BATCH_MAX_HEIGHT,
+            max(total_height // self.ocr.workers + 1, Config.OCR_BATCH_MIN_HEIGHT)
+        )
+        batches = []
+        batch = []
+        batch_height = 0
+        for index in list(range(len(crops))) + [None]:
+            if batch and (index is None or batch_height + crops[index].shape[0] > max_height):
+                batches.append(batch)
+                batch, batch_height = [], 0
+            if index is not None:
+                batch.append(index)
+                batch_height += crops[index].shape[0] + gap
+        
+        mosaics = [self._build_mosaic([crops[index] for index in batch]) for batch in batches]
+        results = self.ocr.map([mosaic for mosaic, _ in mosaics])
+        for batch, (_, row_tops), batch_data in zip(batches, mosaics, results):
+            self._map_batch_words(row_tops, batch_data, [words[index] for index in batch])
+        
+        for key, crop_words in zip(keys, words):
+            self.ocr_memo[key] = crop_words
+    
+    def _build_mosaic(self, crops):
+        """Vertical stack of crops and the top row of each crop"""
+        gap = Config.OCR_BATCH_GAP
+        width = max(crop.shape[1] for crop in crops) + 2 * gap
+        height = sum(crop.shape[0] for crop in crops) + gap * (len(crops) + 1)
+        
+        # Background matches preprocess_image output (text is 255 on 0)
+        mosaic = np.zeros((height, width), dtype=crops[0].dtype)
+        row_tops = np.empty(len(crops), dtype=np.int64)
+        y = gap
+        for i, crop in enumerate(crops):
+            crop_h, crop_w = crop.shape[:2]
+            mosaic[y:y + crop_h, gap:gap + crop_w] = crop
+            row_tops[i] = y
+            y += crop_h + gap
+        return mosaic, row_tops
+    
+    def _map_batch_words(self, row_tops, batch_data, words):
+        """Split the words of one mosaic into its crops, in crop coordinates
+        
+        words holds one list per mosaic row; each word is appended as
+        (text, conf, left, top, width, height).
+        """
+        gap = Config.OCR_BATCH_GAP
+        for i in range(len(batch_data['text'])):
+            if not batch_data['text'][i].strip():
+                continue
+            top, h = batch_data['top'][i], batch_data['height'][i]
+            row = int(np.searchsorted(row_tops, top + h // 2, side='right')) - 1
+            if row < 0:
+                continue
+            words[row].append((
+                batch_data['text'][i], batch_data['conf'][i],
+                batch_data['left'][i] - gap, top - int(row_tops[row]),
+                batch_data['width'][i], h
+            ))
+    
+    @traced('match_text_layer')
+    def text_layer_dimensions(self, words, page_num):
+        """Detect dimensions from native PDF words without OCR
+        
+        CAD exports often split a dimension and its tolerance into separate
+        words, so consecutive words on the same line are joined greedily,
+        longest run first. Every candidate run is classified in one batch.
+        """
+        lines = {}
+        for word in words:
+            lines.setdefault(word['line'], []).append(word)
+        lines = list(lines.values())
+        
+        runs, texts = [], []
+        for line_num, line_words in enumerate(lines):
+            for i in range(len(line_words)):
+                for run in range(1, min(self.MAX_WORDS_PER_DIMENSION, len(line_words) - i) + 1):
+                    runs.append((line_num, i, run))
+                    texts.append(' '.join(word['text'] for word in line_words[i:i + run]))
+        classified = self.classify(texts, page_num)
+        # Runs are chosen in the page's standard, its tokens now all counted
+        standard = self.page_standard(page_num)
+        matched = {
+            key: (text, matches) for key, text, matches in zip(runs, texts, classified)
+            if standard in matches
+        }
+        
+        dimensions = []
+        for line_num, line_words in enumerate(lines):
+            i = 0
+            while i < len(line_words):
+                consumed = 1
+                max_run = min(self.MAX_WORDS_PER_DIMENSION, len(line_words) - i)
+                for run in range(max_run, 0, -1):
+                    if (line_num, i, run) in matched:
+                        text, matches = matched[line_num, i, run]
+                        dimensions.append(self.build_dimension(
+                            text, matches, self._union_bbox(line_words[i:i + run]),
+                            page_num, standard, matches[standard]
+                        ))
+                        consumed = run
+                        break
+                i += consumed
+        
+        return dimensions
+    
+    def build_dimension(self, text, matches, bbox, page_num, standard, match):
+        """Build the dimension dict shared by the OCR and text-layer paths
+        
+        matches is the token's dict from classify() and match its (value,
+        tolerance) pair in standard. 'lines' is filled in afterwards by
+        associate_lines; with 'AUTO', 'matches' is kept for
+        resolve_standard.
+        """
+        value, tolerance = match
+        dimension = {
+            'text': text,
+            'value': value,
+            'tolerance': tolerance,
+            'coords': bbox,
+            'lines': [],
+            'page': page_num,
+            'standard': standard
+        }
+        if self.auto:
+            dimension['matches'] = matches
+        return dimension
+    
+    @traced('find_associated_lines')
+    def associate_lines(self, dimensions, lines):
+        """Attach nearby dimension lines to every dimension in one bulk query"""
+        if lines is None or len(lines) == 0 or not dimensions:
+            return
+        
+        index = LineIndex(lines)
+        matches = index.query([dim['coords'] for dim in dimensions])
+        for dim, segment_ids in zip(dimensions, matches):
+            dim['lines'] = index.segment_tuples(segment_ids)
+    
+    @staticmethod
+    def _union_bbox(words):
+        """Integer (x, y, w, h) box enclosing a group of words"""
+        x0 = int(min(word['bbox'][0] for word in words))
+        y0 = int(min(word['bbox'][1] for word in words))
+        x1 = int(np.ceil(max(word['bbox'][2] for word in words)))
+        y1 = int(np.ceil(max(word['bbox'][3] for word in words)))
+        return (x0, y0, x1 - x0, y1 - y0)
+    
     def find_associated_lines(self, text_bbox, lines):
         """Find dimension lines associated with text"""
         if lines is None:
             return []
-            
-        tx, ty, tw, th = text_bbox
-        text_center = (tx + tw//2, ty + th//2)
-        associated = []
-        
-        for line in lines:
-            x1, y1, x2, y2 = line[0]
-            line_center = ((x1+x2)//2, (y1+y2)//2)
-            
-            # Calculate distance from text center to line center
-            distance = np.sqrt((text_center[0]-line_center[0])**2 + 
-                              (text_center[1]-line_center[1])**2)
-            
-            # If close enough, consider associated
-            if distance < 200:  # 200 pixels threshold
-                associated.append((x1, y1, x2, y2))
-        
-        return associated
+        
+        index = LineIndex(lines)
+        return index.segment_tuples(index.query([text_bbox])[0])
@@ -1,5 +1,9 @@
 import re
 
+def _group_name(standard):
+    """Regex group name for a standard ('ASME_Y14.5' -> 'ASME_Y14_5')"""
+    return re.sub(r'\W', '_', standard)
+
 class DrawingStandards:
     def __init__(self, standard='ASME_Y14.5'):
         self.standard = standard
@@ -24,3 +28,78 @@ class DrawingStandards:
             'JIS_B_0021': "{value}{tolerance}"
         }
         return formats.get(self.standard, formats['ASME_Y14.5'])
+    
+    def get_combined_regex(self):
+        """One MULTILINE regex testing a line against every standard at once
+        
+        Each standard's pattern becomes an optional lookahead at the start
+        of the line, with its value and tolerance captured as
+        '<standard>_value' and '<standard>_tolerance' (see _group_name).
+        Whitespace in the patterns may not cross a line break, so many
+        tokens joined with newlines are classified in one finditer pass.
+        """
+        lookaheads = []
+        for standard, pattern in self.patterns.items():
+            name = _group_name(standard)
+            body = pattern.strip('^$').replace(r'\s', r'[^\S\n]')
+            groups = iter(['value', 'tolerance'])
+            body = re.sub(r'(?<!\\)\((?!\?)', lambda _: f"(?P<{name}_{next(groups)}>", body)
+            lookaheads.append(f"(?=(?P<{name}>{body})$)?")
+        return re.compile('^' + ''.join(lookaheads) + '.*$', re.MULTILINE)
+
+class DimensionMatcher:
+    """Classifies text tokens against all drawing standards in one pass
+    
+    classify() returns one {standard: (value, tolerance)} dict per token,
+    holding every standard whose pattern the token matches.
+    """
+    # Most specific first, for ties: every JIS token (12.50+0.10) also
+    # matches ASME, so a page whose hits are tied between them is JIS
+    PRECEDENCE = ['JIS_B_0021', 'DIN_406', 'ISO_1101', 'ASME_Y14.5']
+    
+    def __init__(self):
+        self.standards = list(DrawingStandards().patterns)
+        self.pattern = DrawingStandards().get_combined_regex()
+        self.names = {standard: _group_name(standard) for standard in self.standards}
+    
+    def classify(self, texts):
+        """Match all tokens with a single regex scan over the joined text"""
+        texts = [text.replace('\n', ' ') for text in texts]
+        if not texts:
+            return []
+        results = []
+        for match in self.pattern.finditer('\n'.join(texts)):
+            groups = match.groupdict()
+            results.append({
+                standard: (groups[f"{name}_value"], groups[f"{name}_tolerance"])
+                for standard, name in self.names.items() if groups[name] is not None
+            })
+        return results
+    
+    def count_hits(self, classified):
+        """Tokens per standard that carry a tolerance in that standard's style
+        
+        Plain numbers match every standard, so only toleranced tokens tell
+        the standards apart.
+        """
+        hits = dict.fromkeys(self.standards, 0)
+        for matches in classified:
+            for standard, (_, tolerance) in matches.items():
+                if tolerance is not None:
+                    hits[standard] += 1
+        return hits
+    
+    def dominant(self, hits, default='ASME_Y14.5'):
+        """Standard with the most hits; ties go to the more specific standard"""
+        ranked = [s for s in self.PRECEDENCE if s in self.standards]
+        ranked += [s for s in self.standards if s not in ranked]
+        best = max(ranked, key=lambda standard: hits.get(standard, 0))
+        return best if hits.get(best, 0) > 0 else default
+
+def detected_standard(dimensions, default='ASME_Y14.5'):
+    """Standard most of the detected dimensions were matched in"""
+    counts = {}
+    for dim in dimensions:
+        standard = dim.get('standard', default)
+        counts[standard] = counts.get(standard, 0) + 1
+    return max(counts, key=counts.get) if counts else default
@@ -0,0 +1,118 @@
+import os
+import cv2
+import numpy as np
+from config import Config
+
+class ImagePyramid:
+    """Tiled, downscaled copies of a page image for previews
+    
+    Level 0 is the full-resolution image and every further level halves it,
+    up to the first level no larger than Config.PREVIEW_THUMBNAIL_SIZE.
+    Each level is cut into Config.PREVIEW_TILE_SIZE square tiles, held in
+    memory or written to PNG files, so a viewer only ever reads the tiles
+    it shows.
+    """
+    
+    def __init__(self, shapes, tiles, tile_size):
+        self.shapes = shapes  # (height, width) per level
+        self.tiles = tiles  # (level, row, col) -> array or PNG path
+        self.tile_size = tile_size
+    
+    @classmethod
+    def build(cls, img, prefix=None, tile_size=None, thumbnail_size=None):
+        """Build the pyramid of img; tiles are written as {prefix}.L_R_C.png"""
+        pyramid = cls([], {}, tile_size or Config.PREVIEW_TILE_SIZE)
+        pyramid.extend(img, prefix, thumbnail_size)
+        return pyramid
+    
+    def extend(self, img, prefix=None, thumbnail_size=None):
+        """Add img as the next level, then halve it down to the thumbnail size"""
+        thumbnail_size = thumbnail_size or Config.PREVIEW_THUMBNAIL_SIZE
+        while True:
+            self.shapes.append(img.shape[:2])
+            self.add_tiles(img, len(self.shapes) - 1, prefix)
+            if max(img.shape[:2]) <= thumbnail_size:
+                break
+            img = self.halve(img)
+    
+    def add_tiles(self, img, level, prefix=None, row=0, col=0, compression=None):
+        """Cut img into tiles of a level, its top-left tile being (row, col)
+        
+        Lets a level be assembled from parts cut separately, e.g. by the
+        tiles of an oversized page (see tiling.py). compression is the PNG
+        compression level of the files, OpenCV's default if None.
+        """
+        size = self.tile_size
+        params = [] if compression is None else [cv2.IMWRITE_PNG_COMPRESSION, compression]
+        height, width = img.shape[:2]
+        for tile_row in range(0, (height + size - 1) // size):
+            for tile_col in range(0, (width + size - 1) // size):
+                tile = img[tile_row * size:(tile_row + 1) * size,
+                           tile_col * size:(tile_col + 1) * size]
+                key = (level, row + tile_row, col + tile_col)
+                if prefix is not None:
+                    path = f"{prefix}.{key[0]}_{key[1]}_{key[2]}.png"
+                    cv2.imwrite(path, tile[..., ::-1] if tile.ndim == 3 else tile, params)
+                    tile = path
+                self.tiles[key] = tile
+    
+    @staticmethod
+    def halve(img):
+        """img at the next level's resolution"""
+        height, width = img.shape[:2]
+        return cv2.resize(
+            img, ((width + 1) // 2, (height + 1) // 2), interpolation=cv2.INTER_AREA
+        )
+    
+    @property
+    def top_level(self):
+        return len(self.shapes) - 1
+    
+    @property
+    def on_disk(self):
+        return isinstance(self.tiles[0, 0, 0], str)
+    
+    def tile(self, level, row, col):
+        """One tile as an RGB or grayscale array"""
+        tile = self.tiles[level, row, col]
+        if isinstance(tile, str):
+            tile = cv2.imread(tile, cv2.IMREAD_UNCHANGED)
+            if tile is not None and tile.ndim == 3:
+                tile = cv2.cvtColor(tile, cv2.COLOR_BGR2RGB)
+        return tile
+    
+    def thumbnail(self):
+        """The whole page at the smallest level"""
+        return self.region(self.top_level, 0, 0, *self.shapes[-1][::-1])
+    
+    def full_image(self):
+        """The whole page at full resolution"""
+        return self.region(0, 0, 0, *self.shapes[0][::-1])
+    
+    def region(self, level, x, y, width, height):
+        """Crop of a level, stitched from only the tiles it overlaps"""
+        level_h, level_w = self.shapes[level]
+        x0, y0 = max(0, int(x)), max(0, int(y))
+        x1, y1 = min(level_w, int(x + width)), min(level_h, int(y + height))
+        size = self.tile_size
+        
+        out = None
+        for row in range(y0 // size, (y1 - 1) // size + 1):
+            for col in range(x0 // size, (x1 - 1) // size + 1):
+                tile = self.tile(level, row, col)
+                if out is None:
+                    out = np.zeros((y1 - y0, x1 - x0) + tile.shape[2:], dtype=tile.dtype)
+                # Overlap of the tile with the requested region
+                tx0, ty0 = col * size, row * size
+                ax0, ay0 = max(x0, tx0), max(y0, ty0)
+                ax1 = min(x1, tx0 + tile.shape[1])
+                ay1 = min(y1, ty0 + tile.shape[0])
+                out[ay0 - y0:ay1 - y0, ax0 - x0:ax1 - x0] = \
+                    tile[ay0 - ty0:ay1 - ty0, ax0 - tx0:ax1 - tx0]
+        return out
+    
+    def is_available(self):
+        """False if a tile file has been removed since"""
+        return all(
+            os.path.exists(tile) for tile in self.tiles.values() if isinstance(tile, str)
+        )
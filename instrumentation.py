@@ -0,0 +1,212 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from config import Config
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+class _NullStage:
+    """Stand-in returned while tracing is disabled; does nothing"""
+    record = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+    
+    def count(self, name, value=1):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    """Context manager measuring one stage; records itself on exit"""
+    
+    def __init__(self, tracer, name, page, counts):
+        self.tracer = tracer
+        self.name = name
+        self.page = page
+        self.counts = counts
+        self.record = None
+    
+    def __enter__(self):
+        self.tracer.active.append(self)
+        self.start = time.time()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+    
+    def __exit__(self, *exc):
+        self.tracer.active.pop()
+        self.record = {
+            'name': self.name,
+            'page': self.page,
+            'pid': os.getpid(),
+            'start': self.start,
+            'wall': time.perf_counter() - self.wall_start,
+            'cpu': time.process_time() - self.cpu_start,
+            'peak_rss_mb': _peak_rss_mb(),
+            'counts': self.counts
+        }
+        self.tracer.records.append(self.record)
+        return False
+    
+    def count(self, name, value=1):
+        """Add to an item count (OCR words, segments, placement attempts...)"""
+        self.counts[name] = self.counts.get(name, 0) + value
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class Tracer:
+    """Collects per-stage, per-page timing and resource records
+    
+    Disabled unless Config.INSTRUMENTATION is set. While disabled, stage() hands out a shared no-op
+    context manager, so instrumented code pays for one attribute check.
+    Everything but that default is per thread, so concurrent runs in one
+    process, such as web UI sessions, never trace into each other's records.
+    """
+    
+    def __init__(self):
+        self.default_enabled = Config.INSTRUMENTATION
+        self.local = threading.local()
+    
+    def _state(self):
+        local = self.local
+        if not hasattr(local, 'records'):
+            local.enabled = self.default_enabled
+            local.records = []
+            local.active = []  # Stages currently open, innermost last
+            local.current_page = None
+        return local
+    
+    @property
+    def enabled(self):
+        return self._state().enabled
+    
+    @property
+    def records(self):
+        return self._state().records
+    
+    @property
+    def active(self):
+        return self._state().active
+    
+    @property
+    def current_page(self):
+        return self._state().current_page
+    
+    def enable(self, enabled=True):
+        """Turn tracing on or off in the calling thread"""
+        self._state().enabled = enabled
+    
+    @contextlib.contextmanager
+    def recording(self, enabled=True):
+        """Trace the enclosed block of the calling thread into a list of its own
+        
+        Yields the list; the thread's setting and records are restored
+        afterwards.
+        """
+        state = self._state()
+        previous = state.enabled, state.records
+        state.enabled, state.records = enabled, []
+        try:
+            yield state.records
+        finally:
+            state.enabled, state.records = previous
+    
+    def stage(self, name, page=None, **counts):
+        """Measure the enclosed block as stage `name`
+        
+        page defaults to the page set with set_page().
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, self.current_page if page is None else page, counts)
+    
+    def count(self, name, value=1):
+        """Add to an item count of the innermost open stage"""
+        if self.active:
+            self.active[-1].count(name, value)
+    
+    def set_page(self, page):
+        """Page that subsequent stages of the calling thread are attributed to"""
+        self._state().current_page = page
+    
+    def drain(self, start=0):
+        """Return and remove the records collected from index start on"""
+        records = self.records[start:]
+        del self.records[start:]
+        return records
+    
+    def extend(self, records):
+        """Merge records collected elsewhere, e.g. in a worker process"""
+        if self.enabled:
+            self.records.extend(records)
+    
+    def summary(self, records=None):
+        """Totals per stage: calls, wall and CPU seconds, summed counts"""
+        totals = {}
+        for record in self.records if records is None else records:
+            total = totals.setdefault(record['name'], {
+                'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_rss_mb': 0.0, 'counts': {}
+            })
+            total['calls'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+            total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'] or 0.0)
+            for name, value in record['counts'].items():
+                total['counts'][name] = total['counts'].get(name, 0) + value
+        return totals
+    
+    def to_chrome_trace(self, records=None):
+        """Records as a Chrome trace (chrome://tracing, Perfetto) dict
+        
+        Each process is shown as its own track and each page as a thread.
+        """
+        events = []
+        for record in self.records if records is None else records:
+            events.append({
+                'name': record['name'],
+                'ph': 'X',
+                'ts': record['start'] * 1e6,
+                'dur': record['wall'] * 1e6,
+                'pid': record['pid'],
+                'tid': -1 if record['page'] is None else record['page'] + 1,
+                'args': {
+                    'cpu_ms': record['cpu'] * 1000,
+                    'peak_rss_mb': record['peak_rss_mb'],
+                    **record['counts']
+                }
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+    
+    def export(self, path, records=None):
+        """Write the Chrome trace JSON to path"""
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome_trace(records), f)
+        return path
+
+# Process-wide tracer used by all components
+tracer = Tracer()
+
+def traced(name):
+    """Decorator recording every call of a function as stage `name`"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,567 @@
+"""Local job service running ballooning jobs outside the web UI
+
+Usage:
+    python job_service.py --port 8765 -j 8
+
+An asyncio HTTP API in front of one shared pool of worker processes:
+    
+    POST   /jobs?standard=AUTO&priority=0&user=...&name=...  body: the PDF
+    GET    /jobs                    all jobs
+    GET    /jobs/<id>               state and per-page progress
+    GET    /jobs/<id>/result        balloons of a finished job
+    GET    /jobs/<id>/files/<name>  one of its export files
+    DELETE /jobs/<id>               cancel, or forget a finished job
+
+Jobs are scheduled page by page. A free worker takes the next page of the
+highest priority job; among equal priorities, the job of the user with the
+fewest pages running, then the oldest job. One large upload therefore cannot
+hold every core while other users wait. Finished jobs and their files are
+kept for Config.JOB_RETENTION seconds, and only the Config.JOB_MAX_FINISHED
+most recent ones. Set Config.JOB_SERVICE_URL to let
+the Streamlit front end submit to and poll this service (see JobClient).
+"""
+import argparse
+import asyncio
+import functools
+import hashlib
+import itertools
+import json
+import mimetypes
+import multiprocessing
+import os
+import shutil
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from config import Config
+from pipeline import init_worker, page_settings, process_page
+from pdf_processor import PDFProcessor
+from cmm_exporter import CMMExporter
+from drawing_standards import detected_standard
+from result_cache import ResultCache
+from template_mask import TemplateDetector, TemplateStore
+
+STANDARDS = ['AUTO'] + Config.SUPPORTED_STANDARDS
+ACTIVE_STATES = ('queued', 'running', 'exporting')
+
+class ServiceError(Exception):
+    """Request error, answered with an HTTP status and a JSON message"""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# Nobody previews service pages
+PAGE_SETTINGS = {'raster_balloons': False, 'preview_pyramid': False}
+
+def _detect_templates(pdf_path, store_folder=None):
+    """PageTemplate or None per page of an upload, found in a worker
+    
+    store_folder holds the templates learned from the same user's earlier
+    uploads, if any.
+    """
+    store = TemplateStore(store_folder) if store_folder is not None else None
+    return TemplateDetector(store).detect(pdf_path)
+
+def _run_page(pdf_path, page_num, standard, template):
+    """Process one page in a worker; only the detections travel back"""
+    result = process_page(pdf_path, page_num, standard=standard, template=template)
+    result.images.clear()
+    return result
+
+@dataclass
+class Job:
+    id: str
+    name: str
+    user: str
+    priority: int
+    standard: str
+    pdf_path: str
+    pdf_hash: str
+    folder: str
+    page_count: int
+    seq: int  # Submission order
+    templates: list  # PageTemplate or None per page
+    created: float = field(default_factory=time.time)
+    finished: float = None  # When the job reached done, failed or cancelled
+    state: str = 'queued'  # queued, running, exporting, done, failed, cancelled
+    next_page: int = 0  # First page not yet started
+    results: dict = field(default_factory=dict)  # page_num -> PageResult
+    outputs: list = field(default_factory=list)  # Export file paths
+    error: str = None
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'user': self.user,
+            'priority': self.priority,
+            'standard': self.standard,
+            'state': self.state,
+            'created': self.created,
+            'finished': self.finished,
+            'page_count': self.page_count,
+            'pages_done': len(self.results),
+            'progress': len(self.results) / self.page_count if self.page_count else 1.0,
+            'dimensions': sum(len(result.dimensions) for result in self.results.values()),
+            'outputs': [os.path.basename(path) for path in self.outputs],
+            'error': self.error
+        }
+    
+    def balloons(self):
+        """All balloons of the job in page order"""
+        return [
+            balloon for page_num in sorted(self.results)
+            for balloon in self.results[page_num].balloons
+        ]
+
+class JobService:
+    """Job queue and page scheduler shared by all clients"""
+    
+    def __init__(self, workers=None, cache=None):
+        Config.init_folders()
+        self.workers = workers or Config.PIPELINE_WORKERS
+        self.cache = cache or ResultCache()
+        self.jobs = {}
+        self.in_flight = {}  # Pool future -> (job, page_num, cache key)
+        self.lookups = 0  # Pages waiting for their cache lookup
+        self.tasks = set()  # Running cache and export tasks
+        self.seq = itertools.count()
+        # spawn rather than fork: the event loop and its threads are running
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=functools.partial(
+                init_worker, Config.SUPPORTED_STANDARDS[0], **PAGE_SETTINGS
+            )
+        )
+    
+    async def submit(self, pdf_bytes, name='drawing.pdf', user='anonymous', priority=0,
+                     standard='AUTO'):
+        """Queue a PDF for ballooning and return its Job"""
+        if not pdf_bytes.startswith(b'%PDF'):
+            raise ServiceError(400, "Body is not a PDF")
+        if standard not in STANDARDS:
+            raise ServiceError(400, f"Unknown standard {standard!r}")
+        
+        job_id = uuid.uuid4().hex
+        os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+        pdf_path = os.path.join(Config.UPLOAD_FOLDER, f"{job_id}.pdf")
+        with open(pdf_path, 'wb') as f:
+            f.write(pdf_bytes)
+        try:
+            page_count = PDFProcessor.page_count(pdf_path)
+        except Exception as e:
+            os.unlink(pdf_path)
+            raise ServiceError(400, f"Unreadable PDF: {e}")
+        
+        # A low-resolution pass over all sheets; cheap next to one page of
+        # OCR, but it renders every sheet: not on the event loop
+        templates = [None] * page_count
+        if Config.TEMPLATE_MASKING:
+            try:
+                templates = await asyncio.wrap_future(self.pool.submit(
+                    _detect_templates, pdf_path, self._template_folder(user)
+                ))
+            except Exception:
+                os.unlink(pdf_path)
+                raise
+        job = Job(
+            id=job_id, name=name, user=user, priority=priority, standard=standard,
+            pdf_path=pdf_path, pdf_hash=hashlib.sha256(pdf_bytes).hexdigest(),
+            folder=os.path.join(Config.OUTPUT_FOLDER, 'jobs', job_id),
+            page_count=page_count, seq=next(self.seq), templates=templates
+        )
+        self.jobs[job_id] = job
+        if page_count == 0:
+            self._start_export(job)
+        self._schedule()
+        return job
+    
+    @staticmethod
+    def _template_folder(user):
+        """Where a user's learned templates are kept, or None without learning"""
+        if not Config.TEMPLATE_LEARNING:
+            return None
+        user_hash = hashlib.sha256(user.encode()).hexdigest()[:16]
+        return os.path.join(Config.TEMP_FOLDER, 'templates', user_hash)
+    
+    def get(self, job_id):
+        if job_id not in self.jobs:
+            raise ServiceError(404, f"No job {job_id}")
+        return self.jobs[job_id]
+    
+    def cancel(self, job_id):
+        """Stop a job; pages already running finish but are discarded"""
+        job = self.get(job_id)
+        if job.state not in ACTIVE_STATES:
+            return job
+        self._finish(job, 'cancelled')
+        self._cancel_pages(job)
+        job.results.clear()
+        self._remove_files(job)
+        self._schedule()
+        return job
+    
+    def delete(self, job_id):
+        """Cancel an active job, or forget a finished one and its files"""
+        job = self.get(job_id)
+        if job.state in ACTIVE_STATES:
+            return self.cancel(job_id)
+        self._forget(job)
+        return job
+    
+    def _finish(self, job, state, error=None):
+        job.state = state
+        job.error = error
+        job.finished = time.time()
+    
+    def _forget(self, job):
+        self.jobs.pop(job.id, None)
+        job.results.clear()
+        self._remove_files(job)
+    
+    def prune(self):
+        """Forget finished jobs past Config.JOB_RETENTION or Config.JOB_MAX_FINISHED
+        
+        Jobs with pages still running are kept until those pages return,
+        as the workers may still be reading their PDF.
+        """
+        busy = {job.id for job, _, _ in self.in_flight.values()}
+        finished = sorted(
+            (job for job in self.jobs.values()
+             if job.state not in ACTIVE_STATES and job.id not in busy),
+            key=lambda job: job.finished, reverse=True
+        )
+        expired = time.time() - Config.JOB_RETENTION
+        for rank, job in enumerate(finished):
+            if rank >= Config.JOB_MAX_FINISHED or job.finished < expired:
+                self._forget(job)
+    
+    def _pick_job(self):
+        """Job whose next page runs first, or None if nothing is waiting"""
+        running = {}
+        for job, _, _ in self.in_flight.values():
+            running[job.user] = running.get(job.user, 0) + 1
+        waiting = [
+            job for job in self.jobs.values()
+            if job.state in ('queued', 'running') and job.next_page < job.page_count
+        ]
+        return min(
+            waiting,
+            key=lambda job: (-job.priority, running.get(job.user, 0), job.seq),
+            default=None
+        )
+    
+    def _schedule(self):
+        """Start pages until every worker is busy"""
+        while len(self.in_flight) + self.lookups < self.workers:
+            job = self._pick_job()
+            if job is None:
+                return
+            page_num = job.next_page
+            job.next_page += 1
+            job.state = 'running'
+            self.lookups += 1
+            self._spawn(self._start_page(job, page_num))
+    
+    async def _start_page(self, job, page_num):
+        """Serve a page from the cache, or hand it to a worker
+        
+        The cache reads from disk, in a thread rather than on the event loop.
+        """
+        template = job.templates[page_num]
+        key = self.cache.make_key(
+            job.pdf_hash, page_num, job.standard, stage='service_page',
+            variant=template.key() if template is not None else None,
+            # Cache keys must reflect what the workers actually produce
+            settings=page_settings(**PAGE_SETTINGS)
+        )
+        try:
+            result = await asyncio.to_thread(self.cache.get, key)
+        except Exception:
+            result = None
+        finally:
+            self.lookups -= 1
+        
+        if job.state != 'running':
+            pass  # Cancelled or failed meanwhile
+        elif result is not None:
+            self._page_done(job, page_num, result)
+        else:
+            loop = asyncio.get_running_loop()
+            future = self.pool.submit(
+                _run_page, job.pdf_path, page_num, job.standard, template
+            )
+            self.in_flight[future] = (job, page_num, key)
+            # Pool callbacks run in the pool's thread: hand over to the loop
+            future.add_done_callback(
+                lambda future: loop.call_soon_threadsafe(self._on_page_finished, future)
+            )
+        self._schedule()
+    
+    def _spawn(self, coro):
+        """Run a coroutine as a task the service keeps a reference to"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+    
+    def _on_page_finished(self, future):
+        job, page_num, key = self.in_flight.pop(future)
+        if job.state == 'running' and not future.cancelled():
+            if future.exception() is not None:
+                self._finish(job, 'failed', repr(future.exception()))
+                self._cancel_pages(job)
+            else:
+                self._spawn(asyncio.to_thread(self.cache.put, key, future.result()))
+                self._page_done(job, page_num, future.result())
+        self._schedule()
+    
+    def _cancel_pages(self, job):
+        """Drop the pages of a job that have not started yet
+        
+        Running pages cannot be interrupted; they stay in flight, so the
+        workers are not overbooked, and their results are ignored.
+        """
+        for future, (owner, _, _) in list(self.in_flight.items()):
+            if owner is job:
+                future.cancel()
+    
+    def _page_done(self, job, page_num, result):
+        job.results[page_num] = result
+        if len(job.results) == job.page_count:
+            self._start_export(job)
+    
+    def _start_export(self, job):
+        job.state = 'exporting'
+        self._spawn(self._export(job))
+    
+    async def _export(self, job):
+        """Write every report format in a thread, off the event loop"""
+        try:
+            outputs = await asyncio.to_thread(self._write_exports, job)
+        except Exception as e:
+            if job.state == 'exporting':
+                self._finish(job, 'failed', repr(e))
+            return
+        if job.state == 'exporting':
+            job.outputs = outputs
+            self._finish(job, 'done')
+            self.prune()
+    
+    @staticmethod
+    def _write_exports(job):
+        balloons = job.balloons()
+        standard = job.standard
+        if standard == 'AUTO':
+            standard = detected_standard([balloon.dimension for balloon in balloons])
+        exporter = CMMExporter(balloons, standard, output_dir=job.folder)
+        return [
+            exporter.to_excel(),
+            exporter.to_csv(),
+            exporter.to_pdf_report(job.name),
+            exporter.to_cmm_text(),
+            exporter.to_qif(),
+            exporter.to_ballooned_pdf(job.pdf_path)
+        ]
+    
+    @staticmethod
+    def _remove_files(job):
+        if os.path.exists(job.pdf_path):
+            os.unlink(job.pdf_path)
+        shutil.rmtree(job.folder, ignore_errors=True)
+    
+    def result(self, job_id):
+        """Balloons of a finished job as JSON-ready dicts"""
+        job = self.get(job_id)
+        if job.state != 'done':
+            raise ServiceError(409, f"Job {job_id} is {job.state}")
+        return [
+            {
+                'id': balloon.id,
+                'page': balloon.dimension['page'],
+                'position': [int(v) for v in balloon.position],
+                'text': balloon.dimension['text'],
+                'value': balloon.dimension['value'],
+                'tolerance': balloon.dimension['tolerance'],
+                'standard': balloon.dimension.get('standard'),
+                'coords': [int(v) for v in balloon.dimension['coords']]
+            }
+            for balloon in job.balloons()
+        ]
+    
+    def file_path(self, job_id, name):
+        """Path of an export file of a job"""
+        job = self.get(job_id)
+        for path in job.outputs:
+            if os.path.basename(path) == name:
+                return path
+        raise ServiceError(404, f"No file {name} for job {job_id}")
+    
+    async def _route(self, method, path, query, body):
+        """Dispatch a request
+        
+        Returns (status, payload); payload is JSON-ready or, for files, a
+        (content type, bytes) pair.
+        """
+        parts = [part for part in path.split('/') if part]
+        arg = lambda name, default: query.get(name, [default])[0]
+        
+        if parts == ['jobs'] and method == 'POST':
+            try:
+                priority = int(arg('priority', 0))
+            except ValueError:
+                raise ServiceError(400, "priority must be an integer")
+            job = await self.submit(
+                body, name=arg('name', 'drawing.pdf'), user=arg('user', 'anonymous'),
+                priority=priority, standard=arg('standard', 'AUTO')
+            )
+            return 201, job.to_dict()
+        if parts == ['jobs'] and method == 'GET':
+            return 200, [job.to_dict() for job in self.jobs.values()]
+        if len(parts) == 2 and parts[0] == 'jobs':
+            if method == 'GET':
+                return 200, self.get(parts[1]).to_dict()
+            if method == 'DELETE':
+                return 200, self.delete(parts[1]).to_dict()
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'result' and method == 'GET':
+            return 200, self.result(parts[1])
+        if len(parts) == 4 and parts[0] == 'jobs' and parts[2] == 'files' and method == 'GET':
+            path = self.file_path(parts[1], parts[3])
+            with open(path, 'rb') as f:
+                data = f.read()
+            return 200, (mimetypes.guess_type(path)[0] or 'application/octet-stream', data)
+        raise ServiceError(404, f"No route {method} {path}")
+    
+    async def handle(self, reader, writer):
+        """Serve one HTTP/1.1 request per connection"""
+        try:
+            try:
+                method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+            except ValueError:
+                raise ServiceError(400, "Malformed request")
+            if length > Config.JOB_MAX_UPLOAD_MB * 1024**2:
+                raise ServiceError(413, f"Uploads are limited to {Config.JOB_MAX_UPLOAD_MB} MB")
+            body = await reader.readexactly(length) if length else b''
+            
+            url = urllib.parse.urlsplit(target)
+            status, payload = await self._route(
+                method, url.path, urllib.parse.parse_qs(url.query), body
+            )
+        except ServiceError as e:
+            status, payload = e.status, {'error': str(e)}
+        except Exception as e:
+            status, payload = 500, {'error': repr(e)}
+        
+        if isinstance(payload, tuple):
+            content_type, data = payload
+        else:
+            content_type, data = 'application/json', json.dumps(payload).encode()
+        reason = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found',
+                  409: 'Conflict', 413: 'Payload Too Large'}.get(status, 'Error')
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('latin-1') + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+    
+    async def _prune_periodically(self):
+        while True:
+            await asyncio.sleep(min(60, Config.JOB_RETENTION))
+            self.prune()
+    
+    async def serve(self, host='127.0.0.1', port=None):
+        server = await asyncio.start_server(self.handle, host, port or Config.JOB_SERVICE_PORT)
+        pruner = asyncio.get_running_loop().create_task(self._prune_periodically())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            pruner.cancel()
+    
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+class JobClient:
+    """Blocking client of the job service, used by the web UI"""
+    
+    def __init__(self, url=None, timeout=30):
+        self.url = (url or Config.JOB_SERVICE_URL).rstrip('/')
+        self.timeout = timeout
+    
+    def _request(self, method, path, body=None, **query):
+        url = f"{self.url}{path}"
+        if query:
+            url += '?' + urllib.parse.urlencode(query)
+        request = urllib.request.Request(url, data=body, method=method)
+        if body is not None:
+            request.add_header('Content-Type', 'application/pdf')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read())['error']
+            except (ValueError, KeyError):
+                message = e.reason
+            raise ServiceError(e.code, message) from None
+    
+    def submit(self, pdf_bytes, name, user, priority=0, standard='AUTO'):
+        return json.loads(self._request(
+            'POST', '/jobs', pdf_bytes, name=name, user=user,
+            priority=priority, standard=standard
+        ))
+    
+    def status(self, job_id):
+        return json.loads(self._request('GET', f"/jobs/{job_id}"))
+    
+    def jobs(self):
+        return json.loads(self._request('GET', '/jobs'))
+    
+    def result(self, job_id):
+        return json.loads(self._request('GET', f"/jobs/{job_id}/result"))
+    
+    def download(self, job_id, name):
+        return self._request('GET', f"/jobs/{job_id}/files/{urllib.parse.quote(name)}")
+    
+    def cancel(self, job_id):
+        """Cancel an active job, or delete a finished one and its files"""
+        return json.loads(self._request('DELETE', f"/jobs/{job_id}"))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ballooning job service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=Config.JOB_SERVICE_PORT)
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Worker processes shared by all jobs (default: CPU count)")
+    args = parser.parse_args(argv)
+    
+    async def run():
+        # The pool is created inside the loop: page futures are tied to it
+        service = JobService(args.workers)
+        print(f"Job service on http://{args.host}:{args.port} with {service.workers} workers")
+        try:
+            await service.serve(args.host, args.port)
+        finally:
+            service.close()
+    
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,300 @@
+import time
+import numpy as np
+from config import Config
+from line_index import LineIndex
+from instrumentation import tracer
+
+class LayoutOptimizer:
+    """Places all balloons of a page together
+    
+    Every dimension gets a fixed set of candidate positions on rings around
+    its text box. Candidates that leave the page or touch the drawing's ink
+    are discarded up front in one vectorized query. Balloons are then
+    assigned most-constrained first, scoring each dimension's remaining
+    candidates at once by leader length, leader crossings and leaders
+    running through other balloons. A repair pass re-places the worst
+    balloons with full knowledge of the others. The time budget bounds the
+    whole layout: balloons still unplaced when it is spent get the nearest
+    clear spot without scoring.
+    """
+    ANGLES = 16  # Candidate directions around each text box
+    CROSSING_PENALTY = 1000  # In pixels of leader length
+    RING_GAP = 10  # Gap between a text box and the first ring
+    FALLBACK_RINGS = 60  # Rings searched for a clear fallback spot, at least Config.LAYOUT_RINGS
+    
+    def __init__(self, img_width, img_height, obstacle_boxes=(), obstacle_lines=None,
+                 time_budget=None):
+        self.img_width = img_width
+        self.img_height = img_height
+        self.time_budget = time_budget or Config.LAYOUT_TIME_BUDGET
+        self.radius = Config.BALLOON_RADIUS
+        self.spacing = 2 * (Config.BALLOON_RADIUS + Config.BALLOON_PADDING)
+        self.ink = self._build_ink_index(obstacle_boxes, obstacle_lines)
+    
+    def _build_ink_index(self, boxes, lines):
+        """Index text boxes and lines as widened segments
+        
+        A box becomes the center line along its longer side widened by half
+        its shorter side, which is close enough to the box for clearance
+        checks.
+        """
+        segments = []
+        clearance = []
+        for x, y, w, h in boxes:
+            if w >= h:
+                segments.append((x, y + h / 2, x + w, y + h / 2))
+                clearance.append(h / 2)
+            else:
+                segments.append((x + w / 2, y, x + w / 2, y + h))
+                clearance.append(w / 2)
+        if lines is not None:
+            lines = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+            segments.extend(lines)
+            clearance.extend([Config.BALLOON_INK_CLEARANCE] * len(lines))
+        if not segments:
+            return None
+        return LineIndex(segments, cell_size=self.spacing, clearance=clearance)
+    
+    def layout(self, dimensions):
+        """Return one (x, y) position per dimension, in input order"""
+        deadline = time.perf_counter() + self.time_budget
+        count = len(dimensions)
+        if count == 0:
+            return []
+        
+        boxes = np.array([dim['coords'] for dim in dimensions], dtype=np.float64)
+        self.boxes = boxes
+        self.anchors = np.stack(
+            [boxes[:, 0] + boxes[:, 2] // 2, boxes[:, 1] + boxes[:, 3] // 2], axis=1
+        )
+        self.candidates, self.cost = self._candidates(boxes)
+        self.feasible = self._static_feasibility()
+        
+        positions = np.full((count, 2), np.nan)
+        placed = np.zeros(count, dtype=bool)
+        choices = np.zeros(count, dtype=np.int64)
+        
+        # Most constrained first, so crowded dimensions still find room
+        order = np.argsort(self.feasible.sum(axis=1), kind='stable')
+        for i in order:
+            if time.perf_counter() >= deadline:
+                break  # Out of time: the rest take the fallback below
+            choice, _ = self._best_candidate(i, positions, placed)
+            if choice is not None:
+                positions[i] = self.candidates[i, choice]
+                placed[i] = True
+                choices[i] = choice
+        
+        self._repair(positions, placed, choices, deadline)
+        
+        # No clear candidate left, or no time to score them
+        for i in np.flatnonzero(~placed):
+            positions[i] = self._fallback_position(i, positions, placed)
+            placed[i] = True
+        
+        return [(int(round(x)), int(round(y))) for x, y in positions]
+    
+    def _candidates(self, boxes):
+        """(D, C, 2) candidate centers and (D, C) base cost"""
+        candidates, reach = self._rings(boxes, np.arange(Config.LAYOUT_RINGS))
+        cost = reach.reshape(len(boxes), -1)
+        # Prefer the right-hand side, where the greedy engine starts, on ties
+        angles = np.linspace(0, 2 * np.pi, self.ANGLES, endpoint=False)
+        cost = cost + 0.01 * np.tile(
+            np.abs(np.arctan2(np.sin(angles), np.cos(angles))), Config.LAYOUT_RINGS
+        )
+        self.reach = reach.max(axis=(1, 2)) + self.spacing
+        return candidates, cost
+    
+    def _rings(self, boxes, rings):
+        """(D, R * ANGLES, 2) centers on the given rings and their (D, R, ANGLES) reach"""
+        angles = np.linspace(0, 2 * np.pi, self.ANGLES, endpoint=False)
+        dx, dy = np.cos(angles), np.sin(angles)
+        
+        # Distance from the box center to its edge along each direction
+        half_w = boxes[:, 2:3] / 2
+        half_h = boxes[:, 3:4] / 2
+        with np.errstate(divide='ignore'):
+            edge = np.minimum(
+                np.where(np.abs(dx) > 1e-9, half_w / np.abs(dx), np.inf),
+                np.where(np.abs(dy) > 1e-9, half_h / np.abs(dy), np.inf)
+            )
+        
+        rings = np.asarray(rings) * self.radius
+        # (D, rings, angles)
+        reach = edge[:, None, :] + self.radius + self.RING_GAP + rings[None, :, None]
+        cand_x = boxes[:, 0:1, None] + half_w[:, :, None] + reach * dx
+        cand_y = boxes[:, 1:2, None] + half_h[:, :, None] + reach * dy
+        return np.stack([cand_x, cand_y], axis=-1).reshape(len(boxes), -1, 2), reach
+    
+    def _static_feasibility(self):
+        """Candidates inside the page and clear of the drawing's ink"""
+        r = Config.BALLOON_RADIUS + Config.BALLOON_PADDING
+        x, y = self.candidates[..., 0], self.candidates[..., 1]
+        feasible = (
+            (x - r >= 0) & (x + r < self.img_width) &
+            (y - r >= 0) & (y + r < self.img_height)
+        )
+        if self.ink is not None:
+            points = self.candidates.reshape(-1, 2)
+            boxes = np.column_stack([points, np.zeros((len(points), 2))])
+            near = self.ink.near_any(boxes, radius=self.radius, mode='segment')
+            feasible &= ~near.reshape(feasible.shape)
+        return feasible
+    
+    def _neighbours(self, i, positions, placed):
+        """Placed balloons whose balloon or leader can interact with dimension i
+        
+        Only those whose leader bounding box reaches the area covered by i's
+        candidates can overlap or cross; everything else is skipped.
+        """
+        others = np.flatnonzero(placed)
+        others = others[others != i]
+        if len(others) == 0:
+            return others
+        pos, anchors = positions[others], self.anchors[others]
+        lo = np.minimum(pos, anchors) - self.spacing
+        hi = np.maximum(pos, anchors) + self.spacing
+        center, reach = self.anchors[i], self.reach[i]
+        near = ((lo <= center + reach) & (hi >= center - reach)).all(axis=1)
+        return others[near]
+    
+    def _fallback_position(self, i, positions, placed):
+        """Spot for dimension i without scoring leaders
+        
+        The nearest spot inside the page that overlaps no placed balloon,
+        off the ink if possible, on the regular rings or farther out. Only
+        when there is none is the spot with the most room around it taken.
+        """
+        others = np.flatnonzero(placed)
+        others = others[others != i]
+        rings = np.arange(max(Config.LAYOUT_RINGS, self.FALLBACK_RINGS))
+        cand, reach = self._rings(self.boxes[i:i + 1], rings)
+        cand, cost = cand[0], reach.reshape(-1)
+        
+        clearance = np.full(len(cand), np.inf)
+        if len(others):
+            clearance = np.hypot(
+                cand[:, None, 0] - positions[others][None, :, 0],
+                cand[:, None, 1] - positions[others][None, :, 1]
+            ).min(axis=1)
+        r = Config.BALLOON_RADIUS + Config.BALLOON_PADDING
+        x, y = cand[:, 0], cand[:, 1]
+        inside = (x - r >= 0) & (x + r < self.img_width) & (y - r >= 0) & (y + r < self.img_height)
+        clear = inside & (clearance >= self.spacing)
+        tracer.count('fallback_attempts', len(cand))
+        if clear.any():
+            if self.ink is not None:
+                boxes = np.column_stack([cand, np.zeros((len(cand), 2))])
+                off_ink = clear & ~self.ink.near_any(boxes, radius=self.radius, mode='segment')
+                if off_ink.any():
+                    clear = off_ink
+            return cand[np.flatnonzero(clear)[np.argmin(cost[clear])]]
+        
+        # Nowhere clear: as much room as there is, inside the page if possible
+        inside = (x >= 0) & (x < self.img_width) & (y >= 0) & (y < self.img_height)
+        clearance[~inside] = -np.inf
+        return cand[int(np.argmax(clearance))]
+    
+    def _best_candidate(self, i, positions, placed):
+        """Best feasible candidate of dimension i as (index, score)
+        
+        Returns (None, inf) when every candidate is blocked.
+        """
+        feasible = np.flatnonzero(self.feasible[i])
+        others = self._neighbours(i, positions, placed)
+        tracer.count('placement_attempts', len(feasible))
+        
+        if len(feasible) and len(others):
+            cand = self.candidates[i, feasible]
+            other_pos = positions[others]
+            # No balloon overlaps: hard constraint
+            gap = np.hypot(
+                cand[:, None, 0] - other_pos[None, :, 0],
+                cand[:, None, 1] - other_pos[None, :, 1]
+            )
+            feasible = feasible[(gap >= self.spacing).all(axis=1)]
+        if len(feasible) == 0:
+            return None, np.inf
+        
+        score = self.cost[i, feasible]
+        if len(others):
+            score = score + self.CROSSING_PENALTY * self._conflicts(
+                self.candidates[i, feasible], self.anchors[i],
+                positions[others], self.anchors[others]
+            )
+        best = int(np.argmin(score))
+        return int(feasible[best]), float(score[best])
+    
+    def _conflicts(self, cand, anchor, other_pos, other_anchors):
+        """Leader conflicts of each candidate with the placed balloons
+        
+        Counts leader/leader crossings, this leader passing through another
+        balloon, and other leaders passing through this balloon.
+        """
+        # (C, B) proper segment intersection test
+        a = cand[:, None, :]
+        b = anchor[None, None, :]
+        c = other_pos[None, :, :]
+        d = other_anchors[None, :, :]
+        d1 = self._orientation(c, d, a)
+        d2 = self._orientation(c, d, b)
+        d3 = self._orientation(a, b, c)
+        d4 = self._orientation(a, b, d)
+        crossings = ((d1 * d2) < 0) & ((d3 * d4) < 0)
+        
+        through_other = self._point_segment_distance(
+            other_pos[None, :, :], cand[:, None, :], anchor[None, None, :]
+        ) < self.radius
+        through_self = self._point_segment_distance(
+            cand[:, None, :], other_pos[None, :, :], other_anchors[None, :, :]
+        ) < self.radius
+        
+        return (crossings | through_other | through_self).sum(axis=1)
+    
+    @staticmethod
+    def _orientation(p, q, r):
+        return (q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1]) - \
+               (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0])
+    
+    @staticmethod
+    def _point_segment_distance(p, a, b):
+        ab = b - a
+        length_sq = (ab ** 2).sum(axis=-1)
+        t = ((p - a) * ab).sum(axis=-1) / np.where(length_sq > 0, length_sq, 1)
+        t = np.clip(t, 0.0, 1.0)[..., None]
+        return np.hypot(*np.moveaxis(p - (a + t * ab), -1, 0))
+    
+    def _repair(self, positions, placed, choices, deadline):
+        """Move balloons one at a time while that lowers their score
+        
+        Balloons already at their cheapest possible spot without conflicts
+        are skipped.
+        """
+        lower_bound = np.where(self.feasible, self.cost, np.inf).min(axis=1)
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            for i in range(len(positions)):
+                if time.perf_counter() >= deadline:
+                    return
+                current = self._score(i, positions, placed, choices) if placed[i] else np.inf
+                if current <= lower_bound[i] + 1e-6:
+                    continue
+                choice, score = self._best_candidate(i, positions, placed)
+                if choice is not None and score + 1e-6 < current:
+                    positions[i] = self.candidates[i, choice]
+                    placed[i] = True
+                    choices[i] = choice
+                    improved = True
+    
+    def _score(self, i, positions, placed, choices):
+        """Cost plus conflict penalty of balloon i where it stands"""
+        others = self._neighbours(i, positions, placed)
+        score = self.cost[i, choices[i]]
+        if len(others):
+            score += self.CROSSING_PENALTY * self._conflicts(
+                positions[i][None, :], self.anchors[i],
+                positions[others], self.anchors[others]
+            )[0]
+        return score
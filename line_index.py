@@ -0,0 +1,173 @@
+import numpy as np
+from config import Config
+
+class LineIndex:
+    """Uniform-grid index over line segments for bulk proximity queries
+    
+    Segments are stored as an (N, 4) array of x1, y1, x2, y2. Two grids are
+    kept: one registers each segment in every cell its bounding box touches
+    (for point-to-segment queries), the other only in the cell of its
+    midpoint. A query for many text boxes gathers candidate segments from
+    the cells around each box and measures all candidate pairs in one
+    vectorized pass.
+    """
+    
+    def __init__(self, lines, cell_size=None, clearance=None):
+        self.cell_size = cell_size or Config.LINE_ASSOCIATION_DISTANCE
+        self.segments = self._as_array(lines)
+        # Optional per-segment widening added to the query radius
+        self.clearance = (
+            np.zeros(len(self.segments)) if clearance is None
+            else np.broadcast_to(np.asarray(clearance, dtype=np.float64), len(self.segments))
+        )
+        self._build()
+    
+    @staticmethod
+    def _as_array(lines):
+        """Accept HoughLinesP output ((N, 1, 4)), an (N, 4) array or a list"""
+        if lines is None or len(lines) == 0:
+            return np.empty((0, 4), dtype=np.float64)
+        return np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+    
+    def _build(self):
+        """Register every segment in the grid cells its bounding box covers"""
+        segs = self.segments
+        if len(segs) == 0:
+            empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+            self._grids = {'segment': empty, 'center': empty}
+            return
+        self._grids = {}
+        
+        x_min = np.minimum(segs[:, 0], segs[:, 2])
+        x_max = np.maximum(segs[:, 0], segs[:, 2])
+        y_min = np.minimum(segs[:, 1], segs[:, 3])
+        y_max = np.maximum(segs[:, 1], segs[:, 3])
+        
+        cx0 = np.floor(x_min / self.cell_size).astype(np.int64)
+        cx1 = np.floor(x_max / self.cell_size).astype(np.int64)
+        cy0 = np.floor(y_min / self.cell_size).astype(np.int64)
+        cy1 = np.floor(y_max / self.cell_size).astype(np.int64)
+        self._origin = (int(cx0.min()), int(cy0.min()))
+        self._columns = int(cx1.max()) - self._origin[0] + 1
+        
+        mx = np.floor((segs[:, 0] + segs[:, 2]) // 2 / self.cell_size).astype(np.int64)
+        my = np.floor((segs[:, 1] + segs[:, 3]) // 2 / self.cell_size).astype(np.int64)
+        self._cell_ranges = {
+            'segment': (cx0, cx1, cy0, cy1),
+            'center': (mx, mx, my, my)
+        }
+    
+    def _grid(self, mode):
+        """Sorted (cell id, segment index) arrays, built on first use"""
+        if mode not in self._grids:
+            self._grids[mode] = self._make_grid(*self._cell_ranges[mode])
+        return self._grids[mode]
+    
+    def _make_grid(self, cx0, cx1, cy0, cy1):
+        """Sorted (cell id, segment index) arrays for the given cell ranges"""
+        seg_ids, cell_ids = self._expand_cells(cx0, cx1, cy0, cy1)
+        order = np.argsort(cell_ids, kind='stable')
+        return cell_ids[order], seg_ids[order]
+    
+    def _expand_cells(self, cx0, cx1, cy0, cy1):
+        """Expand per-item cell ranges to flat (item index, cell id) pairs"""
+        widths = cx1 - cx0 + 1
+        heights = cy1 - cy0 + 1
+        counts = widths * heights
+        items = np.repeat(np.arange(len(counts)), counts)
+        
+        # Position of each pair within its item's block of cells
+        starts = np.cumsum(counts) - counts
+        local = np.arange(counts.sum()) - np.repeat(starts, counts)
+        col = cx0[items] + local % widths[items]
+        row = cy0[items] + local // widths[items]
+        
+        ox, oy = self._origin
+        # Cells outside the indexed area get ids that match nothing
+        valid = (col >= ox) & (col < ox + self._columns) & (row >= oy)
+        cell_ids = np.where(valid, (row - oy) * self._columns + (col - ox), -1)
+        return items, cell_ids
+    
+    def query(self, bboxes, radius=None, mode=None):
+        """Segments near each text box, for many boxes at once
+        
+        bboxes is a sequence of (x, y, w, h). In 'center' mode a segment
+        matches when its midpoint lies within radius of the box center; in
+        'segment' mode when the segment itself passes within radius of it.
+        Returns one array of segment indices per box.
+        """
+        boxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        if len(boxes) == 0:
+            return []
+        pair_boxes, pair_segs = self._matching_pairs(boxes, radius, mode)
+        splits = np.searchsorted(pair_boxes, np.arange(1, len(boxes)))
+        return np.split(pair_segs, splits)
+    
+    def near_any(self, bboxes, radius=None, mode=None):
+        """Boolean array: does any segment lie within radius of each box"""
+        boxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        pair_boxes, _ = self._matching_pairs(boxes, radius, mode)
+        return np.bincount(pair_boxes, minlength=len(boxes)) > 0
+    
+    def _matching_pairs(self, boxes, radius, mode):
+        """Sorted (box index, segment index) arrays of all matches"""
+        radius = radius or Config.LINE_ASSOCIATION_DISTANCE
+        mode = mode or Config.LINE_ASSOCIATION_MODE
+        if len(boxes) == 0 or len(self.segments) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        search_radius = radius + self.clearance.max()
+        
+        centers_x = boxes[:, 0] + boxes[:, 2] // 2
+        centers_y = boxes[:, 1] + boxes[:, 3] // 2
+        
+        # Candidate cells around each box center
+        cx0 = np.floor((centers_x - search_radius) / self.cell_size).astype(np.int64)
+        cx1 = np.floor((centers_x + search_radius) / self.cell_size).astype(np.int64)
+        cy0 = np.floor((centers_y - search_radius) / self.cell_size).astype(np.int64)
+        cy1 = np.floor((centers_y + search_radius) / self.cell_size).astype(np.int64)
+        box_ids, cell_ids = self._expand_cells(cx0, cx1, cy0, cy1)
+        
+        # Look up the run of segments registered in each candidate cell
+        grid_cells, grid_segments = self._grid('segment' if mode == 'segment' else 'center')
+        lo = np.searchsorted(grid_cells, cell_ids, side='left')
+        hi = np.searchsorted(grid_cells, cell_ids, side='right')
+        hi[cell_ids < 0] = lo[cell_ids < 0]
+        counts = hi - lo
+        pair_boxes = np.repeat(box_ids, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_segs = grid_segments[np.repeat(lo, counts) + offsets]
+        
+        # A long segment can be reached through several cells
+        pairs = np.unique(pair_boxes * len(self.segments) + pair_segs)
+        pair_boxes = pairs // len(self.segments)
+        pair_segs = pairs % len(self.segments)
+        
+        px, py = centers_x[pair_boxes], centers_y[pair_boxes]
+        segs = self.segments[pair_segs]
+        if mode == 'segment':
+            distance = self._point_segment_distance(px, py, segs)
+        else:
+            mid_x = (segs[:, 0] + segs[:, 2]) // 2
+            mid_y = (segs[:, 1] + segs[:, 3]) // 2
+            distance = np.hypot(px - mid_x, py - mid_y)
+        
+        keep = distance < radius + self.clearance[pair_segs]
+        return pair_boxes[keep], pair_segs[keep]
+    
+    @staticmethod
+    def _point_segment_distance(px, py, segs):
+        """Distance from points to segments, element-wise"""
+        x1, y1, x2, y2 = segs[:, 0], segs[:, 1], segs[:, 2], segs[:, 3]
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+        t = np.where(
+            length_sq > 0,
+            ((px - x1) * dx + (py - y1) * dy) / np.where(length_sq > 0, length_sq, 1),
+            0.0
+        )
+        t = np.clip(t, 0.0, 1.0)
+        return np.hypot(px - (x1 + t * dx), py - (y1 + t * dy))
+    
+    def segment_tuples(self, indices):
+        """Segments as (x1, y1, x2, y2) integer tuples"""
+        return [tuple(int(v) for v in self.segments[i]) for i in indices]
@@ -1,12 +1,17 @@
 import streamlit as st
 import os
+import json
 import tempfile
-from pdf_processor import PDFProcessor
-from dimension_detector import DimensionDetector
-from balloon_engine import BalloonEngine
+import time
+import uuid
+from pipeline import PagePipeline
+from result_cache import ResultCache
+from revision import RevisionPipeline
+from job_service import JobClient, ServiceError
 from cmm_exporter import CMMExporter
-from drawing_standards import DrawingStandards
+from drawing_standards import detected_standard
 from config import Config
+from instrumentation import tracer
 import cv2
 
 # Initialize configuration
@@ -19,6 +24,224 @@ st.set_page_config(
     page_icon="🎈"
 )
 
+def stage_table(summary):
+    """Rows for a stage timing table from Tracer.summary()"""
+    return [
+        {
+            'Stage': name,
+            'Calls': total['calls'],
+            'Wall (ms)': round(total['wall'] * 1000, 1),
+            'CPU (ms)': round(total['cpu'] * 1000, 1),
+            'Peak RSS (MB)': round(total['peak_rss_mb'], 1),
+            'Counts': ', '.join(f"{key}={value}" for key, value in total['counts'].items())
+        }
+        for name, total in summary.items()
+    ]
+
+def show_preview(result, kind, caption):
+    """Show a page thumbnail; zoomed tiles are only loaded on request
+    
+    Zoom levels are given relative to Config.DPI, which coarse to fine page
+    images (result.scale below 1) do not reach.
+    """
+    st.image(result.preview(kind), caption=caption, use_column_width=True)
+    
+    pyramid = result.pyramids.get(kind)
+    if pyramid is None or pyramid.top_level == 0:
+        return
+    key = f"{kind}_{result.page_num}"
+    if not st.checkbox("Zoom", key=f"zoom_{key}"):
+        return
+    
+    level = st.select_slider(
+        "Detail",
+        options=list(range(pyramid.top_level - 1, -1, -1)),
+        format_func=lambda level: f"{round(100 * result.scale / 2**level)}%",
+        key=f"level_{key}"
+    )
+    height, width = pyramid.shapes[level]
+    view = Config.PREVIEW_THUMBNAIL_SIZE
+    x = y = 0
+    if width > view:
+        x = st.slider("Horizontal position", 0, width - view, (width - view) // 2, key=f"x_{key}")
+    if height > view:
+        y = st.slider("Vertical position", 0, height - view, (height - view) // 2, key=f"y_{key}")
+    st.image(pyramid.region(level, x, y, view, view), use_column_width=True)
+
+def show_revision(pdf_path, drawing_id, standard):
+    """Balloon an upload as the next revision of a drawing and list changes
+    
+    The result is kept for the session, since every widget interaction
+    reruns the script and the same upload must not count as a new revision.
+    Returns the pages' PageResults with previews, like PagePipeline.run.
+    """
+    revision = RevisionPipeline(standard, cache=ResultCache())
+    key = (drawing_id, standard, ResultCache.hash_file(pdf_path))
+    if st.session_state.get('revision_key') != key:
+        st.session_state.revision_result = revision.run(pdf_path, drawing_id)
+        st.session_state.revision_key = key
+    result = st.session_state.revision_result
+    
+    st.subheader(f"Revision of {drawing_id}")
+    st.write(
+        f"{result.pages_reprocessed} pages and {result.regions_reprocessed} "
+        f"regions reprocessed; {len(result.changes)} balloons changed"
+    )
+    if result.changes:
+        st.dataframe(result.changes)
+    return revision.previews(pdf_path, result)
+
+# Export files of the job service and how they are offered for download
+JOB_DOWNLOADS = {
+    'balloon_report.xlsx': ("Download Excel Report", "application/vnd.ms-excel"),
+    'balloon_report.csv': ("Download CSV Report", "text/csv"),
+    'balloon_report.pdf': ("Download PDF Report", "application/pdf"),
+    'balloon_report.txt': ("Download CMM Table", "text/tab-separated-values"),
+    'balloon_report.qif': ("Download QIF File", "application/xml"),
+    'balloon_report.ballooned.pdf': ("Download Ballooned PDF", "application/pdf")
+}
+
+def show_job(uploaded_file, standard):
+    """Hand an upload to the job service and follow its progress
+    
+    The job id is kept in the URL, so a browser refresh resumes following
+    the same job instead of processing the drawing again.
+    """
+    client = JobClient(Config.JOB_SERVICE_URL)
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    
+    if uploaded_file is not None:
+        upload_key = (uploaded_file.file_id, standard)
+        if st.session_state.get('job_upload') != upload_key:
+            job = client.submit(
+                uploaded_file.getvalue(), uploaded_file.name,
+                user=st.session_state.session_id, standard=standard
+            )
+            st.session_state.job_upload = upload_key
+            st.query_params['job'] = job['id']
+    job_id = st.query_params.get('job')
+    if job_id is None:
+        return
+    
+    try:
+        status = client.status(job_id)
+    except ServiceError as e:
+        # Finished jobs expire on the service; forget the stale link
+        st.error(f"Job {job_id}: {e}")
+        del st.query_params['job']
+        return
+    if status['state'] in ('queued', 'running', 'exporting') and st.button("Cancel"):
+        status = client.cancel(job_id)
+    if status['state'] in ('queued', 'running', 'exporting'):
+        # Poll by rerunning the script, so the session stays responsive
+        st.progress(
+            status['progress'],
+            text=f"{status['name']}: {status['state']}, "
+                 f"{status['pages_done']} of {status['page_count']} pages"
+        )
+        time.sleep(Config.JOB_POLL_INTERVAL)
+        st.rerun()
+    
+    if status['state'] != 'done':
+        st.error(f"Job {status['state']}" + (f": {status['error']}" if status['error'] else ""))
+        return
+    
+    balloons = client.result(job_id)
+    st.success(
+        f"✅ Processed {status['page_count']} pages with "
+        f"{status['dimensions']} dimensions detected"
+    )
+    st.dataframe(balloons)
+    
+    st.divider()
+    st.subheader("Export Results")
+    columns = st.columns(len(status['outputs']))
+    for column, name in zip(columns, status['outputs']):
+        label, mime = JOB_DOWNLOADS.get(name, (f"Download {name}", "application/octet-stream"))
+        with column:
+            st.download_button(
+                label=label,
+                data=client.download(job_id, name),
+                file_name=name,
+                mime=mime
+            )
+
+def show_exports(exporter, pdf_path, file_name):
+    """Export buttons; each export runs on the rerun its button triggers"""
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
+    with col1:
+        if st.button("Export to Excel"):
+            excel_path = exporter.to_excel()
+            st.success(f"Excel report saved to: {excel_path}")
+            with open(excel_path, "rb") as f:
+                st.download_button(
+                    label="Download Excel Report",
+                    data=f,
+                    file_name="balloon_report.xlsx",
+                    mime="application/vnd.ms-excel"
+                )
+    
+    with col2:
+        if st.button("Export to CSV"):
+            csv_path = exporter.to_csv()
+            st.success(f"CSV report saved to: {csv_path}")
+            with open(csv_path, "rb") as f:
+                st.download_button(
+                    label="Download CSV Report",
+                    data=f,
+                    file_name="balloon_report.csv",
+                    mime="text/csv"
+                )
+    
+    with col3:
+        if st.button("Generate PDF Report"):
+            report_path = exporter.to_pdf_report(file_name)
+            st.success(f"PDF report saved to: {report_path}")
+            with open(report_path, "rb") as f:
+                st.download_button(
+                    label="Download PDF Report",
+                    data=f,
+                    file_name="balloon_report.pdf",
+                    mime="application/pdf"
+                )
+    
+    with col4:
+        if st.button("Export CMM Table"):
+            cmm_path = exporter.to_cmm_text()
+            st.success(f"CMM table saved to: {cmm_path}")
+            with open(cmm_path, "rb") as f:
+                st.download_button(
+                    label="Download CMM Table",
+                    data=f,
+                    file_name="balloon_report.txt",
+                    mime="text/tab-separated-values"
+                )
+    
+    with col5:
+        if st.button("Export QIF"):
+            qif_path = exporter.to_qif()
+            st.success(f"QIF file saved to: {qif_path}")
+            with open(qif_path, "rb") as f:
+                st.download_button(
+                    label="Download QIF File",
+                    data=f,
+                    file_name="balloon_report.qif",
+                    mime="application/xml"
+                )
+    
+    with col6:
+        if st.button("Export Ballooned PDF"):
+            ballooned_path = exporter.to_ballooned_pdf(pdf_path)
+            st.success(f"Ballooned PDF saved to: {ballooned_path}")
+            with open(ballooned_path, "rb") as f:
+                st.download_button(
+                    label="Download Ballooned PDF",
+                    data=f,
+                    file_name="ballooned_drawing.pdf",
+                    mime="application/pdf"
+                )
+
 def main():
     st.title("🎈 Advanced Engineering Drawing Ballooning Software")
     st.markdown("""
@@ -31,10 +254,22 @@ def main():
         st.header("Configuration")
         drawing_standard = st.selectbox(
             "Drawing Standard",
-            DrawingStandards.SUPPORTED_STANDARDS,
-            index=0
+            ['AUTO'] + Config.SUPPORTED_STANDARDS,
+            index=0,
+            help="AUTO picks the standard whose tolerance notation each page uses"
+        )
+        coarse_to_fine = st.checkbox(
+            "Fast analysis",
+            value=Config.COARSE_TO_FINE,
+            help=f"Analyse pages at {Config.ANALYSIS_DPI} DPI and OCR only their text "
+                 f"at {Config.DPI} DPI; previews are at the lower resolution"
         )
         show_debug = st.checkbox("Show Debug Information", value=False)
+        drawing_id = st.text_input(
+            "Drawing Number (revision tracking)",
+            help="Reprocess only what changed since the last upload of this "
+                 "drawing number and keep its balloon IDs"
+        ).strip()
         st.divider()
         st.info("""
         This software automates dimension ballooning for:
@@ -50,106 +285,109 @@ def main():
         accept_multiple_files=False
     )
     
-    if uploaded_file is not None:
+    # Revision tracking keeps its state in this process, so it never goes
+    # to the job service
+    if Config.JOB_SERVICE_URL and not drawing_id and (
+            uploaded_file is not None or 'job' in st.query_params):
+        show_job(uploaded_file, drawing_standard)
+    
+    elif uploaded_file is not None:
         # Save uploaded file
         with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
             tmp_file.write(uploaded_file.getvalue())
             pdf_path = tmp_file.name
         
+        # Process PDF; pages stream back in order as workers finish them
+        pipeline = PagePipeline(
+            drawing_standard, cache=ResultCache(), coarse_to_fine=coarse_to_fine
+        )
+        
         try:
-            # Process PDF
-            pdf_processor = PDFProcessor()
-            pdf_images = pdf_processor.pdf_to_images(pdf_path)
-            processed_images = [pdf_processor.preprocess_image(img) for img in pdf_images]
-            
-            # Detect dimensions
-            detector = DimensionDetector(drawing_standard)
             all_dimensions = []
             all_balloons = []
+            page_count = 0
             
-            for page_num, img in enumerate(processed_images):
-                dimensions = detector.detect_dimensions(img, page_num)
-                all_dimensions.extend(dimensions)
-                
-                # Create balloon engine for this page
-                img_height, img_width = img.shape[:2]
-                balloon_engine = BalloonEngine(img_width, img_height)
-                
-                # Place balloons
-                for dimension in dimensions:
-                    balloon_engine.place_balloon(dimension)
-                
-                all_balloons.extend(balloon_engine.balloons)
-                
-                # Draw balloons on original image
-                original_img = pdf_images[page_num]
-                img_with_balloons = balloon_engine.draw_balloons(original_img)
-                
-                # Display results
-                st.subheader(f"Page {page_num+1}")
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.image(original_img, caption="Original Drawing", use_column_width=True)
-                
-                with col2:
-                    st.image(img_with_balloons, caption="Ballooned Drawing", use_column_width=True)
-                
-                # Show debug info if enabled
-                if show_debug:
-                    with st.expander(f"Debug Info - Page {page_num+1}"):
-                        st.write(f"Detected {len(dimensions)} dimensions")
-                        st.write(dimensions)
-                        st.image(img, caption="Processed Image", use_column_width=True)
+            # Stage timings are recorded while debugging, into records of
+            # this session's own
+            with tracer.recording(show_debug) as run_trace:
+                if drawing_id:
+                    results = show_revision(pdf_path, drawing_id, drawing_standard)
+                else:
+                    results = pipeline.run(pdf_path)
+                for result in results:
+                    page_num = result.page_num
+                    dimensions = result.dimensions
+                    page_count += 1
+                    all_dimensions.extend(dimensions)
+                    all_balloons.extend(result.balloons)
+                    
+                    # Display results
+                    st.subheader(f"Page {page_num+1}")
+                    col1, col2 = st.columns(2)
+                    
+                    with col1:
+                        show_preview(result, 'image', "Original Drawing")
+                    
+                    with col2:
+                        if result.has('ballooned'):
+                            show_preview(result, 'ballooned', "Ballooned Drawing")
+                        else:
+                            st.info("Balloons are only drawn in the ballooned PDF export")
+                    
+                    # Show debug info if enabled
+                    if show_debug:
+                        with st.expander(f"Debug Info - Page {page_num+1}"):
+                            st.write(f"Detected {len(dimensions)} dimensions")
+                            st.write("Toleranced tokens per standard", result.standard_hits)
+                            st.write(dimensions)
+                            st.image(result.preview('processed'), caption="Processed Image", use_column_width=True)
+                            st.write("Stage timings")
+                            st.dataframe(stage_table(tracer.summary(result.trace)))
             
             # Show summary
-            st.success(f"✅ Processed {len(pdf_images)} pages with {len(all_dimensions)} dimensions detected")
+            st.success(f"✅ Processed {page_count} pages with {len(all_dimensions)} dimensions detected")
+            
+            # Reports are formatted in the standard the drawing turned out to use
+            report_standard = drawing_standard
+            if drawing_standard == 'AUTO':
+                report_standard = detected_standard(all_dimensions)
+                st.info(f"Detected drawing standard: {report_standard}")
             
             # Export options
             st.divider()
             st.subheader("Export Results")
             
-            exporter = CMMExporter(all_balloons, drawing_standard)
-            
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                if st.button("Export to Excel"):
-                    excel_path = exporter.to_excel()
-                    st.success(f"Excel report saved to: {excel_path}")
-                    with open(excel_path, "rb") as f:
-                        st.download_button(
-                            label="Download Excel Report",
-                            data=f,
-                            file_name="balloon_report.xlsx",
-                            mime="application/vnd.ms-excel"
-                        )
+            # Reports of concurrent sessions go to separate folders
+            if 'session_id' not in st.session_state:
+                st.session_state.session_id = uuid.uuid4().hex
+            exporter = CMMExporter(
+                all_balloons, report_standard, session_id=st.session_state.session_id
+            )
             
-            with col2:
-                if st.button("Export to CSV"):
-                    csv_path = exporter.to_csv()
-                    st.success(f"CSV report saved to: {csv_path}")
-                    with open(csv_path, "rb") as f:
-                        st.download_button(
-                            label="Download CSV Report",
-                            data=f,
-                            file_name="balloon_report.csv",
-                            mime="text/csv"
-                        )
+            with tracer.recording(show_debug) as export_trace:
+                show_exports(exporter, pdf_path, uploaded_file.name)
             
-            with col3:
-                if st.button("Generate PDF Report"):
-                    pdf_path = exporter.to_pdf_report(uploaded_file.name)
-                    st.success(f"PDF report saved to: {pdf_path}")
-                    with open(pdf_path, "rb") as f:
-                        st.download_button(
-                            label="Download PDF Report",
-                            data=f,
-                            file_name="balloon_report.pdf",
-                            mime="application/pdf"
-                        )
+            # After the exports, which run on the rerun their button triggers.
+            # Their records are kept in the session for the reruns that
+            # follow, e.g. the one of a download button.
+            if show_debug:
+                if st.session_state.get('export_trace_file') != uploaded_file.file_id:
+                    st.session_state.export_trace = []
+                    st.session_state.export_trace_file = uploaded_file.file_id
+                st.session_state.export_trace.extend(export_trace)
+                records = run_trace + st.session_state.export_trace
+                with st.expander("Timing Breakdown - All Pages"):
+                    st.dataframe(stage_table(tracer.summary(records)))
+                    st.download_button(
+                        label="Download Trace (Chrome/Perfetto JSON)",
+                        data=json.dumps(tracer.to_chrome_trace(records)),
+                        file_name="balloon_trace.json",
+                        mime="application/json"
+                    )
         
         finally:
             # Clean up temporary files
+            pipeline.close()
             os.unlink(pdf_path)
     
     else:
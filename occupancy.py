@@ -0,0 +1,83 @@
+import math
+
+class OccupancyGrid:
+    """Sparse uniform-grid hash of occupied circles, rectangles and segments
+    
+    Only cells that actually contain something are stored, so memory grows
+    with the number of shapes rather than with the page area. A collision
+    query only looks at the shapes registered in the few cells a circle
+    touches.
+    """
+    
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}  # (col, row) -> list of shape indices
+        self.shapes = []  # (kind, geometry)
+    
+    def _cell_range(self, x0, y0, x1, y1):
+        size = self.cell_size
+        return (
+            range(math.floor(x0 / size), math.floor(x1 / size) + 1),
+            range(math.floor(y0 / size), math.floor(y1 / size) + 1)
+        )
+    
+    def _register(self, kind, geometry, bounds):
+        index = len(self.shapes)
+        self.shapes.append((kind, geometry))
+        cols, rows = self._cell_range(*bounds)
+        for col in cols:
+            for row in rows:
+                self.cells.setdefault((col, row), []).append(index)
+    
+    def add_circle(self, x, y, radius):
+        """Mark a circle as occupied"""
+        self._register('circle', (x, y, radius), (x - radius, y - radius, x + radius, y + radius))
+    
+    def add_rect(self, x0, y0, x1, y1):
+        """Mark an axis-aligned rectangle as occupied"""
+        self._register('rect', (x0, y0, x1, y1), (x0, y0, x1, y1))
+    
+    def add_segment(self, x1, y1, x2, y2, clearance=0):
+        """Mark a line segment, widened by clearance on each side, as occupied"""
+        bounds = (
+            min(x1, x2) - clearance, min(y1, y2) - clearance,
+            max(x1, x2) + clearance, max(y1, y2) + clearance
+        )
+        self._register('segment', (x1, y1, x2, y2, clearance), bounds)
+    
+    def collides_circle(self, x, y, radius):
+        """True if a circle overlaps any occupied shape"""
+        cols, rows = self._cell_range(x - radius, y - radius, x + radius, y + radius)
+        seen = set()
+        for col in cols:
+            for row in rows:
+                for index in self.cells.get((col, row), ()):
+                    if index in seen:
+                        continue
+                    seen.add(index)
+                    if self._overlaps(self.shapes[index], x, y, radius):
+                        return True
+        return False
+    
+    @staticmethod
+    def _overlaps(shape, x, y, radius):
+        kind, geometry = shape
+        if kind == 'circle':
+            cx, cy, r = geometry
+            return (x - cx) ** 2 + (y - cy) ** 2 < (radius + r) ** 2
+        
+        if kind == 'rect':
+            x0, y0, x1, y1 = geometry
+            # Closest point of the rectangle to the circle center
+            nx = min(max(x, x0), x1)
+            ny = min(max(y, y0), y1)
+            return (x - nx) ** 2 + (y - ny) ** 2 < radius ** 2
+        
+        x1, y1, x2, y2, clearance = geometry
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+        t = 0.0
+        if length_sq > 0:
+            t = min(1.0, max(0.0, ((x - x1) * dx + (y - y1) * dy) / length_sq))
+        nx, ny = x1 + t * dx, y1 + t * dy
+        return (x - nx) ** 2 + (y - ny) ** 2 < (radius + clearance) ** 2
@@ -0,0 +1,149 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytesseract
+from config import Config
+try:
+    import tesserocr
+except ImportError:  # Optional: pytesseract is used instead
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+def _empty_data():
+    """Word dict in the layout of pytesseract.image_to_data"""
+    return {'text': [], 'conf': [], 'left': [], 'top': [], 'width': [], 'height': []}
+
+class OCREngine:
+    """Common interface of the OCR backends
+    
+    image_to_data() reads one image; map() spreads many images over
+    `workers` threads, so N workers keep N cores busy.
+    """
+    def __init__(self, workers=1):
+        self.workers = max(1, workers)
+        self.executor = None
+    
+    def image_to_data(self, img):
+        """Words of an image as lists of text, conf, left, top, width, height"""
+        raise NotImplementedError
+    
+    def map(self, images):
+        """image_to_data for every image, in input order"""
+        if self.workers == 1 or len(images) <= 1:
+            return [self.image_to_data(img) for img in images]
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='ocr'
+            )
+        return list(self.executor.map(self.image_to_data, images))
+    
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+class PytesseractEngine(OCREngine):
+    """Fallback backend: one tesseract process per call"""
+    
+    def image_to_data(self, img):
+        data = pytesseract.image_to_data(
+            img, output_type=pytesseract.Output.DICT, config='--psm 6'
+        )
+        return {key: data[key] for key in _empty_data()}
+
+class TesserocrEngine(OCREngine):
+    """In-process Tesseract through tesserocr
+    
+    Keeps one PyTessBaseAPI per worker with the language model loaded, and
+    hands it raw pixel buffers, so there is no process start, model load or
+    temp file per call. tesserocr releases the GIL while recognizing, so the
+    worker threads run in parallel.
+    """
+    
+    def __init__(self, workers=1, lang='eng'):
+        super().__init__(workers)
+        self.lang = lang
+        self.apis = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+    
+    def _acquire(self):
+        """An idle API instance, created on first use up to one per worker"""
+        try:
+            return self.apis.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.workers:
+                self.created += 1
+                return tesserocr.PyTessBaseAPI(lang=self.lang, psm=tesserocr.PSM.SINGLE_BLOCK)
+        return self.apis.get()
+    
+    def image_to_data(self, img):
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        height, width = img.shape[:2]
+        channels = 1 if img.ndim == 2 else img.shape[2]
+        data = _empty_data()
+        
+        api = self._acquire()
+        try:
+            api.SetImageBytes(img.tobytes(), width, height, channels, width * channels)
+            api.Recognize()
+            level = tesserocr.RIL.WORD
+            for word in tesserocr.iterate_level(api.GetIterator(), level):
+                text = word.GetUTF8Text(level)
+                box = word.BoundingBox(level)
+                if not text or box is None:
+                    continue
+                x0, y0, x1, y1 = box
+                data['text'].append(text)
+                data['conf'].append(word.Confidence(level))
+                data['left'].append(x0)
+                data['top'].append(y0)
+                data['width'].append(x1 - x0)
+                data['height'].append(y1 - y0)
+        finally:
+            api.Clear()
+            self.apis.put(api)
+        return data
+    
+    def close(self):
+        super().close()
+        while not self.apis.empty():
+            self.apis.get_nowait().End()
+        self.created = 0
+
+# One engine per (backend, workers) and process, reused by every detector
+_engines = {}
+
+def get_ocr_engine(workers=None, backend=None):
+    """Shared OCR engine for this process
+    
+    backend is 'tesserocr', 'pytesseract' or 'auto' (tesserocr if it is
+    installed); both default to the Config settings.
+    """
+    workers = workers or Config.OCR_WORKERS
+    backend = backend or Config.OCR_BACKEND
+    fallback = backend == 'auto' and tesserocr is None
+    if backend == 'auto':
+        backend = 'pytesseract' if tesserocr is None else 'tesserocr'
+    if backend == 'tesserocr' and tesserocr is None:
+        raise ImportError("OCR_BACKEND is 'tesserocr' but tesserocr is not installed")
+    
+    key = (backend, workers)
+    if key not in _engines:
+        if backend == 'tesserocr':
+            logger.info("OCR backend: tesserocr, in process")
+        elif fallback:
+            logger.warning(
+                "OCR backend: pytesseract, one tesseract process per call; "
+                "pip install tesserocr (see requirements.txt) to OCR in process"
+            )
+        else:
+            logger.info("OCR backend: pytesseract")
+        engine_class = TesserocrEngine if backend == 'tesserocr' else PytesseractEngine
+        _engines[key] = engine_class(workers)
+    return _engines[key]
@@ -3,43 +3,297 @@ import cv2
 import numpy as np
 import os
 from config import Config
+from instrumentation import traced, tracer
+
+class _PixmapBuffer:
+    """Exposes a Pixmap's samples to NumPy without copying them
+    
+    The array keeps this object, and so the Pixmap, alive as its base.
+    """
+    
+    def __init__(self, pix):
+        self.pix = pix
+        shape = (pix.height, pix.width) if pix.n == 1 else (pix.height, pix.width, pix.n)
+        strides = (pix.stride, pix.n) if pix.n == 1 else (pix.stride, pix.n, 1)
+        self.__array_interface__ = {
+            'shape': shape,
+            'typestr': '|u1',
+            'data': (pix.samples_ptr, True),  # Read-only
+            'strides': strides,
+            'version': 3
+        }
 
 class PDFProcessor:
+    # Structuring element of the noise-reduction opening
+    OPEN_KERNEL = np.ones((2, 2), np.uint8)
+    
     def __init__(self):
         Config.init_folders()
+        self._threshold_buffers = {}  # Last page shape -> reusable threshold output
     
     def pdf_to_images(self, pdf_path):
         """Convert PDF to high-resolution images"""
-        images = []
+        return [img for _, img in self.iter_pages(pdf_path)]
+    
+    def iter_pages(self, pdf_path):
+        """Yield (page_num, image) one page at a time
+        
+        Only the current page is held in memory, unlike pdf_to_images.
+        """
+        with fitz.open(pdf_path) as doc:
+            for page_num in range(len(doc)):
+                page = doc.load_page(page_num)
+                yield page_num, self.render_page(page)
+    
+    @traced('render_page')
+    def render_page(self, page, gray=False, clip=None, dpi=None):
+        """Render a single PDF page to an RGB (or grayscale) image at Config.DPI
+        
+        clip is an (x, y, w, h) box in image pixels: only that part of the
+        page is rendered. dpi overrides Config.DPI.
+        """
+        zoom = (dpi or Config.DPI) / 72  # 72 is default DPI
+        mat = fitz.Matrix(zoom, zoom)
+        if clip is not None:
+            x, y, w, h = clip
+            clip = fitz.Rect(x, y, x + w, y + h) * ~mat
+        pix = page.get_pixmap(
+            matrix=mat, colorspace=fitz.csGRAY if gray else fitz.csRGB, clip=clip
+        )
+        return self.pixmap_array(pix)
+    
+    @staticmethod
+    def pixmap_array(pix):
+        """Read-only (height, width[, n]) view of a Pixmap's samples, no copy
+        
+        Rows keep the pixmap's stride, which may exceed width * n.
+        """
+        return np.asarray(_PixmapBuffer(pix))
+    
+    @traced('render_fine')
+    def render_boxes(self, pdf_path, page_num, boxes, dpis):
+        """Preprocessed crops of (x, y, w, h) page boxes, each at its own DPI
+        
+        Boxes are in image pixels at Config.DPI. Lets text regions found on
+        a page analysed at a low resolution be OCR'd at a high one.
+        """
+        crops = []
+        with fitz.open(pdf_path) as doc:
+            page = doc.load_page(page_num)
+            for (x, y, w, h), dpi in zip(boxes, dpis):
+                factor = dpi / Config.DPI
+                mat = fitz.Matrix(dpi / 72, dpi / 72)
+                clip = fitz.Rect(x * factor, y * factor, (x + w) * factor, (y + h) * factor)
+                pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, clip=clip * ~mat)
+                crops.append(self.binarize(self.pixmap_array(pix)))
+        tracer.count('pixels', sum(crop.size for crop in crops))
+        return crops
+    
+    @staticmethod
+    def page_count(pdf_path):
+        """Number of pages in a PDF"""
+        with fitz.open(pdf_path) as doc:
+            return len(doc)
+    
+    def extract_text_layer(self, pdf_path):
+        """Extract native text words and raster regions for each page
+        
+        Coordinates are scaled to image pixels at Config.DPI so they line up
+        with the rendered pages. Pages without any text are reported as a
+        single full-page raster region so they go through OCR instead.
+        """
+        text_layers = []
         doc = fitz.open(pdf_path)
+        zoom = Config.DPI / 72
         
         for page_num in range(len(doc)):
             page = doc.load_page(page_num)
-            zoom = Config.DPI / 72  # 72 is default DPI
-            mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat)
-            img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(
-                pix.height, pix.width, 3)
-            images.append(img)
+            text_layers.append(self.get_page_text_layer(page, zoom))
+        
+        doc.close()
+        return text_layers
+    
+    @traced('extract_text_layer')
+    def get_page_text_layer(self, page, zoom):
+        """Word boxes and raster (image) regions of a single page"""
+        # Text and image positions are reported on the unrotated page,
+        # the rendered pixmap is rotated
+        mat = page.rotation_matrix * fitz.Matrix(zoom, zoom)
+        
+        words = []
+        for x0, y0, x1, y1, text, block, line, _ in page.get_text("words"):
+            rect = fitz.Rect(x0, y0, x1, y1) * mat
+            words.append({
+                'text': text,
+                'bbox': (rect.x0, rect.y0, rect.x1, rect.y1),
+                'line': (block, line)
+            })
+        
+        tracer.count('words', len(words))
         
-        return images
+        page_rect = page.rect * fitz.Matrix(zoom, zoom)
+        raster_regions = []
+        if not words:
+            # Scanned page: everything has to be OCR'd
+            raster_regions.append(self._to_pixel_box(page_rect))
+        else:
+            # Raster inserts (pasted scans, screenshots) carry no text layer
+            for info in page.get_image_info():
+                rect = (fitz.Rect(info['bbox']) * mat) & page_rect
+                if not rect.is_empty:
+                    raster_regions.append(self._to_pixel_box(rect))
+        
+        return {'words': words, 'raster_regions': raster_regions}
     
-    def preprocess_image(self, img):
-        """Enhance image for better OCR and line detection"""
+    @traced('extract_geometry')
+    def get_page_geometry(self, page, zoom):
+        """Line segments and arrowheads from the page's vector drawings
+        
+        Returns 'segments' as an (N, 4) float array of x1, y1, x2, y2 image
+        pixels (straight lines, rectangle and quad edges, curve chords of at
+        least Config.LINE_MIN_LENGTH), 'arrows' as an (M, 4) array of x, y,
+        w, h boxes of small filled shapes, and the page's 'raster_regions',
+        whose lines are not in the drawings.
+        """
+        mat = page.rotation_matrix * fitz.Matrix(zoom, zoom)
+        
+        starts, ends, arrows = [], [], []
+        for path in page.get_cdrawings():
+            x0, y0, x1, y1 = path['rect']
+            if 'f' in path['type'] and \
+                    max(x1 - x0, y1 - y0) * zoom <= Config.ARROW_MAX_SIZE:
+                arrows.append(((x0, y0), (x1, y1)))
+                continue
+            for item in path['items']:
+                kind = item[0]
+                if kind == 'l':
+                    starts.append(item[1])
+                    ends.append(item[2])
+                elif kind == 'c':
+                    # Leaders and arcs: the chord is close enough for association
+                    starts.append(item[1])
+                    ends.append(item[4])
+                elif kind == 're':
+                    rx0, ry0, rx1, ry1 = item[1]
+                    corners = [(rx0, ry0), (rx1, ry0), (rx1, ry1), (rx0, ry1)]
+                    starts.extend(corners)
+                    ends.extend(corners[1:] + corners[:1])
+                elif kind == 'qu':
+                    ul, ur, ll, lr = item[1]
+                    starts.extend([ul, ur, lr, ll])
+                    ends.extend([ur, lr, ll, ul])
+        
+        segments = np.hstack([
+            self._transform(starts, mat), self._transform(ends, mat)
+        ]) if starts else np.empty((0, 4))
+        length = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+        segments = segments[length >= Config.LINE_MIN_LENGTH]
+        tracer.count('segments', len(segments))
+        
+        if arrows:
+            corners = np.array(arrows, dtype=np.float64).reshape(-1, 2)
+            corners = self._transform(corners, mat).reshape(-1, 4)
+            top_left = np.minimum(corners[:, :2], corners[:, 2:])
+            arrows = np.hstack([top_left, np.abs(corners[:, 2:] - corners[:, :2])])
+        else:
+            arrows = np.empty((0, 4))
+        
+        page_rect = page.rect * fitz.Matrix(zoom, zoom)
+        raster_regions = []
+        for info in page.get_image_info():
+            rect = (fitz.Rect(info['bbox']) * mat) & page_rect
+            if not rect.is_empty:
+                raster_regions.append(self._to_pixel_box(rect))
+        
+        return {'segments': segments, 'arrows': arrows, 'raster_regions': raster_regions}
+    
+    @staticmethod
+    def crop_geometry(geometry, box, origin):
+        """The part of a page geometry inside an (x, y, w, h) box
+        
+        Segments and arrows are picked by their center; all coordinates are
+        shifted so that origin becomes (0, 0).
+        """
+        x, y, w, h = box
+        ox, oy = origin
+        
+        def inside(cx, cy):
+            return (cx >= x) & (cx < x + w) & (cy >= y) & (cy < y + h)
+        
+        segments = geometry['segments']
+        segments = segments[inside(
+            (segments[:, 0] + segments[:, 2]) / 2, (segments[:, 1] + segments[:, 3]) / 2
+        )] - [ox, oy, ox, oy]
+        arrows = geometry['arrows']
+        arrows = arrows[inside(
+            arrows[:, 0] + arrows[:, 2] / 2, arrows[:, 1] + arrows[:, 3] / 2
+        )] - [ox, oy, 0, 0]
+        
+        raster_regions = []
+        for rx, ry, rw, rh in geometry['raster_regions']:
+            x0, y0 = max(rx, x), max(ry, y)
+            x1, y1 = min(rx + rw, x + w), min(ry + rh, y + h)
+            if x1 > x0 and y1 > y0:
+                x0, y0 = max(x0, ox), max(y0, oy)
+                raster_regions.append((x0 - ox, y0 - oy, x1 - x0, y1 - y0))
+        
+        return {'segments': segments, 'arrows': arrows, 'raster_regions': raster_regions}
+    
+    @staticmethod
+    def _transform(points, mat):
+        """Apply a fitz.Matrix to an (N, 2) sequence of points"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        return np.column_stack([
+            points[:, 0] * mat.a + points[:, 1] * mat.c + mat.e,
+            points[:, 0] * mat.b + points[:, 1] * mat.d + mat.f
+        ])
+    
+    @staticmethod
+    def _to_pixel_box(rect):
+        """Convert a rect in image space to an integer (x, y, w, h) box"""
+        x0, y0 = int(rect.x0), int(rect.y0)
+        x1, y1 = int(np.ceil(rect.x1)), int(np.ceil(rect.y1))
+        return (x0, y0, x1 - x0, y1 - y0)
+    
+    @traced('preprocess_image')
+    def preprocess_image(self, img, out=None, denoise=True):
+        """Enhance image for better OCR and line detection
+        
+        img is RGB or already grayscale. The threshold step writes into a
+        buffer reused for every page of the same size; the result goes to
+        out if given, else to a new array, since callers keep it. See
+        binarize for denoise.
+        """
         # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        
+        shape = gray.shape
+        if shape not in self._threshold_buffers:
+            self._threshold_buffers = {shape: np.empty(shape, np.uint8)}
+        thresh = self._threshold_buffers[shape]
         
+        if out is None:
+            out = np.empty(shape, np.uint8)
+        return self.binarize(gray, thresh, out, denoise)
+    
+    @classmethod
+    def binarize(cls, gray, thresh=None, out=None, denoise=True):
+        """Adaptive threshold and noise reduction of a grayscale image
+        
+        thresh and out are optional output buffers of the threshold and of
+        the result. Without denoise the noise reduction is skipped: at low
+        resolutions it would erase the strokes of small text.
+        """
         # Apply adaptive thresholding
         thresh = cv2.adaptiveThreshold(
-            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY_INV, 11, 2
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY_INV, 11, 2, dst=thresh if denoise else out
         )
+        if not denoise:
+            return thresh
         
         # Noise reduction
-        kernel = np.ones((2, 2), np.uint8)
-        processed = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
-        
-        return processed
+        return cv2.morphologyEx(thresh, cv2.MORPH_OPEN, cls.OPEN_KERNEL, dst=out)
     
     def save_temp_image(self, img, page_num):
         """Save temporary image for debugging"""
@@ -0,0 +1,787 @@
+import functools
+import os
+import shutil
+import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+from config import Config
+from pdf_processor import PDFProcessor
+from dimension_detector import DimensionDetector
+from balloon_engine import BalloonEngine
+from result_cache import ResultCache
+from ocr_engine import get_ocr_engine
+from image_pyramid import ImagePyramid
+from template_mask import TemplateDetector
+from tiling import Tile, TileGrid, page_pixels
+from instrumentation import traced, tracer
+
+@dataclass
+class PageResult:
+    page_num: int
+    # 'image' (original page; RGB with Config.RASTER_BALLOONS, else
+    # grayscale), 'processed' (binary page) and 'ballooned' (page with
+    # balloons drawn, if Config.RASTER_BALLOONS), held in memory until
+    # spilled to disk
+    images: dict = field(default_factory=dict)
+    image_files: dict = field(default_factory=dict)  # Spilled PNG per kind
+    pyramids: dict = field(default_factory=dict)  # Preview ImagePyramid per kind
+    dimensions: list = field(default_factory=list)
+    balloons: list = field(default_factory=list)
+    trace: list = field(default_factory=list)  # Instrumentation records of this page
+    standard_hits: dict = field(default_factory=dict)  # Toleranced tokens per standard
+    # Page image pixels per pixel at Config.DPI: below 1 coarse to fine.
+    # Balloon and dimension coordinates are always at Config.DPI
+    scale: float = 1.0
+    
+    @traced('spill_images')
+    def spill(self, prefix):
+        """Write the page images to PNG files and release the arrays
+        
+        Images whose pyramid tiles are on disk already are not written
+        again; they are reassembled from the full-resolution tiles.
+        """
+        for kind, img in self.images.items():
+            if kind in self.pyramids and self.pyramids[kind].on_disk:
+                continue
+            path = f"{prefix}.{kind}.png"
+            if img.ndim == 3:
+                img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+            cv2.imwrite(path, img)
+            self.image_files[kind] = path
+        self.images.clear()
+    
+    @traced('build_pyramids')
+    def build_pyramids(self, prefix=None):
+        """Build preview pyramids of the in-memory images
+        
+        With a prefix the tiles are written to disk in place of the spilled
+        images, so cached pages keep their previews.
+        """
+        for kind, img in self.images.items():
+            kind_prefix = None if prefix is None else f"{prefix}.{kind}"
+            self.pyramids[kind] = ImagePyramid.build(img, kind_prefix)
+    
+    def preview(self, kind):
+        """Thumbnail of an image, or the image itself without a pyramid"""
+        if kind in self.pyramids:
+            return self.pyramids[kind].thumbnail()
+        return self.source(kind)
+    
+    def has(self, kind):
+        """Whether an image of this kind exists in any form"""
+        return kind in self.images or kind in self.image_files or kind in self.pyramids
+    
+    def source(self, kind):
+        """Image for display: the spilled file path or the in-memory array"""
+        if kind not in self.images and kind not in self.image_files and kind in self.pyramids:
+            return self.load(kind)
+        return self.image_files.get(kind, self.images.get(kind))
+    
+    def load(self, kind):
+        """Image as an array, read back from disk if it was spilled"""
+        if kind in self.images:
+            return self.images[kind]
+        if kind not in self.image_files:
+            return self.pyramids[kind].full_image()
+        img = cv2.imread(self.image_files[kind], cv2.IMREAD_UNCHANGED)
+        if img is not None and img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return img
+    
+    def is_available(self):
+        """False if a spilled image has been removed since"""
+        return (
+            all(os.path.exists(path) for path in self.image_files.values()) and
+            all(pyramid.is_available() for pyramid in self.pyramids.values())
+        )
+
+# Per-process state of pool workers, created once by init_worker
+_worker = {}
+
+def page_settings(raster_balloons=None, preview_pyramid=None, coarse_to_fine=None):
+    """Config overrides for the pages of a run; None keeps the Config value"""
+    return {
+        name: value for name, value in (
+            ('RASTER_BALLOONS', raster_balloons), ('PREVIEW_PYRAMID', preview_pyramid),
+            ('COARSE_TO_FINE', coarse_to_fine)
+        ) if value is not None
+    }
+
+def init_worker(standard, single_threaded=True, trace=False, raster_balloons=None,
+                preview_pyramid=None, coarse_to_fine=None):
+    """Set up a pool worker process to run pages
+    
+    raster_balloons, preview_pyramid and coarse_to_fine override
+    Config.RASTER_BALLOONS, Config.PREVIEW_PYRAMID and Config.COARSE_TO_FINE
+    for the pages run here; Config is left alone.
+    """
+    tracer.enable(trace)
+    if single_threaded:
+        # One page per process already keeps every core busy; nested OpenCV
+        # and Tesseract threads would only oversubscribe them
+        cv2.setNumThreads(1)
+        os.environ['OMP_THREAD_LIMIT'] = '1'
+    # Pool workers already run one page per core: one OCR thread each
+    _worker['state'] = WorkerState(
+        standard, 1 if single_threaded else None, raster_balloons, preview_pyramid,
+        coarse_to_fine
+    )
+
+class WorkerState:
+    """What the pages of a run share: processor, OCR engine, detectors, settings
+    
+    Pool workers hold one per process (see init_worker). Pages run inline
+    get their own, passed along as state, so concurrent runs in one process
+    (Streamlit sessions) never see each other's.
+    """
+    
+    def __init__(self, standard, ocr_workers=None, raster_balloons=None,
+                 preview_pyramid=None, coarse_to_fine=None):
+        self.processor = PDFProcessor()
+        self.ocr = get_ocr_engine(workers=ocr_workers)
+        self.standard = standard
+        self.detectors = {standard: DimensionDetector(standard, self.ocr)}
+        self.settings = page_settings(raster_balloons, preview_pyramid, coarse_to_fine)
+    
+    def setting(self, name):
+        """Config setting as overridden for this run"""
+        return self.settings.get(name, getattr(Config, name))
+    
+    def detector(self, standard=None):
+        """The detector for a drawing standard, created on first use"""
+        standard = standard or self.standard
+        if standard not in self.detectors:
+            self.detectors[standard] = DimensionDetector(standard, self.ocr)
+        return self.detectors[standard]
+
+def _state(state=None):
+    """state, or this pool worker's own"""
+    return state if state is not None else _worker['state']
+
+def process_page(pdf_path, page_num, spill_prefix=None, standard=None, template=None,
+                 state=None):
+    """Run the full render -> OCR -> balloon chain for one page
+    
+    With a spill_prefix the page images are written to disk here, in the
+    worker, so only the small result travels back to the parent process.
+    Instrumentation records of the page travel back in result.trace.
+    standard overrides the worker's drawing standard for this page;
+    template is the page's PageTemplate, if any. state is the WorkerState
+    of pages run inline, by default the pool worker's.
+    """
+    tracer.set_page(page_num)
+    start = len(tracer.records)
+    with tracer.stage('process_page'):
+        result = _process_page(
+            _state(state), pdf_path, page_num, spill_prefix, standard, template
+        )
+    result.trace = tracer.drain(start)
+    tracer.set_page(None)
+    return result
+
+def _process_page(state, pdf_path, page_num, spill_prefix, standard=None, template=None):
+    processor = state.processor
+    detector = state.detector(standard)
+    
+    coarse_to_fine = state.setting('COARSE_TO_FINE')
+    with fitz.open(pdf_path) as doc:
+        page = doc.load_page(page_num)
+        grid = TileGrid.for_page(page, coarse_to_fine)
+        if grid is not None:
+            # Too large to render whole: tile by tile, in this process
+            result = TiledPage(
+                pdf_path, page_num, grid, spill_prefix, standard, template, state=state
+            ).result()
+            tracer.extend(result.trace)
+            return result
+        
+        # Color is only needed to draw colored balloons onto the page.
+        # Coarse to fine, the page is analysed at Config.ANALYSIS_DPI and
+        # only its text regions are rendered at Config.DPI and above for OCR
+        analysis_dpi = Config.ANALYSIS_DPI if coarse_to_fine else Config.DPI
+        img = processor.render_page(
+            page, gray=not state.setting('RASTER_BALLOONS'), dpi=analysis_dpi
+        )
+        img_width, img_height = page_pixels(page)
+        text_layer = (
+            processor.get_page_text_layer(page, Config.DPI / 72)
+            if Config.USE_TEXT_LAYER else None
+        )
+        geometry = (
+            processor.get_page_geometry(page, Config.DPI / 72)
+            if Config.USE_VECTOR_GEOMETRY else None
+        )
+    
+    scale = analysis_dpi / Config.DPI
+    fine = (
+        functools.partial(processor.render_boxes, pdf_path, page_num)
+        if coarse_to_fine else None
+    )
+    processed = processor.preprocess_image(img, denoise=not coarse_to_fine)
+    line_segments = detector.detect_lines(processed, geometry, scale)
+    dimensions = detector.detect_dimensions(
+        processed, page_num, text_layer, line_segments, template, fine, scale
+    )
+    
+    balloon_engine = _place_balloons(
+        img_width, img_height, dimensions, line_segments, text_layer, geometry, template
+    )
+    
+    result = PageResult(
+        page_num=page_num,
+        images={'image': img, 'processed': processed},
+        dimensions=dimensions,
+        balloons=balloon_engine.balloons,
+        standard_hits=detector.hits.pop(page_num, {}),
+        scale=scale
+    )
+    if state.setting('RASTER_BALLOONS'):
+        result.images['ballooned'] = balloon_engine.draw_balloons(img, scale=scale)
+    if state.setting('PREVIEW_PYRAMID'):
+        result.build_pyramids(spill_prefix)
+    if spill_prefix is not None:
+        result.spill(spill_prefix)
+    return result
+
+@traced('preview_page')
+def preview_page(page, result, spill_prefix=None):
+    """Render the images of a PageResult whose balloons are already placed
+    
+    For pages ballooned outside the pipeline, such as revisions: the same
+    images, pyramids and spilling as a pipeline page, without detection.
+    """
+    processor = PDFProcessor()
+    img = processor.render_page(page, gray=not Config.RASTER_BALLOONS)
+    result.images = {'image': img, 'processed': processor.preprocess_image(img)}
+    if Config.RASTER_BALLOONS:
+        balloon_engine = BalloonEngine(img.shape[1], img.shape[0])
+        balloon_engine.balloons = result.balloons
+        result.images['ballooned'] = balloon_engine.draw_balloons(img)
+    if Config.PREVIEW_PYRAMID:
+        result.build_pyramids(spill_prefix)
+    if spill_prefix is not None:
+        result.spill(spill_prefix)
+    return result
+
+def _place_balloons(img_width, img_height, dimensions, line_segments, text_layer=None,
+                    geometry=None, template=None):
+    """BalloonEngine with balloons placed for the dimensions of a page"""
+    balloon_engine = BalloonEngine(img_width, img_height)
+    text_boxes = [dim['coords'] for dim in dimensions]
+    if text_layer is not None:
+        text_boxes += [
+            (x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in
+            (word['bbox'] for word in text_layer['words'])
+        ]
+    if geometry is not None:
+        text_boxes += [tuple(box) for box in geometry['arrows']]
+    if template is not None:
+        # Balloons stay off the title block, border and other template areas
+        text_boxes += template.boxes()
+    balloon_engine.add_obstacles(text_boxes, line_segments)
+    
+    # Place balloons
+    balloon_engine.place_balloons(dimensions)
+    return balloon_engine
+
+@dataclass
+class TileResult:
+    tile: Tile
+    dimensions: list = field(default_factory=list)  # OCR'd dimensions the tile owns
+    lines: np.ndarray = field(default_factory=lambda: np.empty((0, 4)))  # Raster lines it owns
+    standard_hits: dict = field(default_factory=dict)
+    # kind -> (preview pyramid tiles, top) of the core, see TileGrid.cut_pyramid
+    pyramid_parts: dict = field(default_factory=dict)
+    trace: list = field(default_factory=list)
+
+def _on_page(page_num, name, func, *args):
+    """Run func as stage `name` of a page; returns its result and trace records"""
+    previous = tracer.current_page
+    tracer.set_page(page_num)
+    start = len(tracer.records)
+    try:
+        with tracer.stage(name):
+            result = func(*args)
+    finally:
+        tracer.set_page(previous)
+    return result, tracer.drain(start)
+
+def _submit_inline(func, *args, **kwargs):
+    """Run func now, in this process, and return its finished future"""
+    future = Future()
+    try:
+        future.set_result(func(*args, **kwargs))
+    except Exception as error:
+        future.set_exception(error)
+    return future
+
+def process_tile(pdf_path, page_num, grid, tile, ocr_regions, line_regions,
+                 spill_prefix=None, standard=None, template=None, state=None):
+    """Render, preprocess, OCR and line-detect one tile of an oversized page
+    
+    ocr_regions and line_regions are the page boxes whose text and lines
+    have to be read from the image. Only what the tile owns is returned, in
+    page pixels. With a spill_prefix and preview pyramids on, the tile also
+    writes its share of the page's 'image' and 'processed' pyramids.
+    """
+    result, trace = _on_page(
+        page_num, 'process_tile', _process_tile, _state(state), pdf_path, page_num, grid,
+        tile, ocr_regions, line_regions, spill_prefix, standard, template
+    )
+    result.trace = trace
+    return result
+
+def _process_tile(state, pdf_path, page_num, grid, tile, ocr_regions, line_regions,
+                  spill_prefix, standard, template):
+    processor = state.processor
+    detector = state.detector(standard)
+    x, y, _, _ = tile.box
+    
+    with fitz.open(pdf_path) as doc:
+        img = processor.render_page(
+            doc.load_page(page_num), gray=not state.setting('RASTER_BALLOONS'), clip=tile.box
+        )
+    processed = processor.preprocess_image(img)
+    
+    lines = detector.raster_lines(processed, tile.local_regions(line_regions)) + [x, y, x, y]
+    lines = lines[tile.owns((lines[:, 0] + lines[:, 2]) / 2, (lines[:, 1] + lines[:, 3]) / 2)]
+    
+    dimensions = []
+    for region in tile.local_regions(ocr_regions):
+        dimensions.extend(detector.ocr_dimensions(
+            processed, page_num, region, template, origin=(x, y), core=tile.core
+        ))
+    
+    result = TileResult(tile, dimensions, lines, detector.hits.pop(page_num, {}))
+    if spill_prefix is not None and state.setting('PREVIEW_PYRAMID'):
+        core_x, core_y, core_w, core_h = tile.core
+        core = (slice(core_y - y, core_y - y + core_h), slice(core_x - x, core_x - x + core_w))
+        for kind, kind_img in (('image', img), ('processed', processed)):
+            result.pyramid_parts[kind] = grid.cut_pyramid(
+                tile, kind_img[core], f"{spill_prefix}.{kind}"
+            )
+    return result
+
+def place_tiled_page(page_num, grid, text_layer, geometry, tiles, standard=None, template=None,
+                     state=None):
+    """Merge the tiles of an oversized page and place its balloons
+    
+    tiles holds the (dimensions, lines, standard_hits) of every tile.
+    Returns the page's PageResult, without images.
+    """
+    result, trace = _on_page(
+        page_num, 'place_tiled_page', _place_tiled_page, _state(state), page_num, grid,
+        text_layer, geometry, tiles, standard, template
+    )
+    result.trace = trace
+    return result
+
+def _place_tiled_page(state, page_num, grid, text_layer, geometry, tiles, standard, template):
+    detector = state.detector(standard)
+    
+    # The tiles' tokens count towards the page's standard before the text
+    # layer is read in it (see DimensionDetector.resolve_standard)
+    tile_dimensions = []
+    standard_hits = detector.hits.setdefault(page_num, {})
+    line_segments = [geometry['segments']] if geometry is not None else []
+    for dimensions, lines, hits in tiles:
+        tile_dimensions.extend(dimensions)
+        line_segments.append(lines)
+        for name, count in hits.items():
+            standard_hits[name] = standard_hits.get(name, 0) + count
+    dimensions = []
+    if text_layer is not None and text_layer['words']:
+        dimensions = detector.text_layer_dimensions(text_layer['words'], page_num)
+    dimensions = detector.resolve_standard(
+        dimensions + detector.reading_order(tile_dimensions), page_num
+    )
+    standard_hits = detector.hits.pop(page_num)
+    line_segments = np.concatenate(line_segments)
+    tracer.count('segments', len(line_segments))
+    
+    if template is not None:
+        dimensions = [dim for dim in dimensions if not template.covers_box(dim['coords'])]
+    detector.associate_lines(dimensions, line_segments)
+    
+    balloon_engine = _place_balloons(
+        grid.width, grid.height, dimensions, line_segments, text_layer, geometry, template
+    )
+    return PageResult(
+        page_num=page_num,
+        dimensions=dimensions,
+        balloons=balloon_engine.balloons,
+        standard_hits=standard_hits
+    )
+
+def draw_tile(pdf_path, page_num, grid, tile, balloons, spill_prefix, state=None):
+    """Draw balloons onto one tile of an oversized page and cut its previews
+    
+    Without preview pyramids only the full-resolution tiles are written,
+    quickly compressed, for exports to read back.
+    """
+    result, trace = _on_page(
+        page_num, 'draw_tile', _draw_tile, _state(state), pdf_path, page_num, grid, tile,
+        balloons, spill_prefix
+    )
+    result.trace = trace
+    return result
+
+def _draw_tile(state, pdf_path, page_num, grid, tile, balloons, spill_prefix):
+    x, y, _, _ = tile.core
+    with fitz.open(pdf_path) as doc:
+        img = state.processor.render_page(doc.load_page(page_num), clip=tile.core)
+    
+    balloon_engine = BalloonEngine(grid.width, grid.height)
+    balloon_engine.balloons = balloons
+    ballooned = balloon_engine.draw_balloons(img, origin=(x, y))
+    
+    result = TileResult(tile)
+    if state.setting('PREVIEW_PYRAMID'):
+        result.pyramid_parts['ballooned'] = grid.cut_pyramid(
+            tile, ballooned, f"{spill_prefix}.ballooned"
+        )
+    else:
+        result.pyramid_parts['ballooned'] = grid.cut_pyramid(
+            tile, ballooned, f"{spill_prefix}.ballooned", levels=1,
+            compression=Config.TILE_PNG_COMPRESSION
+        )
+    return result
+
+class TiledPage:
+    """An oversized page processed tile by tile (see tiling.py)
+    
+    Tiles are rendered, OCR'd and line-detected on their own, so no image
+    larger than a tile is ever held. Their detections are then merged and
+    the balloons placed on the whole page, which are finally drawn tile by
+    tile. Tiles are read at Config.DPI: coarse to fine does not apply, a
+    page still too large for it at Config.ANALYSIS_DPI is tiled instead.
+    Page images only exist as pyramid tiles written under the spill_prefix
+    (see draw_tile); without one the page has none. Every step goes through
+    submit: a ProcessPoolExecutor's submit runs the tiles in parallel, by
+    default they run in this process one after the other. Stands in for the
+    future of the page: result() returns its PageResult. state is the
+    WorkerState of tiles run inline, by default the pool worker's;
+    raster_balloons and preview_pyramid default to its settings.
+    """
+    
+    def __init__(self, pdf_path, page_num, grid, spill_prefix=None, standard=None,
+                 template=None, submit=None, raster_balloons=None, state=None,
+                 preview_pyramid=None):
+        self.pdf_path = pdf_path
+        self.page_num = page_num
+        self.grid = grid
+        self.spill_prefix = spill_prefix
+        self.standard = standard
+        self.template = template
+        self.submit = submit or _submit_inline
+        self.state = state
+        self.raster_balloons = (
+            _state(state).setting('RASTER_BALLOONS') if raster_balloons is None
+            else raster_balloons
+        )
+        self.preview_pyramid = (
+            _state(state).setting('PREVIEW_PYRAMID') if preview_pyramid is None
+            else preview_pyramid
+        )
+        self.futures = []
+        
+        # Native text and vector lines need no image: read for the whole page
+        (self.text_layer, self.geometry), self.trace = _on_page(
+            page_num, 'extract_page', self._extract
+        )
+        page_box = [(0, 0, grid.width, grid.height)]
+        ocr_regions = (
+            self.text_layer['raster_regions']
+            if self.text_layer is not None and self.text_layer['words'] else page_box
+        )
+        line_regions = (
+            self.geometry['raster_regions']
+            if self.geometry is not None and len(self.geometry['segments']) else page_box
+        )
+        self.tiles = [
+            self._submit(
+                process_tile, pdf_path, page_num, grid, tile, ocr_regions, line_regions,
+                spill_prefix, standard, template
+            )
+            for tile in grid.tiles
+        ]
+    
+    def _extract(self):
+        processor = PDFProcessor()
+        zoom = Config.DPI / 72
+        with fitz.open(self.pdf_path) as doc:
+            page = doc.load_page(self.page_num)
+            text_layer = (
+                processor.get_page_text_layer(page, zoom) if Config.USE_TEXT_LAYER else None
+            )
+            geometry = (
+                processor.get_page_geometry(page, zoom) if Config.USE_VECTOR_GEOMETRY else None
+            )
+        return text_layer, geometry
+    
+    def _submit(self, func, *args):
+        # Pool workers use their own state, which never leaves the process
+        future = (
+            self.submit(func, *args) if self.state is None
+            else self.submit(func, *args, state=self.state)
+        )
+        self.futures.append(future)
+        return future
+    
+    def _collect(self, futures):
+        """Results of futures, with their trace records moved to this page's"""
+        results = [future.result() for future in futures]
+        for result in results:
+            self.trace.extend(result.trace)
+            result.trace = []
+        return results
+    
+    def result(self):
+        """Wait for the tiles, then place and draw the balloons"""
+        tiles = self._collect(self.tiles)
+        result = self._collect([self._submit(
+            place_tiled_page, self.page_num, self.grid, self.text_layer, self.geometry,
+            [(tile.dimensions, tile.lines, tile.standard_hits) for tile in tiles],
+            self.standard, self.template
+        )])[0]
+        
+        if self.spill_prefix is not None:
+            if self.raster_balloons:
+                tiles += self._collect([
+                    self._submit(
+                        draw_tile, self.pdf_path, self.page_num, self.grid, tile,
+                        self._balloons_on(tile, result.balloons), self.spill_prefix
+                    )
+                    for tile in self.grid.tiles
+                ])
+            result.pyramids, trace = _on_page(
+                self.page_num, 'assemble_pyramids', self._assemble_pyramids, tiles
+            )
+            self.trace.extend(trace)
+        
+        result.trace = self.trace
+        return result
+    
+    def cancel(self):
+        for future in self.futures:
+            future.cancel()
+    
+    def _assemble_pyramids(self, tiles):
+        parts = {}
+        for tile in tiles:
+            for kind, (pyramid_tiles, top) in tile.pyramid_parts.items():
+                parts.setdefault(kind, []).append((tile.tile, pyramid_tiles, top))
+        # Without previews only the full-resolution tiles were cut
+        levels = None if self.preview_pyramid else 1
+        return {
+            kind: self.grid.pyramid(kind_parts, f"{self.spill_prefix}.{kind}", levels)
+            for kind, kind_parts in parts.items()
+        }
+    
+    @staticmethod
+    def _balloons_on(tile, balloons):
+        """Balloons drawn at least partly inside a tile's core"""
+        x, y, w, h = tile.core
+        on_tile = []
+        for balloon in balloons:
+            bx, by = balloon.position
+            tx, ty, tw, th = balloon.dimension['coords']
+            cx, cy = tx + tw // 2, ty + th // 2
+            # The ID text may be wider than the circle
+            reach = 2 * balloon.radius
+            if (min(bx - reach, cx) < x + w and max(bx + reach, cx) >= x and
+                    min(by - reach, cy) < y + h and max(by + reach, cy) >= y):
+                on_tile.append(balloon)
+        return on_tile
+
+class PagePipeline:
+    """Processes the pages of a PDF on a pool of worker processes
+    
+    Pages are rendered, processed and (with Config.SPILL_PAGES) written to
+    disk one at a time inside the workers, and at most Config.PAGE_WINDOW
+    pages are in flight at once, so memory is bounded by the window rather
+    than by the document size. raster_balloons, preview_pyramid and
+    coarse_to_fine override the Config settings of the same name for this
+    pipeline. ocr_workers is the OCR thread count of pages run in this
+    process, Config.OCR_WORKERS by default; pool workers use one each.
+    """
+    # Config parameters that change the templates detected
+    TEMPLATE_PARAMETERS = [
+        'TEMPLATE_HASH_DPI', 'TEMPLATE_CELL_SIZE', 'TEMPLATE_MAX_SHARED', 'TEMPLATE_LEARNING'
+    ]
+    
+    def __init__(self, standard='ASME_Y14.5', workers=None, cache=None, window=None,
+                 raster_balloons=None, preview_pyramid=None, coarse_to_fine=None,
+                 ocr_workers=None):
+        self.standard = standard
+        self.workers = workers or Config.PIPELINE_WORKERS
+        self.window = max(window or Config.PAGE_WINDOW, self.workers)
+        self.cache = cache
+        self.raster_balloons = raster_balloons
+        self.preview_pyramid = preview_pyramid
+        self.coarse_to_fine = coarse_to_fine
+        self.ocr_workers = ocr_workers
+        self.spill_folder = None
+    
+    def _settings(self):
+        return page_settings(self.raster_balloons, self.preview_pyramid, self.coarse_to_fine)
+    
+    def run(self, pdf_path):
+        """Yield a PageResult per page, in page order, as soon as it is ready
+        
+        Pages are processed concurrently, so page N is yielded as soon as it
+        and every page before it have finished. Pages found in the result
+        cache are not processed again. Content repeated across the sheets
+        (Config.TEMPLATE_MASKING) is found first and left out of detection.
+        Oversized sheets are split into tiles spread over the workers.
+        """
+        coarse_to_fine = self._settings().get('COARSE_TO_FINE', Config.COARSE_TO_FINE)
+        with fitz.open(pdf_path) as doc:
+            grids = [TileGrid.for_page(page, coarse_to_fine) for page in doc]
+        page_count = len(grids)
+        pdf_hash = ResultCache.hash_file(pdf_path) if self.cache is not None else None
+        templates, template_key = self._templates(pdf_path, pdf_hash, page_count)
+        keys = [None] * page_count
+        cached = {}
+        
+        if self.cache is not None:
+            for page_num in range(page_count):
+                template = templates[page_num]
+                keys[page_num] = self.cache.make_key(
+                    pdf_hash, page_num, self.standard,
+                    variant=template.key() if template is not None else None,
+                    settings=self._settings()
+                )
+                lookup = tracer.stage('cache_hit', page=page_num)
+                with lookup:
+                    result = self.cache.get(keys[page_num])
+                if result is not None and result.is_available():
+                    result.trace = [lookup.record] if lookup.record else []
+                    cached[page_num] = result
+        
+        missing = [page_num for page_num in range(page_count) if page_num not in cached]
+        spill_prefixes = [
+            self._spill_prefix(keys[page_num], page_num, grids[page_num] is not None)
+            for page_num in missing
+        ]
+        computed = self._process_pages(
+            pdf_path, missing, spill_prefixes, [templates[page_num] for page_num in missing],
+            [grids[page_num] for page_num in missing]
+        )
+        
+        # Evict only once the run is over: pages of this run, cached or
+        # not yet yielded, must keep their spilled images until then
+        try:
+            for page_num in range(page_count):
+                if page_num in cached:
+                    yield cached.pop(page_num)
+                    continue
+                
+                result = next(computed)
+                tracer.extend(result.trace)
+                if self.cache is not None:
+                    self.cache.put(keys[page_num], result, evict=False)
+                yield result
+        finally:
+            if self.cache is not None:
+                self.cache.evict(keep=keys + [template_key])
+    
+    def _templates(self, pdf_path, pdf_hash, page_count):
+        """PageTemplate or None per page, and the cache key they are kept under
+        
+        Detection renders every sheet, which would be most of a cached
+        rerun, so with a cache it runs once per document.
+        """
+        if not Config.TEMPLATE_MASKING:
+            return [None] * page_count, None
+        if self.cache is None:
+            return TemplateDetector().detect(pdf_path), None
+        
+        key = self.cache.make_key(pdf_hash, None, '', stage='templates', variant=repr([
+            getattr(Config, name) for name in self.TEMPLATE_PARAMETERS
+        ]))
+        templates = self.cache.get(key)
+        if templates is None:
+            templates = TemplateDetector().detect(pdf_path)
+            self.cache.put(key, templates, evict=False)
+        return templates, key
+    
+    def _spill_prefix(self, key, page_num, tiled=False):
+        """Where a page's images go, or None to keep them in memory
+        
+        Tiled pages always get one: their images only exist on disk.
+        """
+        if not Config.SPILL_PAGES and not tiled:
+            return None
+        if key is not None:
+            # Cached results keep their images next to the cache entry
+            return self.cache.file_prefix(key)
+        if self.spill_folder is None:
+            os.makedirs(Config.TEMP_FOLDER, exist_ok=True)
+            self.spill_folder = tempfile.mkdtemp(prefix='pages_', dir=Config.TEMP_FOLDER)
+        return os.path.join(self.spill_folder, f"page_{page_num+1}")
+    
+    def close(self):
+        """Remove images spilled for this run that are not owned by the cache"""
+        if self.spill_folder is not None:
+            shutil.rmtree(self.spill_folder, ignore_errors=True)
+            self.spill_folder = None
+    
+    def _process_pages(self, pdf_path, page_nums, spill_prefixes, templates, grids):
+        """Process the given pages, yielding results in the same order"""
+        # Each tile of an oversized page can keep a worker busy
+        jobs = sum(1 if grid is None else len(grid.tiles) for grid in grids)
+        workers = min(self.workers, jobs)
+        
+        if workers <= 1:
+            # Not worth a pool: run in this process, one page at a time, with
+            # state of this run's own; other runs may share the process
+            state = WorkerState(
+                self.standard, self.ocr_workers, raster_balloons=self.raster_balloons,
+                preview_pyramid=self.preview_pyramid, coarse_to_fine=self.coarse_to_fine
+            )
+            for page_num, prefix, template in zip(page_nums, spill_prefixes, templates):
+                yield process_page(pdf_path, page_num, prefix, template=template, state=state)
+            return
+        
+        # spawn rather than fork: the Streamlit server is multi-threaded
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=init_worker,
+            initargs=(self.standard, True, tracer.enabled, self.raster_balloons,
+                      self.preview_pyramid, self.coarse_to_fine)
+        ) as pool:
+            pending = iter(zip(page_nums, spill_prefixes, templates, grids))
+            in_flight = deque()
+            try:
+                # Keep at most `window` pages submitted but not yet consumed
+                for page_num, prefix, template, grid in pending:
+                    if grid is not None:
+                        settings = self._settings()
+                        in_flight.append(TiledPage(
+                            pdf_path, page_num, grid, prefix, template=template,
+                            submit=pool.submit, raster_balloons=settings.get(
+                                'RASTER_BALLOONS', Config.RASTER_BALLOONS
+                            ), preview_pyramid=settings.get(
+                                'PREVIEW_PYRAMID', Config.PREVIEW_PYRAMID
+                            )
+                        ))
+                    else:
+                        in_flight.append(pool.submit(
+                            process_page, pdf_path, page_num, prefix, template=template
+                        ))
+                    if len(in_flight) >= self.window:
+                        yield in_flight.popleft().result()
+                while in_flight:
+                    yield in_flight.popleft().result()
+            finally:
+                # Consumer stopped early or a page failed
+                for future in in_flight:
+                    future.cancel()
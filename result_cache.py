@@ -0,0 +1,156 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from config import Config
+
+class ResultCache:
+    """Content-addressed on-disk cache of per-page processing results
+    
+    Entries are keyed by the PDF's content hash, the page index, the drawing
+    standard and every Config parameter that changes the result, so a rerun
+    or a re-upload of the same drawing never repeats work. The cache is
+    bounded by Config.CACHE_MAX_BYTES and evicts least recently used entries.
+    """
+    # Bump when the layout of cached results changes
+    VERSION = 3
+    
+    # Config parameters that influence rendering, detection or placement
+    KEY_PARAMETERS = [
+        'DPI', 'MIN_DIMENSION_CONFIDENCE', 'BALLOON_RADIUS', 'BALLOON_PADDING',
+        'BALLOON_INK_CLEARANCE', 'LAYOUT_MODE', 'LAYOUT_RINGS',
+        'LINE_DETECTION_THRESHOLD', 'LINE_ASSOCIATION_DISTANCE', 'SPILL_PAGES',
+        'LINE_ASSOCIATION_MODE', 'USE_TEXT_LAYER', 'LINE_DETECTION_SCALE',
+        'LINE_MIN_LENGTH', 'USE_VECTOR_GEOMETRY', 'ARROW_MAX_SIZE', 'OCR_REGION_PROPOSAL',
+        'OCR_BACKEND', 'RASTER_BALLOONS', 'PREVIEW_PYRAMID', 'PREVIEW_TILE_SIZE',
+        'PREVIEW_THUMBNAIL_SIZE', 'TILED_PROCESSING', 'TILED_MIN_PIXELS', 'TILE_SIZE',
+        'TILE_OVERLAP', 'COARSE_TO_FINE', 'ANALYSIS_DPI', 'FINE_MIN_TEXT_HEIGHT',
+        'FINE_MAX_DPI'
+    ]
+    
+    def __init__(self, folder=None, max_bytes=None):
+        self.folder = folder or os.path.join(Config.TEMP_FOLDER, 'cache')
+        self.max_bytes = max_bytes or Config.CACHE_MAX_BYTES
+        os.makedirs(self.folder, exist_ok=True)
+    
+    @staticmethod
+    def hash_file(path):
+        """SHA-256 of a file's content"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def make_key(self, pdf_hash, page_num, standard, stage='page', variant=None,
+                 settings=None):
+        """Cache key for one page of a document
+        
+        variant identifies further inputs of the page, such as its template
+        mask. settings holds the Config parameters the page was run with
+        where they differ from Config (see pipeline.page_settings).
+        """
+        settings = settings or {}
+        params = [
+            f"{name}={settings.get(name, getattr(Config, name))}"
+            for name in self.KEY_PARAMETERS
+        ]
+        parts = [str(self.VERSION), stage, pdf_hash, str(page_num), standard] + params
+        if variant:
+            parts.append(variant)
+        return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.pkl")
+    
+    def file_prefix(self, key):
+        """Path prefix for extra files (e.g. page images) owned by an entry
+        
+        Files named '<prefix>.<anything>' are evicted together with the entry.
+        """
+        return os.path.join(self.folder, key)
+    
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except OSError:
+            return None
+        except (EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            # Truncated, or pickled from classes or modules that have since
+            # changed (ImportError covers ModuleNotFoundError): drop the entry
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+        
+        # Record the access for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+    
+    def put(self, key, value, evict=True):
+        """Store value under key and evict old entries if over the size limit
+        
+        Pass evict=False to defer eviction, e.g. until every entry of a run
+        has been used (see evict).
+        """
+        # Write to a temporary file first so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        
+        if evict:
+            self.evict()
+    
+    def evict(self, keep=()):
+        """Remove least recently used entries until the cache fits max_bytes
+        
+        Entries whose key is in keep are never removed, even if that leaves
+        the cache over the limit until the next eviction.
+        """
+        keep = set(keep)
+        # key -> [last access, total size, paths]
+        entries = {}
+        total = 0
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # Removed by a concurrent session
+            group = entries.setdefault(entry.name.split('.')[0], [0.0, 0, []])
+            group[0] = max(group[0], stat.st_mtime)
+            group[1] += stat.st_size
+            group[2].append(entry.path)
+            total += stat.st_size
+        
+        for key, (_, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            for path in paths:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+    
+    def clear(self):
+        """Remove every cache entry"""
+        for entry in os.scandir(self.folder):
+            if not entry.name.endswith('.tmp'):
+                os.unlink(entry.path)
@@ -0,0 +1,406 @@
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+from dataclasses import dataclass, field
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+from config import Config
+from pdf_processor import PDFProcessor
+from template_mask import cell_hashes
+from dimension_detector import DimensionDetector
+from balloon_engine import Balloon, BalloonEngine
+from pipeline import PageResult, preview_page
+from instrumentation import traced, tracer
+
+@dataclass
+class RevisionPage:
+    """What a processed revision remembers about one page"""
+    page_hash: str
+    cell_hashes: np.ndarray  # Fingerprint per REVISION_CELL_SIZE cell
+    lines: np.ndarray  # (N, 4) line segments in page pixels
+    balloons: list = field(default_factory=list)
+    standard_hits: dict = field(default_factory=dict)  # Toleranced tokens per standard
+
+@dataclass
+class RevisionResult:
+    balloons: list  # All balloons of the revision, by ID
+    # One {'id', 'page', 'text', 'change'} dict per added, removed or moved
+    # balloon; 'change' is 'added', 'removed' or 'moved'
+    changes: list
+    pages: list = field(default_factory=list)  # PageResult per page, without images
+    pages_reprocessed: int = 0
+    regions_reprocessed: int = 0
+
+class RevisionStore:
+    """Latest processed revision of each drawing, by drawing ID"""
+    
+    def __init__(self, folder=None):
+        self.folder = folder or os.path.join(Config.OUTPUT_FOLDER, 'revisions')
+        os.makedirs(self.folder, exist_ok=True)
+    
+    def _path(self, drawing_id):
+        safe_id = re.sub(r'[^A-Za-z0-9_.-]', '_', drawing_id)
+        return os.path.join(self.folder, f"{safe_id}.pkl")
+    
+    def load(self, drawing_id):
+        """Stored state of a drawing, or None if it was never processed"""
+        try:
+            with open(self._path(drawing_id), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+    
+    def save(self, drawing_id, state):
+        # Write to a temporary file first so a crash never loses the old state
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(drawing_id))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+class RevisionPipeline:
+    """Balloons a new revision of a drawing, reusing the previous revision
+    
+    Pages whose content is byte-identical to the stored revision are not
+    rendered at all. Other pages are compared cell by cell on a cheap
+    low-resolution render; only the changed regions are rendered at
+    Config.DPI and run through detection. Dimensions outside them keep
+    their balloon, and re-detected dimensions that match a previous one
+    (same text, nearby) keep its ID. IDs are unique across the drawing and
+    never reused. Page previews are drawn and cached like PagePipeline's.
+    """
+    # Bump when the layout of stored revisions changes
+    VERSION = 2
+    
+    # Parameters that make stored coordinates or hashes incomparable
+    STATE_PARAMETERS = ['DPI', 'REVISION_HASH_DPI', 'REVISION_CELL_SIZE']
+    
+    def __init__(self, standard='ASME_Y14.5', store=None, cache=None):
+        self.standard = standard
+        self.store = store or RevisionStore()
+        self.cache = cache
+        self.processor = PDFProcessor()
+        self.detector = DimensionDetector(standard)
+    
+    def _params(self):
+        params = {name: getattr(Config, name) for name in self.STATE_PARAMETERS}
+        params['version'] = self.VERSION
+        return params
+    
+    def run(self, pdf_path, drawing_id):
+        """Process pdf_path as the next revision of drawing_id"""
+        state = self.store.load(drawing_id)
+        if state is not None and (state['standard'] != self.standard or
+                                  state['params'] != self._params()):
+            state = None  # Processed with other settings: start over
+        prior_pages = state['pages'] if state is not None else []
+        next_id = state['next_id'] if state is not None else 1
+        
+        result = RevisionResult(balloons=[], changes=[])
+        pages = []
+        with fitz.open(pdf_path) as doc:
+            for page_num in range(len(doc)):
+                page = doc.load_page(page_num)
+                prior = prior_pages[page_num] if page_num < len(prior_pages) else None
+                tracer.set_page(page_num)
+                
+                page_hash = self.page_hash(page)
+                if prior is not None and prior.page_hash == page_hash:
+                    pages.append(prior)
+                else:
+                    revision_page, next_id = self._update_page(
+                        page, page_num, page_hash, prior, next_id, result
+                    )
+                    pages.append(revision_page)
+                result.balloons.extend(pages[-1].balloons)
+                result.pages.append(PageResult(
+                    page_num=page_num,
+                    dimensions=[balloon.dimension for balloon in pages[-1].balloons],
+                    balloons=pages[-1].balloons,
+                    standard_hits=pages[-1].standard_hits
+                ))
+            tracer.set_page(None)
+        
+        # Pages dropped from the drawing
+        for prior in prior_pages[len(pages):]:
+            result.changes.extend(self._change(b, 'removed') for b in prior.balloons)
+        
+        self.store.save(drawing_id, {
+            'standard': self.standard,
+            'params': self._params(),
+            'next_id': next_id,
+            'pages': pages
+        })
+        result.balloons.sort(key=lambda balloon: balloon.id)
+        return result
+    
+    def previews(self, pdf_path, result):
+        """Yield the PageResults of a processed revision with their images
+        
+        Pages go through the pipeline's preview path (see
+        pipeline.preview_page) and, with a cache, are kept in it: a page
+        whose content and balloons did not change is not rendered again.
+        """
+        keys = []  # Evicted only once every page has been used, as in PagePipeline.run
+        try:
+            with fitz.open(pdf_path) as doc:
+                for page_result in result.pages:
+                    page = doc.load_page(page_result.page_num)
+                    key = None
+                    if self.cache is not None:
+                        key = self.cache.make_key(
+                            self.page_hash(page), page_result.page_num, self.standard,
+                            stage='revision_page', variant=self._balloons_key(page_result.balloons)
+                        )
+                        keys.append(key)
+                        cached = self.cache.get(key)
+                        if cached is not None and cached.is_available():
+                            yield cached
+                            continue
+                    
+                    tracer.set_page(page_result.page_num)
+                    start = len(tracer.records)
+                    prefix = self.cache.file_prefix(key) if key and Config.SPILL_PAGES else None
+                    page_result = preview_page(page, page_result, prefix)
+                    page_result.trace = tracer.drain(start)
+                    tracer.extend(page_result.trace)
+                    tracer.set_page(None)
+                    if key is not None:
+                        self.cache.put(key, page_result, evict=False)
+                    yield page_result
+        finally:
+            if self.cache is not None:
+                self.cache.evict(keep=keys)
+    
+    @staticmethod
+    def _balloons_key(balloons):
+        """Identity of a page's balloons, for preview cache keys"""
+        return hashlib.sha256(repr([
+            (balloon.id, tuple(balloon.position), balloon.dimension['text'],
+             tuple(balloon.dimension['coords']))
+            for balloon in balloons
+        ]).encode()).hexdigest()
+    
+    @staticmethod
+    def page_hash(page):
+        """Hash of a page's content stream, images and form XObjects"""
+        digest = hashlib.sha256()
+        digest.update(repr((tuple(page.rect), page.rotation)).encode())
+        digest.update(page.read_contents())
+        doc = page.parent
+        xrefs = {image[0] for image in page.get_images(full=True)}
+        xrefs.update(xobject[0] for xobject in page.get_xobjects())
+        for xref in sorted(xrefs):
+            digest.update(doc.xref_stream_raw(xref) or b'')
+        return digest.hexdigest()
+    
+    @traced('revision_hash')
+    def cell_hashes(self, page):
+        """64-bit fingerprint of every cell of a low-resolution render"""
+        hashes, _ = cell_hashes(page, Config.REVISION_HASH_DPI, Config.REVISION_CELL_SIZE)
+        return hashes
+    
+    def changed_regions(self, old_hashes, new_hashes, page_size):
+        """(x, y, w, h) boxes in page pixels around the changed cells
+        
+        Changed cells are grown by one cell so text straddling a cell border
+        is read whole.
+        """
+        width, height = page_size
+        if old_hashes is None or old_hashes.shape != new_hashes.shape:
+            return [(0, 0, width, height)]
+        
+        changed = (old_hashes != new_hashes).astype(np.uint8)
+        if not changed.any():
+            return []
+        changed = cv2.dilate(changed, np.ones((3, 3), np.uint8))
+        _, _, stats, _ = cv2.connectedComponentsWithStats(changed, connectivity=8)
+        
+        scale = Config.REVISION_CELL_SIZE * Config.DPI / Config.REVISION_HASH_DPI
+        regions = []
+        for x, y, w, h, _ in stats[1:]:
+            x0, y0 = int(x * scale), int(y * scale)
+            x1, y1 = min(int(np.ceil((x + w) * scale)), width), min(int(np.ceil((y + h) * scale)), height)
+            regions.append((x0, y0, x1 - x0, y1 - y0))
+        return regions
+    
+    def _update_page(self, page, page_num, page_hash, prior, next_id, result):
+        """Re-detect the changed regions of a page and re-balloon it"""
+        zoom = Config.DPI / 72
+        page_rect = page.rect * fitz.Matrix(zoom, zoom)
+        page_size = (int(np.ceil(page_rect.width)), int(np.ceil(page_rect.height)))
+        
+        hashes = self.cell_hashes(page)
+        regions = self.changed_regions(
+            prior.cell_hashes if prior is not None else None, hashes, page_size
+        )
+        text_layer = (
+            self.processor.get_page_text_layer(page, zoom)
+            if Config.USE_TEXT_LAYER else None
+        )
+        geometry = (
+            self.processor.get_page_geometry(page, zoom)
+            if Config.USE_VECTOR_GEOMETRY else None
+        )
+        
+        # Everything outside the changed regions is carried over
+        kept, stale = [], []
+        prior_lines = np.empty((0, 4))
+        if prior is not None:
+            for balloon in prior.balloons:
+                x, y, w, h = balloon.dimension['coords']
+                inside = self._inside(x + w / 2, y + h / 2, regions)
+                (stale if inside else kept).append(balloon)
+            if len(prior.lines):
+                mid_x = (prior.lines[:, 0] + prior.lines[:, 2]) / 2
+                mid_y = (prior.lines[:, 1] + prior.lines[:, 3]) / 2
+                outside = [not self._inside(x, y, regions) for x, y in zip(mid_x, mid_y)]
+                prior_lines = prior.lines[np.array(outside, dtype=bool)]
+        
+        dimensions, lines = [], [prior_lines]
+        for region in regions:
+            region_dims, region_lines = self._process_region(
+                page, page_num, region, text_layer, geometry
+            )
+            dimensions.extend(region_dims)
+            lines.append(region_lines)
+        dimensions = self.detector.resolve_standard(dimensions, page_num)
+        standard_hits = self.detector.hits.pop(page_num, {})
+        lines = np.concatenate(lines)
+        result.pages_reprocessed += 1
+        result.regions_reprocessed += len(regions)
+        
+        # Same obstacles as a full run: dimensions, words, arrowheads, lines
+        engine = BalloonEngine(*page_size)
+        engine.next_id = next_id
+        text_boxes = [balloon.dimension['coords'] for balloon in kept]
+        text_boxes += [dim['coords'] for dim in dimensions]
+        if text_layer is not None:
+            text_boxes += [
+                (x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in
+                (word['bbox'] for word in text_layer['words'])
+            ]
+        if geometry is not None:
+            text_boxes += [tuple(box) for box in geometry['arrows']]
+        engine.add_obstacles(text_boxes, lines)
+        for balloon in kept:
+            engine.balloons.append(balloon)
+            engine.mark_occupied_area(balloon.position)
+        
+        added = []
+        for dim, match in zip(dimensions, self._match(dimensions, stale)):
+            if match is None:
+                added.append(dim)
+                continue
+            stale = [balloon for balloon in stale if balloon is not match]
+            old_x, old_y, _, _ = match.dimension['coords']
+            dx, dy = dim['coords'][0] - old_x, dim['coords'][1] - old_y
+            position = match.position
+            if abs(dx) > Config.REVISION_MOVE_TOLERANCE or abs(dy) > Config.REVISION_MOVE_TOLERANCE:
+                position = engine.find_optimal_position(
+                    (match.position[0] + dx, match.position[1] + dy), dim
+                )
+                result.changes.append(self._change(match, 'moved'))
+            balloon = Balloon(id=match.id, position=position, dimension=dim)
+            engine.balloons.append(balloon)
+            engine.mark_occupied_area(position)
+        
+        result.changes.extend(self._change(balloon, 'removed') for balloon in stale)
+        if prior is None:
+            new_balloons = engine.place_balloons(added)
+        else:
+            # Fit around the balloons that stay where they are
+            new_balloons = [engine.place_balloon(dim) for dim in added]
+        result.changes.extend(self._change(balloon, 'added') for balloon in new_balloons)
+        
+        engine.balloons.sort(key=lambda balloon: balloon.id)
+        return (
+            RevisionPage(page_hash, hashes, lines, engine.balloons, standard_hits),
+            engine.next_id
+        )
+    
+    @traced('revision_region')
+    def _process_region(self, page, page_num, region, text_layer, geometry=None):
+        """Render one region at Config.DPI and detect its dimensions and lines"""
+        zoom = Config.DPI / 72
+        x, y, w, h = region
+        # The clip is in points of the displayed (rotated) page
+        clip = fitz.Rect(x, y, x + w, y + h) * fitz.Matrix(1 / zoom, 1 / zoom)
+        pix = page.get_pixmap(
+            matrix=fitz.Matrix(zoom, zoom), clip=clip, colorspace=fitz.csGRAY
+        )
+        img = self.processor.pixmap_array(pix)
+        ox, oy = pix.x, pix.y
+        
+        processed = self.processor.preprocess_image(img)
+        if geometry is not None:
+            geometry = self.processor.crop_geometry(geometry, region, (ox, oy))
+        lines = self.detector.detect_lines(processed, geometry)
+        
+        if text_layer is None or not text_layer['words']:
+            dimensions = self.detector.ocr_dimensions(processed, page_num)
+        else:
+            words = []
+            for word in text_layer['words']:
+                x0, y0, x1, y1 = word['bbox']
+                if self._inside((x0 + x1) / 2, (y0 + y1) / 2, [region]):
+                    words.append(dict(word, bbox=(x0 - ox, y0 - oy, x1 - ox, y1 - oy)))
+            dimensions = self.detector.text_layer_dimensions(words, page_num)
+            for rx, ry, rw, rh in text_layer['raster_regions']:
+                # Raster inserts overlapping the region, in region pixels
+                x0, y0 = max(rx - ox, 0), max(ry - oy, 0)
+                x1, y1 = min(rx + rw - ox, pix.width), min(ry + rh - oy, pix.height)
+                if x1 > x0 and y1 > y0:
+                    dimensions.extend(self.detector.ocr_dimensions(
+                        processed, page_num, (x0, y0, x1 - x0, y1 - y0)
+                    ))
+        self.detector.associate_lines(dimensions, lines)
+        
+        # Back to page pixels
+        for dim in dimensions:
+            dx, dy, dw, dh = dim['coords']
+            dim['coords'] = (dx + ox, dy + oy, dw, dh)
+            dim['lines'] = [
+                (x1 + ox, y1 + oy, x2 + ox, y2 + oy) for x1, y1, x2, y2 in dim['lines']
+            ]
+        return dimensions, lines + [ox, oy, ox, oy]
+    
+    @staticmethod
+    def _inside(x, y, regions):
+        return any(rx <= x < rx + rw and ry <= y < ry + rh for rx, ry, rw, rh in regions)
+    
+    @staticmethod
+    def _match(dimensions, candidates):
+        """Previous balloon of each dimension: same text, nearest, in range"""
+        taken = set()
+        matches = []
+        for dim in dimensions:
+            x, y, _, _ = dim['coords']
+            best, best_distance = None, Config.REVISION_MATCH_DISTANCE
+            for balloon in candidates:
+                if id(balloon) in taken or balloon.dimension['text'] != dim['text']:
+                    continue
+                old_x, old_y, _, _ = balloon.dimension['coords']
+                distance = np.hypot(x - old_x, y - old_y)
+                if distance <= best_distance:
+                    best, best_distance = balloon, distance
+            if best is not None:
+                taken.add(id(best))
+            matches.append(best)
+        return matches
+    
+    @staticmethod
+    def _change(balloon, change):
+        return {
+            'id': balloon.id,
+            'page': balloon.dimension['page'] + 1,
+            'text': balloon.dimension['text'],
+            'change': change
+        }
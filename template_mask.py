@@ -0,0 +1,200 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+from config import Config
+from pdf_processor import PDFProcessor
+from instrumentation import traced
+
+def cell_hashes(page, dpi, cell):
+    """64-bit fingerprint of every cell of a low-resolution render
+    
+    Returns the (rows, cols) hash grid and a mask of cells without ink.
+    """
+    zoom = dpi / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+    img = PDFProcessor.pixmap_array(pix)
+    
+    rows, cols = -(-pix.height // cell), -(-pix.width // cell)
+    padded = np.full((rows * cell, cols * cell), 255, dtype=np.uint8)
+    padded[:pix.height, :pix.width] = img
+    blocks = padded.reshape(rows, cell, cols, cell).swapaxes(1, 2)
+    
+    hashes = np.empty((rows, cols), dtype=np.uint64)
+    for row in range(rows):
+        for col in range(cols):
+            hashes[row, col] = int.from_bytes(
+                hashlib.blake2b(blocks[row, col].tobytes(), digest_size=8).digest(), 'little'
+            )
+    return hashes, blocks.min(axis=(2, 3)) == 255
+
+class PageTemplate:
+    """Cells of a page that repeat the drawing template (border, title block...)"""
+    
+    def __init__(self, cells, cell_pixels):
+        self.cells = cells  # (rows, cols) bool grid
+        self.cell_pixels = cell_pixels  # Cell edge in page pixels at Config.DPI
+    
+    def key(self):
+        """Identity of the mask, for cache keys"""
+        return hashlib.sha256(np.packbits(self.cells).tobytes() + repr(
+            (self.cells.shape, self.cell_pixels)).encode()).hexdigest()
+    
+    def covers(self, x, y):
+        """Whether page pixel (x, y) lies in the template; accepts arrays"""
+        rows, cols = self.cells.shape
+        row = np.clip((np.asarray(y) // self.cell_pixels).astype(np.int64), 0, rows - 1)
+        col = np.clip((np.asarray(x) // self.cell_pixels).astype(np.int64), 0, cols - 1)
+        return self.cells[row, col]
+    
+    def covers_box(self, box):
+        """Whether the center of an (x, y, w, h) box lies in the template"""
+        x, y, w, h = box
+        return bool(self.covers(x + w / 2, y + h / 2))
+    
+    def boxes(self):
+        """(x, y, w, h) page pixel boxes covering exactly the template cells
+        
+        One box per run of template cells along a row, extended down over
+        the rows that repeat the same run. Bounding boxes of connected areas
+        would not do: the sheet border alone would cover the whole sheet.
+        """
+        open_runs = {}  # (first col, end col) -> first row
+        spans = []  # (first row, end row, first col, end col)
+        for row, row_cells in enumerate(np.vstack([self.cells, np.zeros_like(self.cells[:1])])):
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], row_cells.astype(np.int8), [0]))))
+            runs = set(zip(edges[::2].tolist(), edges[1::2].tolist()))
+            for run in list(open_runs):
+                if run not in runs:
+                    spans.append((open_runs.pop(run), row) + run)
+            for run in runs:
+                open_runs.setdefault(run, row)
+        
+        scale = self.cell_pixels
+        return [
+            (int(c0 * scale), int(r0 * scale),
+             int(np.ceil((c1 - c0) * scale)), int(np.ceil((r1 - r0) * scale)))
+            for r0, r1, c0, c1 in sorted(spans)
+        ]
+
+class TemplateStore:
+    """Templates learned from earlier documents, per sheet size, on disk
+    
+    Each entry is the (hashes, cells) pair of one learned sheet: its cell
+    hash grid and which cells were template. Lets a template be recognized
+    in a single-sheet document made from the same CAD template. Whoever
+    shares a store shares what it masks: give each user their own folder.
+    """
+    
+    def __init__(self, folder=None):
+        self.folder = folder or os.path.join(Config.TEMP_FOLDER, 'templates')
+        os.makedirs(self.folder, exist_ok=True)
+    
+    def _path(self, shape):
+        return os.path.join(self.folder, f"{shape[0]}x{shape[1]}.pkl")
+    
+    def load(self, shape):
+        """[(hashes, cells)] of the templates last learned with this grid shape"""
+        try:
+            with open(self._path(shape), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return []
+    
+    def save(self, shape, templates):
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(templates[-Config.TEMPLATE_HISTORY:], f)
+            os.replace(tmp_path, self._path(shape))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+class TemplateDetector:
+    """Finds the content repeated across sheets of a drawing package
+    
+    Pages are compared cell by cell on a low-resolution render. Inked cells
+    identical on two sheets of a document belong to the template, unless
+    the two sheets share most of their ink: then they are copies of one
+    drawing, not two drawings on one template. Templates found this way are
+    remembered and matched against later documents, whose own sheets are
+    never compared with earlier uploads: those may be revisions of the same
+    drawing. Without a store, or the shared default one that
+    Config.TEMPLATE_LEARNING enables, a document is only compared with
+    itself.
+    """
+    
+    def __init__(self, store=None):
+        if store is None and Config.TEMPLATE_LEARNING:
+            store = TemplateStore()
+        self.store = store
+    
+    @traced('detect_templates')
+    def detect(self, pdf_path):
+        """PageTemplate, or None where nothing repeats, for every page"""
+        with fitz.open(pdf_path) as doc:
+            pages = [
+                cell_hashes(page, Config.TEMPLATE_HASH_DPI, Config.TEMPLATE_CELL_SIZE)
+                for page in doc
+            ]
+        
+        cells = [np.zeros(hashes.shape, dtype=bool) for hashes, _ in pages]
+        by_shape = {}
+        for page_num, (hashes, _) in enumerate(pages):
+            by_shape.setdefault(hashes.shape, []).append(page_num)
+        
+        for shape, page_nums in by_shape.items():
+            for i, page_num in enumerate(page_nums):
+                for other_num in page_nums[i + 1:]:
+                    shared = self._shared_cells(pages[page_num], pages[other_num])
+                    if shared is not None:
+                        cells[page_num] |= shared
+                        cells[other_num] |= shared
+            if self.store is None:
+                continue
+            
+            # Learned templates of earlier documents, then remember new ones
+            history = self.store.load(shape)
+            learned = [(pages[page_num][0], cells[page_num].copy())
+                       for page_num in page_nums if cells[page_num].any()]
+            for page_num in page_nums:
+                hashes, blank = pages[page_num]
+                for known_hashes, known_cells in history:
+                    cells[page_num] |= (hashes == known_hashes) & known_cells & ~blank
+            for hashes, template_cells in learned:
+                if not any(np.array_equal(np.where(template_cells, hashes, 0),
+                                          np.where(known_cells, known_hashes, 0))
+                           for known_hashes, known_cells in history):
+                    history.append((hashes, template_cells))
+            if learned:
+                self.store.save(shape, history)
+        
+        cell_pixels = Config.TEMPLATE_CELL_SIZE * Config.DPI / Config.TEMPLATE_HASH_DPI
+        templates = []
+        for page_cells in cells:
+            if not page_cells.any():
+                templates.append(None)
+                continue
+            # Absorb single differing cells, e.g. the sheet number in a title block
+            closed = cv2.morphologyEx(
+                page_cells.astype(np.uint8), cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8)
+            )
+            templates.append(PageTemplate(closed.astype(bool), cell_pixels))
+        return templates
+    
+    @staticmethod
+    def _shared_cells(page, other):
+        """Inked cells identical on both pages, or None if they are one drawing"""
+        hashes, blank = page
+        other_hashes, other_blank = other
+        shared = (hashes == other_hashes) & ~blank & ~other_blank
+        inked = min(int((~blank).sum()), int((~other_blank).sum()))
+        count = int(shared.sum())
+        if count == 0 or count > Config.TEMPLATE_MAX_SHARED * inked:
+            return None
+        return shared
@@ -0,0 +1,53 @@
+import os
+import sys
+import cv2
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import pipeline
+from ocr_engine import OCREngine, _empty_data
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run every test in its own folder, so uploads/temp/outputs stay there"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+class BlobOCR(OCREngine):
+    """Reads every word-like group of ink blobs as one dimension
+    
+    Blobs join a word when the gap between them is below their height, so
+    the words found do not depend on the crop or its resolution. No
+    Tesseract needed.
+    """
+    
+    def image_to_data(self, img):
+        data = _empty_data()
+        _, _, stats, _ = cv2.connectedComponentsWithStats((img > 0).astype(np.uint8))
+        boxes = stats[1:, :4][stats[1:, 3] >= 4].astype(np.int64)
+        x, y, w, h = boxes.T[:, :, None]
+        gap = np.maximum(x, x.T) - np.minimum(x + w, (x + w).T)
+        overlap = np.minimum(y + h, (y + h).T) - np.maximum(y, y.T)
+        near = (gap < 0.4 * np.maximum(h, h.T)) & (overlap > 0.5 * np.minimum(h, h.T))
+        word = np.arange(len(boxes))
+        for a, b in zip(*np.nonzero(np.triu(near, 1))):
+            word[word == word[b]] = word[a]
+        for label in np.unique(word):
+            x0, y0 = boxes[word == label, :2].min(axis=0)
+            x1, y1 = (boxes[word == label, :2] + boxes[word == label, 2:]).max(axis=0)
+            if y1 - y0 >= 8:
+                data['text'].append('10.5')
+                data['conf'].append(95)
+                for name, value in (('left', x0), ('top', y0), ('width', x1 - x0),
+                                    ('height', y1 - y0)):
+                    data[name].append(int(value))
+        return data
+
+@pytest.fixture
+def blob_ocr(monkeypatch):
+    """Pages processed in this process read dimensions with BlobOCR"""
+    monkeypatch.setattr(pipeline, 'get_ocr_engine', lambda workers=None: BlobOCR(1))
@@ -0,0 +1,14 @@
+from batch_cli import document_key, run_batch
+
+def test_unreadable_document_is_recorded_as_failed(tmp_path):
+    missing = str(tmp_path / 'missing.pdf')
+    summary = run_batch([missing], str(tmp_path / 'out'), workers=1)
+    assert summary['failed'] == 1 and summary['processed'] == 0
+    assert summary['failures'][0]['path'] == missing
+
+def test_resume_key_depends_on_the_formats(tmp_path):
+    pdf_path = tmp_path / 'drawing.pdf'
+    pdf_path.write_bytes(b'%PDF')
+    key = document_key(str(pdf_path), 'ASME_Y14.5', formats=['csv', 'png'])
+    assert key == document_key(str(pdf_path), 'ASME_Y14.5', formats=['png', 'csv'])
+    assert key != document_key(str(pdf_path), 'ASME_Y14.5', formats=['csv'])
@@ -0,0 +1,53 @@
+import numpy as np
+from config import Config
+from dimension_detector import DimensionDetector
+from drawing_standards import DimensionMatcher
+from ocr_engine import OCREngine, _empty_data
+from pdf_processor import PDFProcessor
+from synthetic_drawings import format_dimension, generate_drawing
+
+class ScriptedOCR(OCREngine):
+    """Reads the same words from every image"""
+    
+    def __init__(self, texts):
+        super().__init__()
+        self.texts = texts
+    
+    def image_to_data(self, img):
+        data = _empty_data()
+        for i, text in enumerate(self.texts):
+            for key, value in zip(data, (text, 95, 10, 10 + 40 * i, 100, 30)):
+                data[key].append(value)
+        return data
+
+def test_all_jis_tokens_detect_jis():
+    matcher = DimensionMatcher()
+    texts = [format_dimension(value, 0.1, 0.1, 'JIS_B_0021') for value in (12.5, 30, 101.25)]
+    assert matcher.dominant(matcher.count_hits(matcher.classify(texts))) == 'JIS_B_0021'
+
+def test_auto_detects_jis_drawing(workdir):
+    truth = generate_drawing('jis.pdf', sheet='A4', dimensions=10, standard='JIS_B_0021')
+    processor = PDFProcessor()
+    detector = DimensionDetector('AUTO', ScriptedOCR([]))
+    text_layer = processor.extract_text_layer('jis.pdf')[0]
+    
+    dimensions = detector.detect_dimensions(None, 0, text_layer, line_segments=[])
+    assert {item['text'] for item in truth} <= {dim['text'] for dim in dimensions}
+    assert {dim['standard'] for dim in dimensions} == {'JIS_B_0021'}
+
+def test_auto_reads_whole_page_in_one_standard(monkeypatch):
+    monkeypatch.setattr(Config, 'OCR_REGION_PROPOSAL', False)
+    # One ASME word in the text layer, three DIN dimensions in a raster insert
+    words = [
+        {'text': '5.00', 'bbox': (10, 10, 50, 30), 'line': (0, 0)},
+        {'text': '±0.10', 'bbox': (55, 10, 100, 30), 'line': (0, 0)}
+    ]
+    text_layer = {'words': words, 'raster_regions': [(0, 100, 300, 200)]}
+    ocr = ScriptedOCR([format_dimension(value, 0.1, 0.05, 'DIN_406') for value in (1, 2, 3)])
+    detector = DimensionDetector('AUTO', ocr)
+    
+    img = np.zeros((300, 300), dtype=np.uint8)
+    dimensions = detector.detect_dimensions(img, 0, text_layer, line_segments=[])
+    assert {dim['standard'] for dim in dimensions} == {'DIN_406'}
+    assert len(dimensions) == 4  # The ASME token's value still counts as a dimension
+    assert all('matches' not in dim for dim in dimensions)
@@ -0,0 +1,26 @@
+import threading
+from instrumentation import tracer
+
+def test_recording_is_per_thread():
+    other = {}
+    entered, done = threading.Event(), threading.Event()
+    
+    def other_session():
+        entered.wait()
+        other['enabled'] = tracer.enabled
+        with tracer.stage('other'):
+            pass
+        other['records'] = list(tracer.records)
+        done.set()
+    
+    thread = threading.Thread(target=other_session)
+    thread.start()
+    with tracer.recording() as records:
+        with tracer.stage('mine'):
+            entered.set()
+            done.wait()
+    thread.join()
+    
+    assert [record['name'] for record in records] == ['mine']
+    assert other == {'enabled': False, 'records': []}
+    assert not tracer.enabled
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import time
+import pytest
+from config import Config
+from job_service import Job, JobService
+
+@pytest.fixture
+def service():
+    service = JobService(workers=1)
+    yield service
+    service.close()
+
+def add_job(service, state, finished=None):
+    job_id = f"job{len(service.jobs)}"
+    folder = os.path.join(Config.OUTPUT_FOLDER, 'jobs', job_id)
+    os.makedirs(folder)
+    pdf_path = os.path.join(Config.UPLOAD_FOLDER, f"{job_id}.pdf")
+    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+    with open(pdf_path, 'wb') as f:
+        f.write(b'%PDF')
+    job = Job(id=job_id, name='drawing.pdf', user='anonymous', priority=0, standard='AUTO',
+              pdf_path=pdf_path, pdf_hash='', folder=folder, page_count=1,
+              seq=len(service.jobs), templates=[None], state=state, finished=finished)
+    service.jobs[job_id] = job
+    return job
+
+def test_prune_drops_expired_and_surplus_finished_jobs(service, monkeypatch):
+    monkeypatch.setattr(Config, 'JOB_RETENTION', 100)
+    monkeypatch.setattr(Config, 'JOB_MAX_FINISHED', 2)
+    now = time.time()
+    running = add_job(service, 'running')
+    expired = add_job(service, 'failed', now - 200)
+    oldest = add_job(service, 'done', now - 30)
+    recent = [add_job(service, 'done', now - 20), add_job(service, 'cancelled', now - 10)]
+    
+    service.prune()
+    
+    assert set(service.jobs) == {running.id} | {job.id for job in recent}
+    for job in (expired, oldest):
+        assert not os.path.exists(job.pdf_path)
+        assert not os.path.exists(job.folder)
+    assert os.path.exists(running.pdf_path)
+
+def test_delete_cancels_active_jobs_and_forgets_finished_ones(service):
+    running = add_job(service, 'queued')
+    done = add_job(service, 'done', time.time())
+    
+    status, payload = asyncio.run(service._route('DELETE', f"/jobs/{running.id}", {}, b''))
+    assert status == 200 and payload['state'] == 'cancelled'
+    assert running.id in service.jobs and not os.path.exists(running.pdf_path)
+    
+    status, payload = asyncio.run(service._route('DELETE', f"/jobs/{done.id}", {}, b''))
+    assert status == 200 and payload['state'] == 'done'
+    assert done.id not in service.jobs
+    assert not os.path.exists(done.pdf_path) and not os.path.exists(done.folder)
+
+def test_service_leaves_config_alone(service):
+    assert Config.RASTER_BALLOONS and Config.PREVIEW_PYRAMID
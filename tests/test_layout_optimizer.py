@@ -0,0 +1,28 @@
+import numpy as np
+from config import Config
+from layout_optimizer import LayoutOptimizer
+
+def grid_dimensions(rows, cols, step):
+    return [{'coords': (100 + col * step, 100 + row * step, 40, 12)}
+            for row in range(rows) for col in range(cols)]
+
+def min_spacing(positions):
+    points = np.array(positions, dtype=np.float64)
+    distances = np.hypot(*(points[:, None] - points[None, :]).transpose(2, 0, 1))
+    np.fill_diagonal(distances, np.inf)
+    return distances.min()
+
+def test_spent_budget_still_places_every_balloon_apart():
+    dimensions = grid_dimensions(4, 4, 300)
+    optimizer = LayoutOptimizer(2000, 2000, time_budget=1e-9)
+    positions = optimizer.layout(dimensions)
+    assert len(positions) == len(dimensions)
+    assert min_spacing(positions) >= optimizer.spacing - 1
+
+def test_fallback_looks_past_the_regular_rings(monkeypatch):
+    # Rings too few for dimensions this close to all get a clear candidate
+    monkeypatch.setattr(Config, 'LAYOUT_RINGS', 1)
+    dimensions = grid_dimensions(3, 3, 60)
+    optimizer = LayoutOptimizer(3000, 3000)
+    positions = optimizer.layout(dimensions)
+    assert min_spacing(positions) >= optimizer.spacing - 1
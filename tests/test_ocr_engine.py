@@ -0,0 +1,12 @@
+import logging
+import ocr_engine
+
+def test_falling_back_to_pytesseract_is_logged(monkeypatch, caplog):
+    monkeypatch.setattr(ocr_engine, 'tesserocr', None)
+    monkeypatch.setattr(ocr_engine, '_engines', {})
+    with caplog.at_level(logging.INFO, logger='ocr_engine'):
+        engine = ocr_engine.get_ocr_engine(workers=1, backend='auto')
+    assert isinstance(engine, ocr_engine.PytesseractEngine)
+    assert [record.levelno for record in caplog.records] == [logging.WARNING]
+    assert 'tesserocr' in caplog.records[0].getMessage()
+    engine.close()
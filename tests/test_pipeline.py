@@ -0,0 +1,89 @@
+import numpy as np
+from config import Config
+from pipeline import PagePipeline
+from result_cache import ResultCache
+from synthetic_drawings import generate_drawing
+from template_mask import TemplateDetector
+
+def run_pages(pdf_path, **options):
+    pipeline = PagePipeline(workers=1, **options)
+    try:
+        return list(pipeline.run(pdf_path))
+    finally:
+        pipeline.close()
+
+def test_page_settings_override_config_for_one_pipeline(workdir):
+    generate_drawing('drawing.pdf', sheet='A4', dimensions=5)
+    cache = ResultCache(str(workdir / 'cache'))
+    
+    plain, = run_pages('drawing.pdf', cache=cache, raster_balloons=False, preview_pyramid=False)
+    assert not plain.has('ballooned') and not plain.pyramids
+    assert Config.RASTER_BALLOONS and Config.PREVIEW_PYRAMID
+    
+    # Not served the plain page from the cache
+    full, = run_pages('drawing.pdf', cache=cache)
+    assert full.has('ballooned') and full.pyramids
+
+def test_coarse_to_fine_finds_the_same_dimension_boxes(blob_ocr, monkeypatch):
+    monkeypatch.setattr(Config, 'TEMPLATE_MASKING', False)
+    truth = generate_drawing('raster.pdf', sheet='A4', dimensions=12, raster=True)
+    
+    full, = run_pages('raster.pdf', coarse_to_fine=False)
+    coarse, = run_pages('raster.pdf', coarse_to_fine=True)
+    assert coarse.scale == Config.ANALYSIS_DPI / Config.DPI and full.scale == 1
+    
+    # Whatever the full path reads of a dimension, coarse to fine reads too;
+    # words may be split differently, so their extent is compared
+    found = 0
+    for dim in truth:
+        x0, y0, x1, y1 = np.array(dim['rect']) * Config.DPI / 72
+        margin = y1 - y0
+        extents = []
+        for result in (full, coarse):
+            boxes = np.array([
+                (x, y, x + w, y + h) for x, y, w, h in
+                (other['coords'] for other in result.dimensions)
+                if x0 - margin <= x + w / 2 < x1 + margin and y0 <= y + h / 2 < y1
+            ]).reshape(-1, 4)
+            extents.append(
+                np.r_[boxes[:, :2].min(axis=0), boxes[:, 2:].max(axis=0)] if len(boxes) else None
+            )
+        if extents[0] is not None:
+            found += 1
+            assert extents[1] is not None and np.abs(extents[0] - extents[1]).max() <= 4
+    assert found >= len(truth) - 2
+
+def test_results_of_a_run_survive_eviction(workdir, monkeypatch):
+    monkeypatch.setattr(Config, 'SPILL_PAGES', True)
+    generate_drawing('drawing.pdf', sheet='A4', dimensions=3, pages=3)
+    # Too small for a single page: every eviction empties it
+    cache = ResultCache(str(workdir / 'cache'), max_bytes=1)
+    
+    for run in range(2):
+        results = run_pages('drawing.pdf', cache=cache)
+        assert all(result.is_available() for result in results)
+
+def test_inline_runs_do_not_share_state(blob_ocr, monkeypatch):
+    monkeypatch.setattr(Config, 'TEMPLATE_MASKING', False)
+    generate_drawing('raster.pdf', sheet='A4', dimensions=5, raster=True, pages=2)
+    
+    full = PagePipeline('ASME_Y14.5', workers=1, coarse_to_fine=False).run('raster.pdf')
+    first = next(full)
+    # Another session's run in between, as on a Streamlit server
+    run_pages('raster.pdf', standard='ISO_1101', coarse_to_fine=True)
+    second = next(full)
+    
+    for result in (first, second):
+        assert result.scale == 1
+        assert {dim['standard'] for dim in result.dimensions} <= {'ASME_Y14.5'}
+
+def test_cached_rerun_skips_template_detection(workdir, monkeypatch):
+    generate_drawing('drawing.pdf', sheet='A4', dimensions=3, pages=2)
+    cache = ResultCache(str(workdir / 'cache'))
+    first = run_pages('drawing.pdf', cache=cache)
+    
+    def detect(self, pdf_path):
+        raise AssertionError("templates detected again")
+    monkeypatch.setattr(TemplateDetector, 'detect', detect)
+    again = run_pages('drawing.pdf', cache=cache)
+    assert [len(result.balloons) for result in again] == [len(result.balloons) for result in first]
@@ -0,0 +1,16 @@
+import os
+import pytest
+from result_cache import ResultCache
+
+@pytest.mark.parametrize('data', [
+    b"cno_such_module\nThing\n.",  # Module since removed
+    b"cos\nno_such_attribute\n.",  # Class since renamed
+    b"\x80\x04\x95",  # Truncated
+])
+def test_unloadable_entry_is_a_miss_and_removed(tmp_path, data):
+    cache = ResultCache(folder=str(tmp_path))
+    cache.put('key', 1)
+    with open(cache._path('key'), 'wb') as f:
+        f.write(data)
+    assert cache.get('key') is None
+    assert not os.path.exists(cache._path('key'))
@@ -0,0 +1,31 @@
+from result_cache import ResultCache
+from revision import RevisionPipeline, RevisionStore
+from synthetic_drawings import generate_drawing
+from instrumentation import tracer
+
+def test_revision_pages_come_with_hits_and_cached_previews(workdir):
+    generate_drawing('drawing.pdf', sheet='A4', dimensions=8, pages=2)
+    revision = RevisionPipeline(
+        'AUTO', store=RevisionStore(str(workdir / 'revisions')),
+        cache=ResultCache(str(workdir / 'cache'))
+    )
+    result = revision.run('drawing.pdf', 'D-100')
+    assert not revision.detector.hits
+    assert [page.page_num for page in result.pages] == [0, 1]
+    assert all(sum(page.standard_hits.values()) for page in result.pages)
+    
+    pages = list(revision.previews('drawing.pdf', result))
+    assert all(page.has('ballooned') and page.balloons for page in pages)
+    
+    # Unchanged revision: same balloons, previews straight from the cache
+    again = revision.run('drawing.pdf', 'D-100')
+    assert again.pages_reprocessed == 0
+    assert [page.standard_hits for page in again.pages] == [page.standard_hits for page in pages]
+    tracer.enable()
+    try:
+        start = len(tracer.records)
+        cached = list(revision.previews('drawing.pdf', again))
+        assert 'preview_page' not in {record['name'] for record in tracer.drain(start)}
+    finally:
+        tracer.enable(False)
+    assert [len(page.balloons) for page in cached] == [len(page.balloons) for page in pages]
@@ -0,0 +1,50 @@
+import numpy as np
+from config import Config
+from pipeline import PagePipeline
+from synthetic_drawings import generate_drawing
+from template_mask import PageTemplate, TemplateDetector, TemplateStore
+
+def test_boxes_cover_exactly_the_template_cells():
+    cells = np.zeros((6, 8), dtype=bool)
+    cells[0, :] = cells[-1, :] = cells[:, 0] = cells[:, -1] = True  # Border ring
+    cells[3:5, 4:7] = True  # Title block
+    template = PageTemplate(cells, 10)
+    
+    covered = np.zeros((60, 80), dtype=bool)
+    for x, y, w, h in template.boxes():
+        covered[y:y + h, x:x + w] = True
+    assert np.array_equal(covered[::10, ::10], cells)
+
+def test_bordered_sheets_keep_balloons_next_to_their_dimensions(workdir, monkeypatch):
+    monkeypatch.setattr(Config, 'TEMPLATE_MASKING', True)
+    generate_drawing('sheets.pdf', sheet='A3', dimensions=30, pages=3)
+    templates = TemplateDetector(TemplateStore(str(workdir / 'templates'))).detect('sheets.pdf')
+    assert all(template is not None for template in templates)
+    
+    pipeline = PagePipeline(workers=1)
+    try:
+        results = list(pipeline.run('sheets.pdf'))
+    finally:
+        pipeline.close()
+    
+    distances = []
+    for result, template in zip(results, templates):
+        assert result.balloons
+        for balloon in result.balloons:
+            x, y, w, h = balloon.dimension['coords']
+            distances.append(np.hypot(balloon.position[0] - x - w / 2,
+                                      balloon.position[1] - y - h / 2))
+            assert not template.covers(*balloon.position)
+    assert np.mean(distances) < 100
+
+def test_learned_templates_stay_in_their_store(workdir):
+    generate_drawing('package.pdf', sheet='A3', dimensions=10, pages=3)
+    generate_drawing('single.pdf', sheet='A3', dimensions=10, pages=1, seed=1)
+    
+    # Learning is opt-in: by default documents never mask each other
+    TemplateDetector().detect('package.pdf')
+    assert TemplateDetector().detect('single.pdf') == [None]
+    
+    TemplateDetector(TemplateStore(str(workdir / 'a'))).detect('package.pdf')
+    assert TemplateDetector(TemplateStore(str(workdir / 'b'))).detect('single.pdf') == [None]
+    assert TemplateDetector(TemplateStore(str(workdir / 'a'))).detect('single.pdf')[0] is not None
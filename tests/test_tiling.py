@@ -0,0 +1,71 @@
+import fitz  # PyMuPDF
+import pytest
+from config import Config
+from pipeline import PagePipeline
+from synthetic_drawings import generate_drawing
+from tiling import TileGrid
+
+@pytest.fixture
+def small_tiles(blob_ocr, monkeypatch):
+    """Tile every page in 1024 pixel tiles, reading text and lines from pixels
+    
+    Scanned pages are not used: MuPDF resamples an image slightly
+    differently when only part of it is rendered, so their tiles cannot
+    match the whole page to the pixel.
+    """
+    monkeypatch.setattr(Config, 'TEMPLATE_MASKING', False)
+    monkeypatch.setattr(Config, 'USE_TEXT_LAYER', False)
+    monkeypatch.setattr(Config, 'USE_VECTOR_GEOMETRY', False)
+    monkeypatch.setattr(Config, 'LAYOUT_MODE', 'greedy')
+    monkeypatch.setattr(Config, 'TILED_MIN_PIXELS', 0)
+    monkeypatch.setattr(Config, 'TILE_SIZE', 1024)
+
+def run_page(pdf_path, tiled, monkeypatch, **options):
+    monkeypatch.setattr(Config, 'TILED_PROCESSING', tiled)
+    pipeline = PagePipeline(workers=1, **options)
+    try:
+        result, = pipeline.run(pdf_path)
+        # Tiled page images only exist in the pipeline's spill folder
+        ballooned = result.load('ballooned') if result.has('ballooned') else None
+    finally:
+        pipeline.close()
+    return result, ballooned
+
+def detections(result):
+    return (
+        [(dim['text'], tuple(dim['coords'])) for dim in result.dimensions],
+        [(balloon.id, tuple(balloon.position)) for balloon in result.balloons]
+    )
+
+def test_tiled_page_matches_whole_page(small_tiles, monkeypatch):
+    generate_drawing('drawing.pdf', sheet='A4', dimensions=12)
+    with fitz.open('drawing.pdf') as doc:
+        assert len(TileGrid.for_page(doc[0]).tiles) > 4
+    
+    whole, _ = run_page('drawing.pdf', False, monkeypatch)
+    tiled, _ = run_page('drawing.pdf', True, monkeypatch)
+    assert len(whole.dimensions) >= 12
+    assert detections(tiled) == detections(whole)
+    assert tiled.pyramids['ballooned'].shapes == whole.pyramids['ballooned'].shapes
+
+def test_tiled_page_without_previews_keeps_the_ballooned_page(small_tiles, monkeypatch):
+    generate_drawing('drawing.pdf', sheet='A4', dimensions=12)
+    
+    _, full = run_page('drawing.pdf', True, monkeypatch)
+    plain, ballooned = run_page('drawing.pdf', True, monkeypatch, preview_pyramid=False)
+    assert set(plain.pyramids) == {'ballooned'}
+    assert len(plain.pyramids['ballooned'].shapes) == 1
+    assert (ballooned == full).all()
+
+def test_text_straddling_a_seam_is_read_once_and_whole(small_tiles, monkeypatch):
+    # One dimension centered on the seam between the first two tile columns
+    seam = 1024 * 72 / Config.DPI
+    with fitz.open() as doc:
+        doc.new_page(width=595, height=842).insert_text((seam - 15, 200), "25.40", fontsize=14)
+        doc.save('seam.pdf')
+    
+    whole, _ = run_page('seam.pdf', False, monkeypatch)
+    tiled, _ = run_page('seam.pdf', True, monkeypatch)
+    (_, (x, _, w, _)), = detections(whole)[0]
+    assert x < 1024 < x + w
+    assert detections(tiled) == detections(whole)
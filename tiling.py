@@ -0,0 +1,143 @@
+from dataclasses import dataclass
+import fitz  # PyMuPDF
+import numpy as np
+from config import Config
+from image_pyramid import ImagePyramid
+from instrumentation import traced
+
+@dataclass
+class Tile:
+    """One tile of an oversized page, in page pixels at Config.DPI"""
+    row: int
+    col: int
+    core: tuple  # (x, y, w, h) area the tile owns
+    box: tuple  # (x, y, w, h) area rendered: the core and the overlap around it
+    
+    def owns(self, x, y):
+        """Whether page pixel (x, y) lies in the core; accepts arrays"""
+        x0, y0, w, h = self.core
+        return (x >= x0) & (x < x0 + w) & (y >= y0) & (y < y0 + h)
+    
+    def local_regions(self, regions):
+        """Parts of (x, y, w, h) page boxes inside the rendered area, in tile pixels"""
+        bx, by, bw, bh = self.box
+        local = []
+        for x, y, w, h in regions:
+            x0, y0 = max(x, bx), max(y, by)
+            x1, y1 = min(x + w, bx + bw), min(y + h, by + bh)
+            if x1 > x0 and y1 > y0:
+                local.append((x0 - bx, y0 - by, x1 - x0, y1 - y0))
+        return local
+
+def page_pixels(page, dpi=None):
+    """(width, height) of a page rendered at dpi, by default Config.DPI"""
+    zoom = (dpi or Config.DPI) / 72
+    rect = (page.rect * fitz.Matrix(zoom, zoom)).irect
+    return rect.width, rect.height
+
+class TileGrid:
+    """Overlapping tiles covering a page too large to render whole
+    
+    Each tile renders its core plus Config.TILE_OVERLAP pixels around it,
+    so text crossing a seam is read whole by at least one tile. A detection
+    belongs to the tile whose core holds its center, which keeps detections
+    in the overlap of two tiles exactly once. Cores are
+    Config.PREVIEW_TILE_SIZE times a power of two, so every tile also cuts
+    its own share of the page's preview pyramid levels.
+    """
+    
+    def __init__(self, width, height):
+        preview = Config.PREVIEW_TILE_SIZE
+        # Halvings after which a core is a single preview tile
+        core_levels = max(0, (Config.TILE_SIZE // preview).bit_length() - 1)
+        self.size = preview << core_levels
+        self.width, self.height = width, height
+        
+        # Preview pyramid levels, as ImagePyramid.build would make them
+        self.shapes = [(height, width)]
+        while max(self.shapes[-1]) > Config.PREVIEW_THUMBNAIL_SIZE:
+            level_h, level_w = self.shapes[-1]
+            self.shapes.append(((level_h + 1) // 2, (level_w + 1) // 2))
+        self.tile_levels = min(core_levels + 1, len(self.shapes))  # Levels cut per tile
+        
+        overlap = Config.TILE_OVERLAP
+        self.tiles = []
+        for row in range(-(-height // self.size)):
+            for col in range(-(-width // self.size)):
+                x, y = col * self.size, row * self.size
+                w, h = min(self.size, width - x), min(self.size, height - y)
+                x0, y0 = max(0, x - overlap), max(0, y - overlap)
+                x1, y1 = min(width, x + w + overlap), min(height, y + h + overlap)
+                self.tiles.append(Tile(row, col, (x, y, w, h), (x0, y0, x1 - x0, y1 - y0)))
+    
+    @classmethod
+    def for_page(cls, page, coarse_to_fine=None):
+        """Grid of a page larger than Config.TILED_MIN_PIXELS, else None
+        
+        Coarse to fine (Config.COARSE_TO_FINE unless given) the page is only
+        rendered whole at Config.ANALYSIS_DPI, so that is the size compared.
+        """
+        if not Config.TILED_PROCESSING:
+            return None
+        if coarse_to_fine is None:
+            coarse_to_fine = Config.COARSE_TO_FINE
+        analysis_dpi = Config.ANALYSIS_DPI if coarse_to_fine else None
+        analysis_w, analysis_h = page_pixels(page, analysis_dpi)
+        if analysis_w * analysis_h <= Config.TILED_MIN_PIXELS:
+            return None
+        return cls(*page_pixels(page))
+    
+    @property
+    def continues(self):
+        """Whether the pyramid has levels above those cut per tile"""
+        return self.tile_levels < len(self.shapes)
+    
+    def _levels(self, levels):
+        return self.tile_levels if levels is None else min(levels, self.tile_levels)
+    
+    def _continues(self, levels):
+        return levels == self.tile_levels and self.continues
+    
+    @traced('build_pyramids')
+    def cut_pyramid(self, tile, img, prefix, levels=None, compression=None):
+        """Preview pyramid tiles of a tile's core image, written under prefix
+        
+        Returns the {(level, row, col): path} tiles of the levels cut per
+        tile and, if the pyramid continues, the core at the last of them.
+        levels cuts fewer, e.g. 1 for the full-resolution image alone, and
+        then the pyramid ends there. compression is the PNG compression
+        level (see ImagePyramid.add_tiles).
+        """
+        levels = self._levels(levels)
+        part = ImagePyramid([], {}, Config.PREVIEW_TILE_SIZE)
+        for level in range(levels):
+            if level:
+                img = ImagePyramid.halve(img)
+            # Preview tiles along a core edge at this level
+            step = (self.size >> level) // Config.PREVIEW_TILE_SIZE
+            part.add_tiles(img, level, prefix, tile.row * step, tile.col * step, compression)
+        return part.tiles, img if self._continues(levels) else None
+    
+    def pyramid(self, parts, prefix, levels=None):
+        """Assemble a page's ImagePyramid from the (tile, tiles, top) parts
+        
+        Levels above those cut per tile are built from the stitched tops,
+        which are at most a Config.PREVIEW_TILE_SIZE square per tile.
+        levels is as given to cut_pyramid.
+        """
+        levels = self._levels(levels)
+        pyramid = ImagePyramid(self.shapes[:levels], {}, Config.PREVIEW_TILE_SIZE)
+        for _, tiles, _ in parts:
+            pyramid.tiles.update(tiles)
+        if not self._continues(levels):
+            return pyramid
+        
+        step = Config.PREVIEW_TILE_SIZE
+        top = None
+        for tile, _, img in parts:
+            if top is None:
+                top = np.empty(self.shapes[self.tile_levels - 1] + img.shape[2:], img.dtype)
+            y, x = tile.row * step, tile.col * step
+            top[y:y + img.shape[0], x:x + img.shape[1]] = img
+        pyramid.extend(ImagePyramid.halve(top), prefix)
+        return pyramid